@@ -3,13 +3,16 @@ Command-line script to convert a .gct file to .gctx.
 
 Main method takes in a .gct file path (and, optionally, an 
 	out path and/or name to which to save the equivalent .gctx)
-	and saves the enclosed content to a .gctx file. 
+	and saves the enclosed content to a .gctx file. The .gct file is
+	converted one block of rows at a time (see parse_gct.iterate), so it
+	does not need to fit in memory.
 
 Note: Only supports v1.3 .gct files. 
 """
 import sys
 import logging
 import argparse
+import itertools
 import os.path
 import pandas as pd
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
@@ -36,6 +39,9 @@ def build_parser():
                         help="Whether to print a bunch of output.", action="store_true", default=False)
     parser.add_argument("-row_annot_path", help="Path to annotations file for rows")
     parser.add_argument("-col_annot_path", help="Path to annotations file for columns")
+    parser.add_argument("-block_size", type=int, default=None,
+                        help=("number of rows to convert at a time. " +
+                              "Default is about 2 million values per block"))
     return parser
 
 
@@ -48,32 +54,49 @@ def main():
 def gct2gctx_main(args):
     """ Separate from main() in order to make command-line tool. """
 
-    in_gctoo = parse_gct.parse(args.filename, convert_neg_666=False)
-
     if args.output_filepath is None:
         basename = os.path.basename(args.filename)
         out_name = os.path.splitext(basename)[0] + ".gctx"
     else:
         out_name = args.output_filepath
 
-    """ If annotations are supplied, parse table and set metadata_df """
-    if args.row_annot_path is None:
-        pass
-    else:
+    """ If annotations are supplied, parse table """
+    row_metadata = None
+    if args.row_annot_path is not None:
         row_metadata = pd.read_csv(args.row_annot_path, sep='\t', index_col=0, header=0, low_memory=False)
-        assert all(in_gctoo.data_df.index.isin(row_metadata.index)), \
-            "Row ids in matrix missing from annotations file"
-        in_gctoo.row_metadata_df = row_metadata.loc[row_metadata.index.isin(in_gctoo.data_df.index)]
 
-    if args.col_annot_path is None:
-        pass
-    else:
+    col_metadata = None
+    if args.col_annot_path is not None:
         col_metadata = pd.read_csv(args.col_annot_path, sep='\t', index_col=0, header=0, low_memory=False)
-        assert all(in_gctoo.data_df.columns.isin(col_metadata.index)), \
-            "Column ids in matrix missing from annotations file"
-        in_gctoo.col_metadata_df = col_metadata.loc[col_metadata.index.isin(in_gctoo.data_df.columns)]
 
-    write_gctx.write(in_gctoo, out_name)
+    """ Convert one block of rows at a time, so that the matrix is never held in memory in full;
+    row metadata is written as text, as its type cannot be told from one block """
+    blocks = parse_gct.iterate(args.filename, block_size=args.block_size, convert_neg_666=False,
+                               convert_row_metadata=False)
+    first_block = next(blocks, None)
+    if first_block is None:
+        # no data rows to stream
+        in_gctoo = parse_gct.parse(args.filename, convert_neg_666=False)
+        in_gctoo.col_metadata_df = annotate(in_gctoo.col_metadata_df, col_metadata, "Column")
+        write_gctx.write(in_gctoo, out_name)
+        return
+
+    block_col_metadata = annotate(first_block.col_metadata_df, col_metadata, "Column")
+    with write_gctx.GCTXWriter(out_name, col_metadata_df=block_col_metadata, src=first_block.src) as writer:
+        for block in itertools.chain([first_block], blocks):
+            writer.append_rows(block.data_df, annotate(block.row_metadata_df, row_metadata, "Row"))
+
+
+def annotate(metadata_df, annotations, dim_label):
+    """
+    Returns the rows of annotations for the ids of metadata_df, or metadata_df itself
+    if annotations is None.
+    """
+    if annotations is None:
+        return metadata_df
+    assert all(metadata_df.index.isin(annotations.index)), \
+        "{} ids in matrix missing from annotations file".format(dim_label)
+    return annotations.loc[metadata_df.index]
 
 
 if __name__ == "__main__":
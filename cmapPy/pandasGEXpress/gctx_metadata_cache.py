@@ -0,0 +1,157 @@
+"""
+gctx_metadata_cache.py
+
+Opt-in on-disk cache of parsed gctx row / column metadata. Parsing metadata
+(reading every field, converting to str, then back to numeric) dominates the
+cost of taking a small slice of a large gctx, so repeated parses of the same
+file can instead load the already-parsed DataFrames from a cache directory.
+
+Entries are keyed by the gctx file's path, size and modification time (plus the
+parse options), so a rewritten file is never served stale metadata. The cache
+directory is bounded in size; the least recently used entries are evicted first.
+
+ex:
+    cache = gctx_metadata_cache.MetadataCache("~/.cmapPy_metadata_cache")
+    my_gctoo = parse_gctx.parse("my_big_file.gctx", cid=my_cids, metadata_cache=cache)
+"""
+import logging
+import os
+import time
+import hashlib
+import pandas as pd
+import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
+
+__author__ = "Oana Enache"
+__email__ = "oana@broadinstitute.org"
+
+logger = logging.getLogger(setup_logger.LOGGER_NAME)
+
+# bump when the way metadata is parsed changes, to invalidate existing entries
+cache_format_version = 1
+cache_file_suffix = ".meta.pkl"
+temp_file_marker = cache_file_suffix + ".tmp"
+# temp files older than this were left behind by a process that died mid-put
+stale_temp_seconds = 60 * 60
+default_max_bytes = 1024 * 1024 * 1024
+
+
+class MetadataCache(object):
+    """Directory of pickled metadata DataFrames, evicted least-recently-used first."""
+    def __init__(self, cache_dir, max_bytes=default_max_bytes):
+        """
+        Input:
+            - cache_dir (str): directory to store cached metadata in; created if needed
+            - max_bytes (int): total size the cache directory is kept under. Default = 1 GB.
+        """
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get(self, gctx_file_path, dim, **parse_options):
+        """
+        Returns the cached metadata DataFrame for this file, or None if there is none.
+
+        Input:
+            - gctx_file_path (str): path to gctx file the metadata was parsed from
+            - dim (str): "row" or "col"
+            - parse_options: options the metadata was parsed with, e.g. convert_neg_666
+        """
+        entry_path = self.entry_path(gctx_file_path, dim, parse_options)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            meta_df = pd.read_pickle(entry_path)
+        except Exception as e:
+            # a missing entry was evicted by another process since the exists check
+            if os.path.exists(entry_path):
+                logger.warning("could not read metadata cache entry {}, ignoring it: {}".format(entry_path, e))
+            return None
+        # mark as recently used for eviction purposes; another process may have evicted it meanwhile
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        logger.debug("metadata cache hit - dim:  {}  entry_path:  {}".format(dim, entry_path))
+        return meta_df
+
+    def put(self, gctx_file_path, dim, meta_df, **parse_options):
+        """
+        Stores meta_df for this file, then evicts old entries if the cache is too large.
+        Failures to write are logged and otherwise ignored.
+        """
+        entry_path = self.entry_path(gctx_file_path, dim, parse_options)
+        temp_path = entry_path + ".tmp{}".format(os.getpid())
+        try:
+            meta_df.to_pickle(temp_path)
+            os.rename(temp_path, entry_path)
+        except (IOError, OSError) as e:
+            logger.warning("could not write metadata cache entry {}: {}".format(entry_path, e))
+            remove_if_present(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache is under max_bytes, along with
+        temp files left behind by puts that never finished. Entries removed by another
+        process in the meantime are skipped.
+        """
+        now = time.time()
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, fname)
+            if fname.endswith(cache_file_suffix):
+                try:
+                    entry_stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, fname))
+            elif temp_file_marker in fname:
+                try:
+                    is_stale = now - os.stat(path).st_mtime > stale_temp_seconds
+                except OSError:
+                    continue
+                if is_stale:
+                    logger.debug("removing stale metadata cache temp file:  {}".format(fname))
+                    remove_if_present(path)
+
+        total_bytes = sum([size for (_, size, _) in entries])
+        for (_, size, fname) in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            logger.debug("evicting metadata cache entry:  {}".format(fname))
+            remove_if_present(os.path.join(self.cache_dir, fname))
+            total_bytes -= size
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith(cache_file_suffix) or temp_file_marker in fname:
+                remove_if_present(os.path.join(self.cache_dir, fname))
+
+    def entry_path(self, gctx_file_path, dim, parse_options):
+        full_path = os.path.abspath(os.path.expanduser(gctx_file_path))
+        file_stat = os.stat(full_path)
+        # nanoseconds: a float st_mtime cannot tell apart writes less than ~0.2 us apart (Python 2 has no st_mtime_ns)
+        mtime = getattr(file_stat, "st_mtime_ns", repr(file_stat.st_mtime))
+        key_fields = [cache_format_version, pd.__version__, full_path, file_stat.st_size,
+                      mtime, dim, sorted(parse_options.items())]
+        key = hashlib.sha1(repr(key_fields).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + "." + dim + cache_file_suffix)
+
+
+def remove_if_present(path):
+    """Removes path, treating it already being gone (e.g. removed by another process) as success."""
+    try:
+        os.remove(path)
+    except OSError:
+        if os.path.exists(path):
+            raise
+
+
+def get_metadata_cache(metadata_cache):
+    """Accepts either a MetadataCache, a cache directory path or None."""
+    if metadata_cache is None or isinstance(metadata_cache, MetadataCache):
+        return metadata_cache
+    return MetadataCache(metadata_cache)
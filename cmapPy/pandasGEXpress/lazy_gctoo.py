@@ -0,0 +1,246 @@
+"""
+lazy_gctoo.py
+
+Parses a .gctx file into a LazyGCToo: the row and column metadata are read
+eagerly, but the h5py handle is kept open and the data matrix is only read
+from /0/DATA/0/matrix when data_df -- or a .loc/.iloc slice of it -- is
+actually used. Slicing reads only the requested rows and columns.
+
+ex:
+    import cmapPy.pandasGEXpress.lazy_gctoo as lazy_gctoo
+    with lazy_gctoo.parse("my_big_file.gctx") as lazy_gct:
+        dmso_cids = lazy_gct.col_metadata_df.index[lazy_gct.col_metadata_df.pert_iname == "DMSO"]
+        dmso_df = lazy_gct.data_df.loc[:, dmso_cids]
+
+"""
+import logging
+import os
+import numpy as np
+import pandas as pd
+import h5py
+import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.gctx_metadata_cache as gctx_metadata_cache
+
+__author__ = "Oana Enache"
+__email__ = "oana@broadinstitute.org"
+
+logger = logging.getLogger(setup_logger.LOGGER_NAME)
+
+
+def parse(gctx_file_path, convert_neg_666=True, rid=None, cid=None, ridx=None, cidx=None,
+          metadata_cache=None, row_fields=None, col_fields=None):
+    """
+    Reads the metadata of a gctx file and returns a LazyGCToo whose data_df is
+    read from disk on demand.
+
+    Input:
+        Mandatory:
+        - gctx_file_path (str): full path to gctx file you want to parse.
+
+        Optional:
+        - convert_neg_666 (bool): whether to convert -666 values to numpy.nan or not.
+            Default = True.
+        - rid (list of strings): list of row ids to restrict the LazyGCToo to. Default=None.
+        - cid (list of strings): list of col ids to restrict the LazyGCToo to. Default=None.
+        - ridx (list of integers): list of row indexes to restrict the LazyGCToo to. Default=None.
+        - cidx (list of integers): list of col indexes to restrict the LazyGCToo to. Default=None.
+        - metadata_cache (MetadataCache or str): see parse_gctx.parse. Default = None.
+        - row_fields (list of strings): see parse_gctx.parse. Default = None.
+        - col_fields (list of strings): see parse_gctx.parse. Default = None.
+
+    Output:
+        - lazy_gctoo (LazyGCToo): keeps the gctx file open until lazy_gctoo.close()
+            is called (or the with block it is used in exits).
+    """
+    full_path = os.path.expanduser(gctx_file_path)
+
+    # Verify that the  path exists
+    if not os.path.exists(full_path):
+        err_msg = "The given path to the gctx file cannot be found. full_path: {}"
+        logger.error(err_msg.format(full_path))
+        raise Exception(err_msg.format(full_path))
+    logger.info("Lazily reading GCTX: {}".format(full_path))
+
+    metadata_cache = gctx_metadata_cache.get_metadata_cache(metadata_cache)
+
+    gctx_file = h5py.File(full_path, "r")
+
+    (rid, ridx) = parse_gctx.lookup_ids_with_index(gctx_file, "row", rid, ridx)
+    (cid, cidx) = parse_gctx.lookup_ids_with_index(gctx_file, "col", cid, cidx)
+
+    # if subsetting by index, only read the metadata of the selected entries
+    (row_read_idx, ridx) = parse_gctx.get_metadata_read_idx(gctx_file, "row", ridx, None)
+    (col_read_idx, cidx) = parse_gctx.get_metadata_read_idx(gctx_file, "col", cidx, None)
+
+    row_meta = parse_gctx.read_metadata(gctx_file, "row", convert_neg_666, metadata_cache, row_fields, row_read_idx)
+    col_meta = parse_gctx.read_metadata(gctx_file, "col", convert_neg_666, metadata_cache, col_fields, col_read_idx)
+
+    (sorted_ridx, sorted_cidx) = parse_gctx.check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta, col_meta,
+                                                                      sort_row_meta=True, sort_col_meta=True)
+    row_meta = row_meta.iloc[sorted_ridx]
+    col_meta = col_meta.iloc[sorted_cidx]
+
+    # positions of the selected rows and columns in the matrix
+    matrix_ridx = sorted_ridx if row_read_idx is None else row_read_idx[sorted_ridx]
+    matrix_cidx = sorted_cidx if col_read_idx is None else col_read_idx[sorted_cidx]
+    data_df = LazyDataFrame(gctx_file[parse_gctx.data_node], row_meta.index, col_meta.index,
+                            matrix_ridx, matrix_cidx)
+
+    my_version = parse_gctx.read_version(gctx_file)
+
+    return LazyGCToo(gctx_file, data_df=data_df, row_metadata_df=row_meta, col_metadata_df=col_meta,
+                     src=full_path, version=my_version)
+
+
+class LazyGCToo(GCToo.GCToo):
+    """GCToo whose data_df is a LazyDataFrame backed by an open gctx file.
+    Assigning a regular DataFrame to data_df works as for any GCToo.
+    """
+    def __init__(self, gctx_file, data_df, row_metadata_df=None, col_metadata_df=None,
+                 src=None, version=None, logger_name=setup_logger.LOGGER_NAME):
+        self.gctx_file = gctx_file
+        super(LazyGCToo, self).__init__(data_df, row_metadata_df=row_metadata_df,
+                                        col_metadata_df=col_metadata_df, src=src, version=version,
+                                        make_multiindex=False, logger_name=logger_name)
+
+    def check_df(self, df):
+        # ids of a LazyDataFrame come straight from the (already checked) metadata
+        if isinstance(df, LazyDataFrame):
+            return True
+        return super(LazyGCToo, self).check_df(df)
+
+    def load(self):
+        """Reads the whole data matrix and returns an equivalent in-memory GCToo."""
+        data_df = self.data_df.load() if isinstance(self.data_df, LazyDataFrame) else self.data_df
+        return GCToo.GCToo(data_df=data_df, row_metadata_df=self.row_metadata_df,
+                           col_metadata_df=self.col_metadata_df, src=self.src, version=self.version)
+
+    def close(self):
+        """Closes the underlying gctx file; unread parts of data_df can no longer be accessed."""
+        self.gctx_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LazyDataFrame(object):
+    """Stand-in for a GCToo data_df that reads from an HDF5 dataset on demand.
+
+    index, columns and shape are available without touching the matrix;
+    .loc and .iloc read only the selected rows and columns. Any other DataFrame
+    attribute loads (and caches) the whole matrix first.
+    """
+    def __init__(self, data_dset, index, columns, ridx, cidx):
+        self._data_dset = data_dset
+        self.index = index
+        self.columns = columns
+        # positions of index / columns within the matrix on disk
+        self._ridx = np.asarray(ridx, dtype=np.int64)
+        self._cidx = np.asarray(cidx, dtype=np.int64)
+        self._df = None
+
+    @property
+    def shape(self):
+        return (len(self.index), len(self.columns))
+
+    @property
+    def is_loaded(self):
+        return self._df is not None
+
+    @property
+    def loc(self):
+        return _LazyIndexer(self, "loc")
+
+    @property
+    def iloc(self):
+        return _LazyIndexer(self, "iloc")
+
+    def load(self):
+        """Reads (once) and returns the full data_df."""
+        if self._df is None:
+            self._df = self.read(np.arange(len(self.index)), np.arange(len(self.columns)))
+        return self._df
+
+    def read(self, row_positions, col_positions):
+        """
+        Reads a block of the matrix into a DataFrame.
+
+        Input:
+            - row_positions (array of int): positions within self.index, any order
+            - col_positions (array of int): positions within self.columns, any order
+        Output:
+            - block_df (pandas DataFrame)
+        """
+        disk_ridx = self._ridx[row_positions]
+        disk_cidx = self._cidx[col_positions]
+
+        # h5py can only read sorted, unique indexes; reorder afterwards if needed
+        (uniq_ridx, inverse_ridx) = np.unique(disk_ridx, return_inverse=True)
+        (uniq_cidx, inverse_cidx) = np.unique(disk_cidx, return_inverse=True)
+        data_array = parse_gctx.read_data_array(self._data_dset, uniq_ridx, uniq_cidx)
+        if len(uniq_ridx) != len(disk_ridx) or np.any(uniq_ridx != disk_ridx):
+            data_array = data_array[inverse_ridx, :]
+        if len(uniq_cidx) != len(disk_cidx) or np.any(uniq_cidx != disk_cidx):
+            data_array = data_array[:, inverse_cidx]
+
+        return pd.DataFrame(data_array, index=self.index[row_positions], columns=self.columns[col_positions])
+
+    def __getitem__(self, key):
+        if self._df is not None:
+            return self._df[key]
+        return self.loc[:, key]
+
+    def __getattr__(self, name):
+        # only called for attributes not found on LazyDataFrame itself
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.load().values, dtype=dtype)
+
+    def __repr__(self):
+        if self._df is not None:
+            return repr(self._df)
+        return "LazyDataFrame: [{} rows x {} columns] (not loaded)".format(*self.shape)
+
+
+class _LazyIndexer(object):
+    """Implements .loc / .iloc on a LazyDataFrame by reading only the selection."""
+    def __init__(self, lazy_df, kind):
+        self.lazy_df = lazy_df
+        self.kind = kind
+
+    def __getitem__(self, key):
+        if self.lazy_df.is_loaded:
+            return getattr(self.lazy_df._df, self.kind)[key]
+
+        (row_key, col_key) = key if isinstance(key, tuple) else (key, slice(None))
+        (row_positions, row_is_scalar) = self.positions(self.lazy_df.index, row_key)
+        (col_positions, col_is_scalar) = self.positions(self.lazy_df.columns, col_key)
+
+        block_df = self.lazy_df.read(row_positions, col_positions)
+
+        if row_is_scalar and col_is_scalar:
+            return block_df.iloc[0, 0]
+        elif row_is_scalar:
+            return block_df.iloc[0, :]
+        elif col_is_scalar:
+            return block_df.iloc[:, 0]
+        return block_df
+
+    def positions(self, labels, key):
+        """Uses pandas' own indexing rules to turn a key into integer positions."""
+        position_series = pd.Series(np.arange(len(labels)), index=labels)
+        selected = getattr(position_series, self.kind)[key]
+        if isinstance(selected, pd.Series):
+            return (selected.values, False)
+        return (np.array([selected]), True)
@@ -62,11 +62,17 @@ import logging
 import pandas as pd
 import numpy as np
 import os.path
+import io
 import gzip
 import cmapPy.pandasGEXpress.GCToo as GCToo
-import cmapPy.pandasGEXpress.subset_gctoo as sg
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
 
+# optional: checkpoints to resume decompressing .gct.gz files from (see build_gz_index)
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
 __author__ = "Lev Litichevskiy, Oana Enache"
 __email__ = "lev@broadinstitute.org"
 
@@ -78,6 +84,14 @@ column_index_name = "cid"
 row_header_name = "rhd"
 column_header_name = "chd"
 DEFAULT_DATA_TYPE = np.float32
+# number of matrix values converted per chunk of data rows (see read_data_rows); chunks of
+# very wide files are kept to at least min_chunk_rows, as the parser's cost per column and chunk dominates
+default_chunk_values = 2 ** 21
+min_chunk_rows = 100
+# sidecar index of a .gct.gz file (see build_gz_index): file name suffix, and default number of
+# uncompressed bytes between decompressor checkpoints (each of which stores a 32 KB window)
+gz_index_suffix = ".idx"
+default_gz_index_spacing = 4 * 2 ** 20
 
 
 def parse(file_path, convert_neg_666=True, rid=None, cid=None,
@@ -96,6 +110,8 @@ def parse(file_path, convert_neg_666=True, rid=None, cid=None,
             list of integer ids. Default=None.
         - cidx (list of integers): only read the columns corresponding to this
             list of integer ids. Default=None.
+            (Only the requested rows and columns of the matrix are converted to
+            data_type, and they keep their order in the file.)
         - row_meta_only (bool): Whether to load data + metadata (if False), or
             just row metadata (if True) as pandas DataFrame
         - col_meta_only (bool): Whether to load data + metadata (if False), or
@@ -120,39 +136,27 @@ def parse(file_path, convert_neg_666=True, rid=None, cid=None,
     assert sum([row_meta_only, col_meta_only]) <= 1, (
         "row_meta_only and col_meta_only cannot both be requested.")
 
-    nan_values = [
-        "#N/A", "N/A", "NA", "#NA", "NULL", "NaN", "-NaN",
-        "nan", "-nan", "#N/A!", "na", "NA", "None", "#VALUE!"]
-
-    # Add "-666" to the list of NaN values
-    if convert_neg_666:
-        nan_values.append("-666")
+    nan_values = get_nan_values(convert_neg_666)
 
     # Verify that the gct path exists
-    if not os.path.exists(file_path):
-        err_msg = "The given path to the gct file cannot be found. gct_path: {}"
-        logger.error(err_msg.format(file_path))
-        raise Exception(err_msg.format(file_path))
+    check_gct_path(file_path)
     logger.info("Reading GCT: {}".format(file_path))
 
     # Read version and dimensions
     (version, num_data_rows, num_data_cols,
      num_row_metadata, num_col_metadata) = read_version_and_dims(file_path)
 
-    # Read in metadata and data
+    # Read in metadata and data (only the requested rows and columns, if subsetting)
     (row_metadata, col_metadata, data) = parse_into_3_df(
         file_path, num_data_rows, num_data_cols,
-        num_row_metadata, num_col_metadata, nan_values, data_type)
+        num_row_metadata, num_col_metadata, nan_values, data_type,
+        rid=rid, cid=cid, ridx=ridx, cidx=cidx)
 
     # Create the gctoo object and assemble 3 component dataframes
     # Not the most efficient if only metadata requested (i.e. creating the
     # whole GCToo just to return the metadata df), but simplest
     myGCToo = create_gctoo_obj(file_path, version, row_metadata, col_metadata,
                                data, make_multiindex)
-    # Subset if requested
-    if (rid is not None) or (ridx is not None) or (cid is not None) or (cidx is not None):
-        logger.info("Subsetting GCT... (note that there are no speed gains when subsetting GCTs)")
-        myGCToo = sg.subset_gctoo(myGCToo, rid=rid, cid=cid, ridx=ridx, cidx=cidx)
 
     if row_meta_only:
         return myGCToo.row_metadata_df
@@ -164,12 +168,109 @@ def parse(file_path, convert_neg_666=True, rid=None, cid=None,
         return myGCToo
 
 
+def iterate(file_path, block_size=None, convert_neg_666=True, data_type=DEFAULT_DATA_TYPE,
+            convert_row_metadata=True):
+    """
+    Generator over the rows of a gct file, a block of rows at a time, for files too large
+    to parse at once. The header (ids and column metadata) is parsed once; each block is
+    a GCToo of block_size rows with the column metadata of the whole file, so only one
+    block of the matrix is held in memory at a time.
+
+    ex:
+        for block in parse_gct.iterate("my_big_file.gct", block_size=10000):
+            row_means = block.data_df.mean(axis=1)
+
+    Args:
+        - file_path (string): full path to gct(.gz) file you want to parse
+        - block_size (int): number of rows per block. Default = None (about
+            default_chunk_values values, and at least min_chunk_rows rows, per block).
+        - convert_neg_666 (bool): whether to convert -666 values to numpy.nan. Default = True.
+        - data_type (numpy datatype): type of data to convert the matrix into. Default = numpy float32
+        - convert_row_metadata (bool): whether to convert row metadata fields to numeric where
+            possible, as parse does. If False, row metadata is yielded as read (strings, and NaN
+            for missing values). Default = True.
+
+    Returns:
+        - generator of GCToo objects, one per block of rows, in file order
+
+    Note: row metadata is converted to numeric one block at a time, so a field that is numeric
+        in some blocks only can be numeric in those blocks and strings in the others (e.g. "007"
+        becomes 7 in a block whose values are all numbers). Use convert_row_metadata=False to
+        get the same values in every block, as gct2gctx does.
+    """
+    nan_values = get_nan_values(convert_neg_666)
+    check_gct_path(file_path)
+    logger.info("Iterating over GCT: {}".format(file_path))
+
+    (version, num_data_rows, num_data_cols,
+     num_row_metadata, num_col_metadata) = read_version_and_dims(file_path)
+
+    header_df = read_header_block(file_path, num_col_metadata, nan_values)
+    expected_col_num = num_row_metadata + num_data_cols + 1
+    assert header_df.shape == (num_col_metadata + 1, expected_col_num), (
+        ("The shape of the header block is not as expected: expected shape is {} x {} " +
+         "parsed shape is {} x {}").format(num_col_metadata + 1, expected_col_num,
+                                           header_df.shape[0], header_df.shape[1]))
+    col_metadata = assemble_col_metadata(header_df, num_col_metadata, num_row_metadata, num_data_cols)
+    row_header_df = header_df.iloc[:, :num_row_metadata + 1]
+    columns = pd.Index(col_metadata.index, name=column_index_name)
+
+    if block_size is None:
+        block_size = calculate_chunk_rows(num_data_cols)
+
+    num_rows_read = 0
+    blocks = read_data_rows(file_path, num_col_metadata, num_row_metadata, num_data_cols, nan_values,
+                            data_type, chunk_rows=block_size)
+    while True:
+        try:
+            (row_metadata_block, data_block) = next(blocks)
+        except StopIteration:
+            break
+        except ValueError:
+            # Report the first value of the block that could not be converted
+            report_unconvertible_value(file_path, min(block_size, num_data_rows - num_rows_read), num_data_cols,
+                                       num_row_metadata, num_col_metadata, nan_values, data_type,
+                                       first_data_row=num_rows_read)
+            raise
+        assert num_rows_read + len(data_block) <= num_data_rows, (
+            "The gct file has more data rows than the {} given in its dimensions".format(num_data_rows))
+        num_rows_read += len(data_block)
+
+        row_metadata = assemble_row_metadata(pd.concat([row_header_df, row_metadata_block], ignore_index=True),
+                                             num_col_metadata, len(data_block), num_row_metadata,
+                                             convert_numeric=convert_row_metadata)
+        data = pd.DataFrame(data_block, index=pd.Index(row_metadata.index, name=row_index_name), columns=columns)
+        yield create_gctoo_obj(file_path, version, row_metadata, col_metadata, data, False)
+
+    assert num_rows_read == num_data_rows, (
+        "The gct file has {} data rows but {} are given in its dimensions".format(num_rows_read, num_data_rows))
+
+
+def get_nan_values(convert_neg_666):
+    """Returns the strings to read as NaN, including "-666" if convert_neg_666."""
+    nan_values = [
+        "#N/A", "N/A", "NA", "#NA", "NULL", "NaN", "-NaN",
+        "nan", "-nan", "#N/A!", "na", "NA", "None", "#VALUE!"]
+
+    # Add "-666" to the list of NaN values
+    if convert_neg_666:
+        nan_values.append("-666")
+    return nan_values
+
+
+def check_gct_path(file_path):
+    if not os.path.exists(file_path):
+        err_msg = "The given path to the gct file cannot be found. gct_path: {}"
+        logger.error(err_msg.format(file_path))
+        raise Exception(err_msg.format(file_path))
+
+
 def read_version_and_dims(file_path):
     extension = os.path.splitext(file_path)[-1]
     logger.debug("extension:  {}".format(extension))
 
     # Open file
-    f = open(file_path, "r") if ".gct" == extension else gzip.open(file_path, 'rt')
+    f = open_gct_file(file_path)
 
     # Get version from the first line
     version = f.readline().strip().lstrip("#")
@@ -213,32 +314,465 @@ def read_version_and_dims(file_path):
     return version_as_string, num_data_rows, num_data_cols, num_row_metadata, num_col_metadata
 
 
-def parse_into_3_df(file_path, num_data_rows, num_data_cols, num_row_metadata, num_col_metadata, nan_values, data_type=DEFAULT_DATA_TYPE):
-    # Read the gct file beginning with line 3
-    full_df = pd.read_csv(file_path, sep="\t", header=None, skiprows=2,
-                          dtype=str, na_values=nan_values, keep_default_na=False)
+def open_gct_file(file_path):
+    """Opens a .gct file, or a gzipped one (any other extension), for reading text."""
+    extension = os.path.splitext(file_path)[-1]
+    return open(file_path, "r") if ".gct" == extension else gzip.open(file_path, 'rt')
 
-    # Check that full_df is the size we expect
-    expected_row_num = num_col_metadata + num_data_rows + 1
-    expected_col_num = num_row_metadata + num_data_cols + 1
-    assert full_df.shape == (expected_row_num,
-                             expected_col_num), (
-        ("The shape of full_df is not as expected: expected shape is {} x {} " +
-         "parsed shape is {} x {}").format(expected_row_num, expected_col_num,
-                full_df.shape[0], full_df.shape[1]))
 
-    # Assemble metadata dataframes
-    row_metadata = assemble_row_metadata(full_df, num_col_metadata, num_data_rows, num_row_metadata)
-    col_metadata = assemble_col_metadata(full_df, num_col_metadata, num_row_metadata, num_data_cols)
+def parse_into_3_df(file_path, num_data_rows, num_data_cols, num_row_metadata, num_col_metadata, nan_values,
+                    data_type=DEFAULT_DATA_TYPE, rid=None, cid=None, ridx=None, cidx=None):
+    """
+    Reads the gct file in two regions: the header block (ids and column metadata) is read as
+    strings, then the data rows are streamed in chunks, their row metadata as strings and their
+    values converted by pandas' C parser straight into a preallocated data_type array. The
+    matrix is never held as strings.
+
+    If rid / ridx or cid / cidx are given (see parse), only those rows and columns of the
+    matrix are read: columns are selected from the header, and the other cells of the matrix
+    are skipped by the parser without being converted. Rows and columns keep their order in
+    the file. The metadata is converted to numeric over all of the rows / columns before being
+    subset, so that each field gets the dtype it has when the whole file is parsed: the column
+    metadata is in the header, and the row metadata (and ids, to find rid) of all rows is read
+    by a first pass over the metadata columns only (just the id column if there is no row
+    metadata, or none at all if ridx is given).
+    """
+    header_df = read_header_block(file_path, num_col_metadata, nan_values)
+
+    # Check that the header block is the size we expect
+    expected_col_num = num_row_metadata + num_data_cols + 1
+    assert header_df.shape == (num_col_metadata + 1, expected_col_num), (
+        ("The shape of the header block is not as expected: expected shape is {} x {} " +
+         "parsed shape is {} x {}").format(num_col_metadata + 1, expected_col_num,
+                                           header_df.shape[0], header_df.shape[1]))
+
+    # Figure out which rows and columns to read
+    row_positions = None
+    col_positions = None
+    gz_index = None
+    all_row_metadata = None
+    if (rid is not None) or (ridx is not None):
+        # row ids and offsets from the sidecar index of a .gct.gz file, if it has an up-to-date one
+        gz_index = load_gz_index(file_path, num_data_rows)
+        row_ids = None
+        if num_row_metadata > 0:
+            all_row_metadata = read_row_metadata_columns(file_path, num_col_metadata, num_row_metadata, nan_values)
+            assert len(all_row_metadata) == num_data_rows, (
+                "The gct file has {} data rows but {} are given in its dimensions".format(
+                    len(all_row_metadata), num_data_rows))
+            row_ids = all_row_metadata.iloc[:, 0]
+        elif rid is not None and gz_index is not None:
+            row_ids = clean_row_ids(gz_index["row_ids"], nan_values)
+        elif rid is not None:
+            row_ids = read_row_ids(file_path, num_col_metadata, nan_values)
+        row_positions = get_subset_positions(num_data_rows, rid, ridx, row_ids, "rid")
+    if (cid is not None) or (cidx is not None):
+        col_ids = header_df.iloc[0, num_row_metadata + 1:]
+        col_positions = get_subset_positions(num_data_cols, cid, cidx, col_ids, "cid")
+    num_rows_to_read = num_data_rows if row_positions is None else len(row_positions)
+    num_cols_to_read = num_data_cols if col_positions is None else len(col_positions)
+    if (row_positions is not None) or (col_positions is not None):
+        assert num_rows_to_read > 0 and num_cols_to_read > 0, "Subsetting yielded an empty gct!"
+        logger.info("Reading {} of {} rows and {} of {} columns of the GCT".format(
+            num_rows_to_read, num_data_rows, num_cols_to_read, num_data_cols))
+
+    # Stream the data rows into a single array
+    data_values = np.empty((num_rows_to_read, num_cols_to_read), dtype=data_type)
+    row_metadata_blocks = []
+    num_rows_read = 0
+    try:
+        for (row_metadata_block, data_block) in read_data_rows(file_path, num_col_metadata, num_row_metadata,
+                                                              num_data_cols, nan_values, data_type,
+                                                              row_positions=row_positions,
+                                                              col_positions=col_positions, gz_index=gz_index):
+            assert num_rows_read + len(data_block) <= num_rows_to_read, (
+                "The gct file has more data rows than the {} given in its dimensions".format(num_data_rows))
+            data_values[num_rows_read:num_rows_read + len(data_block)] = data_block
+            row_metadata_blocks.append(row_metadata_block)
+            num_rows_read += len(data_block)
+    except ValueError:
+        # Report the first value that could not be converted
+        report_unconvertible_value(file_path, num_data_rows, num_data_cols, num_row_metadata, num_col_metadata,
+                                   nan_values, data_type, row_positions=row_positions, col_positions=col_positions)
+        raise
+    assert num_rows_read == num_rows_to_read, (
+        "The gct file has {} data rows but {} are given in its dimensions".format(num_rows_read, num_data_rows))
+
+    # Assemble metadata dataframes from the string regions, converting each field over all of its entries
+    if all_row_metadata is None:
+        row_metadata_df = pd.concat([header_df.iloc[:, :num_row_metadata + 1]] + row_metadata_blocks, ignore_index=True)
+        row_metadata = assemble_row_metadata(row_metadata_df, num_col_metadata, num_rows_to_read, num_row_metadata)
+    else:
+        row_metadata_df = pd.concat([header_df.iloc[:, :num_row_metadata + 1], all_row_metadata], ignore_index=True)
+        row_metadata = assemble_row_metadata(row_metadata_df, num_col_metadata, num_data_rows,
+                                             num_row_metadata).iloc[row_positions]
+    col_metadata = assemble_col_metadata(header_df, num_col_metadata, num_row_metadata, num_data_cols)
+    if col_positions is not None:
+        col_metadata = col_metadata.iloc[col_positions]
 
-    # Assemble data dataframe
-    data = assemble_data(full_df, num_col_metadata, num_data_rows, num_row_metadata, num_data_cols, data_type)
+    # Assemble data dataframe around the array, without copying it
+    data = pd.DataFrame(data_values, index=pd.Index(row_metadata.index, name=row_index_name),
+                        columns=pd.Index(col_metadata.index, name=column_index_name))
 
     # Return 3 dataframes
     return row_metadata, col_metadata, data
 
 
-def assemble_row_metadata(full_df, num_col_metadata, num_data_rows, num_row_metadata):
+def read_header_block(file_path, num_col_metadata, nan_values):
+    """
+    Reads the line of ids / headers and the column metadata lines (lines 3 to
+    3 + num_col_metadata of the file) as strings.
+
+    Returns:
+        - header_df (pandas df): num_col_metadata + 1 rows, one column per field of the file
+    """
+    return pd.read_csv(file_path, sep="\t", header=None, skiprows=2, nrows=num_col_metadata + 1,
+                       dtype=str, na_values=nan_values, keep_default_na=False)
+
+
+def read_row_ids(file_path, num_col_metadata, nan_values):
+    """
+    Reads only the id column of the data rows (as strings, nan_values being NaN), by scanning
+    the lines of the file rather than tokenizing all of their fields.
+    """
+    with open_gct_file(file_path) as f:
+        for _ in range(num_col_metadata + 3):
+            f.readline()
+        ids = [line.split("\t", 1)[0].rstrip("\r\n") for line in f if line.strip("\r\n")]
+    return clean_row_ids(ids, nan_values)
+
+
+def read_row_metadata_columns(file_path, num_col_metadata, num_row_metadata, nan_values):
+    """
+    Reads the row id and row metadata columns of all of the data rows (as strings, nan_values
+    being NaN), by scanning the lines of the file rather than tokenizing all of their fields,
+    as read_row_ids does.
+
+    Returns:
+        - row_metadata_strings (pandas df): num_row_metadata + 1 columns, one row per data row
+    """
+    num_meta_cols = num_row_metadata + 1
+    with open_gct_file(file_path) as f:
+        for _ in range(num_col_metadata + 3):
+            f.readline()
+        fields = [line.rstrip("\r\n").split("\t", num_meta_cols)[:num_meta_cols]
+                  for line in f if line.strip("\r\n")]
+    columns = list(zip(*fields)) if fields else [[]] * num_meta_cols
+    assert len(columns) == num_meta_cols, (
+        "The data rows of the gct file have fewer than the {} row id and metadata fields expected".format(
+            num_meta_cols))
+    return pd.DataFrame(dict((i, clean_row_ids(list(column), nan_values)) for (i, column) in enumerate(columns)),
+                        columns=list(range(num_meta_cols)))
+
+
+def clean_row_ids(ids, nan_values):
+    """Strips quotes around ids and makes nan_values NaN, as read_csv does."""
+    row_ids = pd.Series(ids, dtype=object)
+    quoted = row_ids.str.startswith('"') & row_ids.str.endswith('"') & (row_ids.str.len() > 1)
+    row_ids[quoted] = row_ids[quoted].str[1:-1]
+    row_ids[row_ids.isin(nan_values)] = np.nan
+    return row_ids
+
+
+def get_subset_positions(num_ids, id_list, idx_list, ids, id_type):
+    """
+    Figures out which positions of a dimension to keep, as subset_gctoo does: either the
+    positions of the ids in id_list (ids missing from the file are logged and ignored) or
+    the integer ids in idx_list. The positions are returned sorted, i.e. in file order.
+
+    Args:
+        - num_ids (int): length of the dimension
+        - id_list (list of strings): ids to keep, or None
+        - idx_list (list of integers): integer ids to keep, or None
+        - ids (pandas Series or Index): ids of the dimension (only needed with id_list)
+        - id_type (string): "rid" or "cid"
+
+    Returns:
+        - positions (numpy array of int): sorted positions to keep
+    """
+    idx_type = id_type[0] + "idx"
+    assert (id_list is None) or (idx_list is None), (
+        "Only one of {} and {} can be provided.".format(id_type, idx_type))
+
+    if id_list is not None:
+        assert type(id_list) == list, "{} must be a list. {}: {}".format(id_type, id_type, id_list)
+        keep = np.asarray(pd.Index(ids).isin(id_list))
+
+        # Tell user if some ids not found
+        num_missing_ids = len(id_list) - keep.sum()
+        if num_missing_ids != 0:
+            logger.info("{} {}s were not found in the GCT.".format(num_missing_ids, id_type))
+    else:
+        assert type(idx_list[0]) is int, (
+            "{} must be a list of integers. {}[0]: {}, type({}[0]): {}").format(
+                idx_type, idx_type, idx_list[0], idx_type, type(idx_list[0]))
+        dim_name = "row" if id_type == "rid" else "column"
+        assert max(idx_list) < num_ids, (
+            "{} contains an integer larger than the number of {}s in the GCT. max({}): {}, " +
+            "number of {}s: {}").format(idx_type, dim_name, idx_type, max(idx_list), dim_name, num_ids)
+        keep = np.zeros(num_ids, dtype=bool)
+        keep[idx_list] = True
+
+    return np.flatnonzero(keep)
+
+
+def read_data_rows(file_path, num_col_metadata, num_row_metadata, num_data_cols, nan_values,
+                   data_type=DEFAULT_DATA_TYPE, chunk_rows=None, row_positions=None, col_positions=None,
+                   gz_index=None):
+    """
+    Generator over the data rows of a gct file, a chunk of rows at a time. The row id and
+    row metadata columns are read as strings, the data columns are converted to data_type
+    by the C parser (explicit dtypes), so no chunk is ever held as strings in full.
+
+    Args:
+        - chunk_rows (int): number of rows per chunk. Default = None (about
+            default_chunk_values values, and at least min_chunk_rows rows, per chunk).
+        - row_positions (sorted list of int): only read these data rows (0 being the first
+            data row); the others are skipped by the parser. Default = None (all rows).
+        - col_positions (sorted list of int): only read these data columns (0 being the
+            first data column); the others are not converted. Default = None (all columns).
+        - gz_index (dict): sidecar index of a .gct.gz file (see load_gz_index), used to
+            seek to the rows at row_positions. Default = None.
+
+    Returns:
+        - generator of (row_metadata_block, data_block): a pandas df of the row id and row
+            metadata strings, and a data_type numpy array of the chunk's values
+    """
+    num_meta_cols = num_row_metadata + 1
+    first_line = num_col_metadata + 3
+    if col_positions is None:
+        data_cols = list(range(num_meta_cols, num_meta_cols + num_data_cols))
+        usecols = None
+    else:
+        data_cols = [num_meta_cols + c for c in col_positions]
+        usecols = list(range(num_meta_cols)) + data_cols
+    if chunk_rows is None:
+        chunk_rows = calculate_chunk_rows(len(data_cols))
+    dtypes = dict([(i, str) for i in range(num_meta_cols)] + [(i, data_type) for i in data_cols])
+    read_csv_kwargs = dict(sep="\t", header=None, usecols=usecols, dtype=dtypes, na_values=nan_values,
+                           keep_default_na=False, low_memory=False)
+
+    if row_positions is None:
+        chunks = read_csv_chunks(file_path, first_line, chunk_rows, read_csv_kwargs)
+    elif gz_index is not None:
+        chunks = read_indexed_row_chunks(file_path, gz_index, row_positions, chunk_rows, read_csv_kwargs)
+    else:
+        chunks = read_selected_line_chunks(file_path, first_line, row_positions, chunk_rows, read_csv_kwargs)
+    try:
+        for chunk in chunks:
+            assert chunk.shape[1] == num_meta_cols + len(data_cols), (
+                "The data rows of the gct file have {} fields, expected {}".format(
+                    chunk.shape[1], num_meta_cols + len(data_cols)))
+            # copied, so that keeping the row metadata does not keep the whole chunk alive
+            yield (chunk.iloc[:, :num_meta_cols].copy(), chunk.iloc[:, num_meta_cols:].to_numpy(dtype=data_type))
+    finally:
+        chunks.close()
+
+
+def read_csv_chunks(file_path, first_line, chunk_rows, read_csv_kwargs):
+    """Generator over the data rows of a gct file (from line first_line on) as dataframes of chunk_rows rows."""
+    try:
+        reader = pd.read_csv(file_path, skiprows=first_line, chunksize=chunk_rows, **read_csv_kwargs)
+    except pd.errors.EmptyDataError:
+        # no data rows
+        return
+    try:
+        for chunk in reader:
+            yield chunk
+    finally:
+        reader.close()
+
+
+def read_selected_line_chunks(file_path, first_line, row_positions, chunk_rows, read_csv_kwargs):
+    """
+    Generator over the data rows at row_positions as dataframes of up to chunk_rows rows. The
+    requested lines are picked out of the file before parsing, which is much faster than having
+    the parser skip the others, and the file is only read up to the last requested row.
+    """
+    if len(row_positions) == 0:
+        return
+    keep = np.zeros(row_positions[-1] + 1, dtype=bool)
+    keep[row_positions] = True
+
+    lines = []
+    with open_gct_file(file_path) as f:
+        for _ in range(first_line):
+            f.readline()
+        row = 0
+        for line in f:
+            # as read_csv, skip blank lines
+            if not line.strip("\r\n"):
+                continue
+            if row == len(keep):
+                break
+            if keep[row]:
+                lines.append(line)
+                if len(lines) == chunk_rows:
+                    yield pd.read_csv(io.StringIO("".join(lines)), **read_csv_kwargs)
+                    lines = []
+            row += 1
+    if lines:
+        yield pd.read_csv(io.StringIO("".join(lines)), **read_csv_kwargs)
+
+
+def build_gz_index(file_path, spacing=default_gz_index_spacing):
+    """
+    Writes a sidecar index of a .gct.gz file, file_path + gz_index_suffix, which parse uses
+    (when it is up to date) to read the rows requested by rid / ridx without decompressing
+    the file from the start. The index holds:
+        - the id and the uncompressed byte range of every data row
+        - if indexed_gzip is installed, checkpoints of the decompressor every spacing bytes of
+            uncompressed data (zran-style), to resume decompressing from. Without them, the
+            rows are still located from the index but the file is decompressed up to them.
+
+    Args:
+        - file_path (string): path to the .gct.gz file
+        - spacing (int): uncompressed bytes between checkpoints; more than 32 KB. Default = 4 MB
+            (the checkpoints then take about 1% of the uncompressed size).
+
+    Returns:
+        - index_path (string): path of the index written
+    """
+    if ".gct" == os.path.splitext(file_path)[-1]:
+        err_msg = "Only gzipped gct files can be indexed. file_path: {}"
+        logger.error(err_msg.format(file_path))
+        raise Exception(err_msg.format(file_path))
+
+    (_, num_data_rows, _, _, num_col_metadata) = read_version_and_dims(file_path)
+    if indexed_gzip is None:
+        logger.info("indexed_gzip is not installed: indexing the rows of {} without checkpoints".format(file_path))
+        f = gzip.open(file_path, "rb")
+    else:
+        f = indexed_gzip.IndexedGzipFile(file_path, spacing=spacing)
+
+    try:
+        offset = 0
+        for _ in range(num_col_metadata + 3):
+            offset += len(f.readline())
+        row_starts = []
+        row_ids = []
+        for line in f:
+            # as read_csv, skip blank lines
+            if line.strip(b"\r\n"):
+                row_starts.append(offset)
+                row_ids.append(line.split(b"\t", 1)[0].rstrip(b"\r\n").decode("utf-8"))
+            offset += len(line)
+
+        checkpoints = b""
+        if indexed_gzip is not None:
+            f.build_full_index()
+            checkpoints_buffer = io.BytesIO()
+            f.export_index(fileobj=checkpoints_buffer)
+            checkpoints = checkpoints_buffer.getvalue()
+    finally:
+        f.close()
+
+    if len(row_starts) != num_data_rows:
+        err_msg = "The gct file has {} data rows but {} are given in its dimensions. file_path: {}"
+        logger.error(err_msg.format(len(row_starts), num_data_rows, file_path))
+        raise Exception(err_msg.format(len(row_starts), num_data_rows, file_path))
+
+    # each row ends where the next starts, up to the trailing line break / blank lines
+    row_ends = np.array(row_starts[1:] + [offset], dtype=np.int64)
+
+    index_path = file_path + gz_index_suffix
+    with open(index_path, "wb") as index_file:
+        np.savez(index_file, row_starts=np.array(row_starts, dtype=np.int64), row_ends=row_ends,
+                 row_ids=np.array(row_ids, dtype=str), checkpoints=np.frombuffer(checkpoints, dtype=np.uint8),
+                 gz_signature=np.frombuffer(read_gz_signature(file_path), dtype=np.uint8))
+    logger.info("Wrote index of {} rows ({} checkpoint bytes) to {}".format(
+        num_data_rows, len(checkpoints), index_path))
+    return index_path
+
+
+def load_gz_index(file_path, num_data_rows):
+    """
+    Loads the sidecar index of a .gct.gz file written by build_gz_index.
+
+    Returns:
+        - gz_index (dict): row_starts, row_ends, row_ids and checkpoints (bytes), or None if
+            file_path is not gzipped, or has no index, or its index is out of date
+    """
+    index_path = file_path + gz_index_suffix
+    if ".gct" == os.path.splitext(file_path)[-1] or not os.path.exists(index_path):
+        return None
+
+    with np.load(index_path) as index_npz:
+        gz_index = dict((name, index_npz[name]) for name in index_npz.files)
+    if (gz_index["gz_signature"].tobytes() != read_gz_signature(file_path) or
+            len(gz_index["row_starts"]) != num_data_rows):
+        logger.warning("The index of {} is out of date and will not be used; rebuild it with build_gz_index".format(
+            file_path))
+        return None
+    gz_index["checkpoints"] = gz_index["checkpoints"].tobytes()
+    return gz_index
+
+
+def read_gz_signature(file_path):
+    """The size of a gzipped file and its last 8 bytes (CRC and size of the uncompressed data), to tell it has changed."""
+    with open(file_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 8))
+        return str(size).encode() + b":" + f.read()
+
+
+def read_indexed_row_chunks(file_path, gz_index, row_positions, chunk_rows, read_csv_kwargs):
+    """
+    Generator over the data rows at row_positions of a .gct.gz file as dataframes of up to
+    chunk_rows rows, seeking to each run of consecutive rows with its sidecar index.
+    """
+    if indexed_gzip is not None and len(gz_index["checkpoints"]) > 0:
+        # a small read buffer, as each seek discards it (indexed_gzip's default is 4 * spacing)
+        f = indexed_gzip.IndexedGzipFile(file_path, buffer_size=2 ** 16)
+        f.import_index(fileobj=io.BytesIO(gz_index["checkpoints"]))
+    else:
+        # seeking decompresses the file up to the rows
+        f = gzip.open(file_path, "rb")
+
+    try:
+        for start in range(0, len(row_positions), chunk_rows):
+            chunk_positions = np.asarray(row_positions[start:start + chunk_rows])
+            runs = np.split(chunk_positions, np.flatnonzero(np.diff(chunk_positions) != 1) + 1)
+            pieces = []
+            for run in runs:
+                f.seek(gz_index["row_starts"][run[0]])
+                pieces.append(f.read(gz_index["row_ends"][run[-1]] - gz_index["row_starts"][run[0]]))
+            yield pd.read_csv(io.BytesIO(b"".join(pieces)), **read_csv_kwargs)
+    finally:
+        f.close()
+
+
+def calculate_chunk_rows(num_data_cols):
+    """Default number of data rows per chunk: about default_chunk_values values, and at least min_chunk_rows rows."""
+    return max(min_chunk_rows, default_chunk_values // max(1, num_data_cols))
+
+
+def report_unconvertible_value(file_path, num_data_rows, num_data_cols, num_row_metadata, num_col_metadata,
+                               nan_values, data_type=DEFAULT_DATA_TYPE, first_data_row=0, row_positions=None,
+                               col_positions=None):
+    """
+    Reads num_data_rows data rows, from the first_data_row-th on (or the rows at row_positions, and
+    only the columns at col_positions; see read_data_rows), as strings to raise an exception naming
+    the first value that could not be converted.
+    """
+    # keep the line of ids and the data rows to check, skip the column metadata
+    first_line = num_col_metadata + 3
+    if row_positions is None:
+        lines_to_keep = set([2]) | set(range(first_line + first_data_row, first_line + first_data_row + num_data_rows))
+    else:
+        lines_to_keep = set([2]) | set((first_line + np.asarray(row_positions)).tolist())
+    usecols = None
+    if col_positions is not None:
+        usecols = list(range(num_row_metadata + 1)) + [num_row_metadata + 1 + c for c in col_positions]
+        num_data_cols = len(col_positions)
+    full_df = pd.read_csv(file_path, sep="\t", header=None, skiprows=lambda i: i not in lines_to_keep,
+                          nrows=len(lines_to_keep), usecols=usecols, dtype=str, na_values=nan_values,
+                          keep_default_na=False)
+    assemble_data(full_df, 0, len(full_df) - 1, num_row_metadata, num_data_cols, data_type)
+
+
+def assemble_row_metadata(full_df, num_col_metadata, num_data_rows, num_row_metadata, convert_numeric=True):
     # Extract values
     row_metadata_row_inds = range(num_col_metadata + 1, num_col_metadata + num_data_rows + 1)
     row_metadata_col_inds = range(1, num_row_metadata + 1)
@@ -255,7 +789,8 @@ def assemble_row_metadata(full_df, num_col_metadata, num_data_rows, num_row_meta
     row_metadata.columns.name = row_header_name
 
     # Convert metadata to numeric if possible
-    row_metadata = row_metadata.apply(lambda x: pd.to_numeric(x, errors="ignore"))
+    if convert_numeric:
+        row_metadata = row_metadata.apply(lambda x: pd.to_numeric(x, errors="ignore"))
 
     return row_metadata
 
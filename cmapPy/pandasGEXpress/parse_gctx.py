@@ -1,10 +1,16 @@
 import logging
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
 import os
+import zlib
+import weakref
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import pandas as pd
 import h5py
+from h5py import h5z
 import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.gctx_metadata_cache as gctx_metadata_cache
 
 __author__ = "Oana Enache"
 __email__ = "oana@broadinstitute.org"
@@ -18,11 +24,31 @@ cid_node = "/0/META/COL/id"
 data_node = "/0/DATA/0/matrix"
 row_meta_group_node = "/0/META/ROW"
 col_meta_group_node = "/0/META/COL"
+row_id_index_group_node = "/0/ID_INDEX/ROW"
+col_id_index_group_node = "/0/ID_INDEX/COL"
+sorted_id_node = "sorted_id"
+sorted_idx_node = "sorted_idx"
+row_categories_group_node = "/0/META_CATEGORIES/ROW"
+col_categories_group_node = "/0/META_CATEGORIES/COL"
+metadata_dtype_attr = "dtype"
+# attributes of a quantized data matrix (write_gctx.write(..., quantize=True))
+scale_factor_attr = "scale_factor"
+add_offset_attr = "add_offset"
+missing_value_attr = "missing_value"
+
+# used by iterate when the data matrix is not chunked
+default_block_size = 1000
+# entries of an unchunked id index that search_sorted_dset reads at once instead of probing
+default_index_block_len = 4096
+# upper bound on the temporary buffer read_planned_hyperslabs reads a scattered selection of a
+# contiguous dataset through; it is further limited to a quarter of the size of the output
+max_read_block_bytes = 32 * 1024 * 1024
 
 
 def parse(gctx_file_path, convert_neg_666=True, rid=None, cid=None,
           ridx=None, cidx=None, row_meta_only=False, col_meta_only=False, make_multiindex=False,
-          sort_col_meta = True, sort_row_meta = True):
+          sort_col_meta = True, sort_row_meta = True, metadata_cache=None, row_fields=None, col_fields=None,
+          row_filter=None, col_filter=None, num_threads=1, workers=1, mode="read"):
     """
     Primary method of script. Reads in path to a gctx file and parses into GCToo object.
 
@@ -47,6 +73,29 @@ def parse(gctx_file_path, convert_neg_666=True, rid=None, cid=None,
             the 3 component dfs
         - sort_col_meta (bool) : whether to sort the column metadata by indexes. Default = True
         - sort_row_meta (bool) : whether to sort the row metadata by indexes. Default = True
+        - metadata_cache (MetadataCache or str): if provided, parsed metadata is read from / stored
+            in this gctx_metadata_cache.MetadataCache (or cache directory). Default = None.
+        - row_fields (list of strings): only read these row metadata fields; [] reads only the rids.
+            Default = None (read all fields).
+        - col_fields (list of strings): only read these col metadata fields; [] reads only the cids.
+            Default = None (read all fields).
+        - row_filter (dict): only keep rows whose metadata matches every {field: condition} entry,
+            where condition is a value (equality), a list/set of values (membership) or a function
+            taking the field as a pandas Series and returning a boolean mask. Combined with rid/ridx
+            if both are given. Default = None.
+        - col_filter (dict): same as row_filter, for columns; e.g.
+            {"pert_type": "trt_cp", "cell_id": ["A375", "MCF7"]}. Default = None.
+        - num_threads (int): number of threads used to decompress the data matrix's chunks
+            (gzip / shuffle compressed, chunked files only; otherwise ignored). Default = 1.
+        - workers (int): number of processes to read the data matrix with; each reads a range of
+            columns directly into a shared memory buffer that backs the returned data_df.
+            Requires Python 3.8+ when more than 1. Default = 1 (read in this process).
+        - mode (str): "read" reads the data matrix into memory; "mmap" instead memory-maps it
+            (read-only) straight from the file, so processes mapping the same file share one
+            page cache copy. Requires an uncompressed, contiguous matrix, e.g. written with
+            write_gctx.write(..., mmap_friendly=True). Without rid/cid/ridx/cidx, data_df is
+            backed by the mapping itself; subsets are copied out of it. Either way data_df keeps
+            the matrix's stored dtype rather than being converted to float32. Default = "read".
     Output:
         - myGCToo (GCToo): A GCToo instance containing content of parsed gctx file. Note: if meta_only = True,
             this will be a GCToo instance where the data_df is empty, i.e. data_df = pd.DataFrame(index=rids,
@@ -67,13 +116,28 @@ def parse(gctx_file_path, convert_neg_666=True, rid=None, cid=None,
         raise Exception(err_msg.format(full_path))
     logger.info("Reading GCTX: {}".format(full_path))
 
+    if mode not in ("read", "mmap"):
+        err_msg = "mode must be either 'read' or 'mmap' - mode:  {}".format(mode)
+        logger.error(err_msg)
+        raise Exception("parse_gctx.parse " + err_msg)
+
+    metadata_cache = gctx_metadata_cache.get_metadata_cache(metadata_cache)
+
     # open file
     gctx_file = h5py.File(full_path, "r")
 
+    # resolve rid / cid to indexes with the file's id index, if it has one
+    (rid, ridx) = lookup_ids_with_index(gctx_file, "row", rid, ridx)
+    (cid, cidx) = lookup_ids_with_index(gctx_file, "col", cid, cidx)
+
+    # if subsetting by index, only read the metadata of the selected entries
+    (row_read_idx, ridx) = get_metadata_read_idx(gctx_file, "row", ridx, row_filter)
+    (col_read_idx, cidx) = get_metadata_read_idx(gctx_file, "col", cidx, col_filter)
+
     if row_meta_only:
         # read in row metadata
-        row_dset = gctx_file[row_meta_group_node]
-        row_meta = parse_metadata_df("row", row_dset, convert_neg_666)
+        row_meta = read_metadata(gctx_file, "row", convert_neg_666, metadata_cache, row_fields, row_read_idx)
+        (rid, ridx) = apply_metadata_filter(gctx_file, "row", rid, ridx, row_meta, row_filter, convert_neg_666)
 
         # validate optional input ids & get indexes to subset by
         (sorted_ridx, sorted_cidx) = check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta, None, 
@@ -92,8 +156,8 @@ def parse(gctx_file_path, convert_neg_666=True, rid=None, cid=None,
         return row_meta
     elif col_meta_only:
         # read in col metadata
-        col_dset = gctx_file[col_meta_group_node]
-        col_meta = parse_metadata_df("col", col_dset, convert_neg_666)
+        col_meta = read_metadata(gctx_file, "col", convert_neg_666, metadata_cache, col_fields, col_read_idx)
+        (cid, cidx) = apply_metadata_filter(gctx_file, "col", cid, cidx, col_meta, col_filter, convert_neg_666)
 
         # validate optional input ids & get indexes to subset by
         (sorted_ridx, sorted_cidx) = check_and_order_id_inputs(rid, ridx, cid, cidx, None, 
@@ -112,49 +176,350 @@ def parse(gctx_file_path, convert_neg_666=True, rid=None, cid=None,
         return col_meta
     else:
         # read in row metadata
-        row_dset = gctx_file[row_meta_group_node]
-        row_meta = parse_metadata_df("row", row_dset, convert_neg_666)
+        row_meta = read_metadata(gctx_file, "row", convert_neg_666, metadata_cache, row_fields, row_read_idx)
+        (rid, ridx) = apply_metadata_filter(gctx_file, "row", rid, ridx, row_meta, row_filter, convert_neg_666)
 
         # read in col metadata
-        col_dset = gctx_file[col_meta_group_node]
-        col_meta = parse_metadata_df("col", col_dset, convert_neg_666)
+        col_meta = read_metadata(gctx_file, "col", convert_neg_666, metadata_cache, col_fields, col_read_idx)
+        (cid, cidx) = apply_metadata_filter(gctx_file, "col", cid, cidx, col_meta, col_filter, convert_neg_666)
 
-        # validate optional input ids & get indexes to subset by
-        (sorted_ridx, sorted_cidx) = check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta, col_meta, 
-                                                                sort_row_meta = True, sort_col_meta = True)
+        (data_df, row_meta, col_meta) = read_data_and_subset_metadata(
+            gctx_file, full_path, rid, ridx, cid, cidx, row_meta, col_meta, sort_row_meta, sort_col_meta,
+            num_threads, workers, mode, row_read_idx, col_read_idx)
 
-        data_dset = gctx_file[data_node]
-        data_df = parse_data_df(data_dset, sorted_ridx, sorted_cidx, row_meta, col_meta)
+        my_version = read_version(gctx_file)
 
-        # (if subsetting) subset metadata
-        row_meta = row_meta.iloc[sorted_ridx]
-        col_meta = col_meta.iloc[sorted_cidx]
+        gctx_file.close()
 
-        if not sort_col_meta:
-            ## in the subsetted and re-indexed dataframe get where new indexes lie
-            (_, unsorted_cidx) = check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta, col_meta, 
-                                                        sort_row_meta, sort_col_meta)
-            
-            data_df = data_df.iloc[:,unsorted_cidx]
-            col_meta = col_meta.iloc[unsorted_cidx,:]
+        # make GCToo instance
+        my_gctoo = GCToo.GCToo(data_df=data_df, row_metadata_df=row_meta, col_metadata_df=col_meta,
+                               src=full_path, version=my_version, make_multiindex=make_multiindex)
+        return my_gctoo
+
+
+def read_data_and_subset_metadata(gctx_file, full_path, rid, ridx, cid, cidx, row_meta, col_meta,
+                                  sort_row_meta, sort_col_meta, num_threads=1, workers=1, mode="read",
+                                  row_read_idx=None, col_read_idx=None):
+    """
+    Reads the requested part of the data matrix and subsets (and orders) the metadata to match.
+
+    Input:
+        - gctx_file (h5py File): open gctx file
+        - full_path (str): path gctx_file was opened from
+        - rid, ridx, cid, cidx: see parse; indexes are positions within row_meta / col_meta
+        - row_meta (pandas DataFrame): the file's row metadata
+        - col_meta (pandas DataFrame): the file's col metadata
+        - sort_row_meta, sort_col_meta, num_threads, workers, mode: see parse
+        - row_read_idx (numpy array or None): if row_meta holds only some of the file's rows,
+            their indexes in the file (see get_metadata_read_idx). Default = None.
+        - col_read_idx (numpy array or None): same as row_read_idx, for columns. Default = None.
+    Output:
+        - data_df (pandas DataFrame)
+        - row_meta (pandas DataFrame)
+        - col_meta (pandas DataFrame)
+    """
+    # validate optional input ids & get indexes to subset by
+    (sorted_ridx, sorted_cidx) = check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta, col_meta, 
+                                                            sort_row_meta = True, sort_col_meta = True)
+    # positions of the selected rows and columns in the matrix
+    matrix_ridx = sorted_ridx if row_read_idx is None else [int(i) for i in row_read_idx[sorted_ridx]]
+    matrix_cidx = sorted_cidx if col_read_idx is None else [int(i) for i in col_read_idx[sorted_cidx]]
+
+    if mode == "mmap":
+        data_array = map_data_array(full_path, gctx_file[data_node], matrix_ridx, matrix_cidx)
+    elif workers > 1:
+        data_array = read_data_array_shared(full_path, matrix_ridx, matrix_cidx, workers, num_threads)
+    else:
+        data_array = read_data_array(gctx_file[data_node], matrix_ridx, matrix_cidx, num_threads)
+    data_df = pd.DataFrame(data_array, index=row_meta.index[sorted_ridx],
+                           columns=col_meta.index[sorted_cidx], copy=False)
+
+    # (if subsetting) subset metadata
+    row_meta = row_meta.iloc[sorted_ridx]
+    col_meta = col_meta.iloc[sorted_cidx]
+
+    if not sort_col_meta:
+        ## in the subsetted and re-indexed dataframe get where new indexes lie
+        (_, unsorted_cidx) = check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta, col_meta, 
+                                                    sort_row_meta, sort_col_meta)
         
-        if not sort_row_meta:
-            (unsorted_ridx, _) = check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta, col_meta,
-                                                      sort_row_meta, sort_row_meta)
-            data_df = data_df.iloc[unsorted_ridx,:]
-            row_meta = row_meta.iloc[unsorted_ridx,:]
+        data_df = data_df.iloc[:,unsorted_cidx]
+        col_meta = col_meta.iloc[unsorted_cidx,:]
+    
+    if not sort_row_meta:
+        (unsorted_ridx, _) = check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta, col_meta,
+                                                  sort_row_meta, sort_row_meta)
+        data_df = data_df.iloc[unsorted_ridx,:]
+        row_meta = row_meta.iloc[unsorted_ridx,:]
+
+    return (data_df, row_meta, col_meta)
+
+
+def read_version(gctx_file):
+    my_version = gctx_file.attrs[version_node]
+    if type(my_version) == np.ndarray:
+        my_version = my_version[0]
+    return my_version
+
 
-        # get version
+class GCTXReader(object):
+    """
+    Keeps a gctx file open, together with its parsed row and column metadata, so that many
+    slices can be read from it without reopening the file or re-parsing metadata each time.
+    rid / cid lookups use the (hashed) index of the in-memory metadata.
+
+    ex:
+        with parse_gctx.GCTXReader("my_big_file.gctx", rdcc_nbytes=256 * 1024 ** 2) as reader:
+            for my_cids in cid_batches:
+                my_gctoo = reader.slice(cid=my_cids)
+    """
+    def __init__(self, gctx_file_path, convert_neg_666=True, metadata_cache=None, row_fields=None,
+                 col_fields=None, rdcc_nbytes=None, rdcc_nslots=None, rdcc_w0=None):
+        """
+        Input:
+            Mandatory:
+            - gctx_file_path (str): full path to gctx file you want to read from.
+
+            Optional:
+            - convert_neg_666, metadata_cache, row_fields, col_fields: see parse.
+            - rdcc_nbytes (int): size in bytes of the HDF5 chunk cache of the data matrix. Worth
+                raising to hold a whole row (or column) of chunks when slicing the other way.
+                Default = None (HDF5 default, 1 MB).
+            - rdcc_nslots (int): number of hash slots of the chunk cache; ideally a prime ~100x
+                the number of chunks that fit in it. Default = None (HDF5 default).
+            - rdcc_w0 (float): chunk cache preemption policy, see h5py.File. Default = None.
+        """
+        self.full_path = os.path.expanduser(gctx_file_path)
+
+        # Verify that the  path exists
+        if not os.path.exists(self.full_path):
+            err_msg = "The given path to the gctx file cannot be found. full_path: {}"
+            logger.error(err_msg.format(self.full_path))
+            raise Exception(err_msg.format(self.full_path))
+        logger.info("Opening GCTX: {}".format(self.full_path))
+
+        chunk_cache_args = dict([(k, v) for (k, v) in [("rdcc_nbytes", rdcc_nbytes), ("rdcc_nslots", rdcc_nslots),
+                                                       ("rdcc_w0", rdcc_w0)] if v is not None])
+        self.gctx_file = h5py.File(self.full_path, "r", **chunk_cache_args)
+        self.convert_neg_666 = convert_neg_666
+        self.version = read_version(self.gctx_file)
+
+        metadata_cache = gctx_metadata_cache.get_metadata_cache(metadata_cache)
+        self.row_metadata_df = read_metadata(self.gctx_file, "row", convert_neg_666, metadata_cache, row_fields)
+        self.col_metadata_df = read_metadata(self.gctx_file, "col", convert_neg_666, metadata_cache, col_fields)
+
+    def slice(self, rid=None, cid=None, ridx=None, cidx=None, row_filter=None, col_filter=None,
+              sort_row_meta=True, sort_col_meta=True, make_multiindex=False, num_threads=1, workers=1,
+              mode="read"):
+        """
+        Reads a subset of the file into a GCToo; all arguments are as for parse.
+
+        Output:
+            - my_gctoo (GCToo)
+        """
+        (rid, ridx) = apply_metadata_filter(self.gctx_file, "row", rid, ridx, self.row_metadata_df,
+                                            row_filter, self.convert_neg_666)
+        (cid, cidx) = apply_metadata_filter(self.gctx_file, "col", cid, cidx, self.col_metadata_df,
+                                            col_filter, self.convert_neg_666)
+
+        (data_df, row_meta, col_meta) = read_data_and_subset_metadata(
+            self.gctx_file, self.full_path, rid, ridx, cid, cidx, self.row_metadata_df, self.col_metadata_df,
+            sort_row_meta, sort_col_meta, num_threads, workers, mode)
+
+        return GCToo.GCToo(data_df=data_df, row_metadata_df=row_meta, col_metadata_df=col_meta,
+                           src=self.full_path, version=self.version, make_multiindex=make_multiindex)
+
+    def close(self):
+        self.gctx_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iterate(gctx_file_path, block_size=None, dim="col", convert_neg_666=True, as_gctoo=False,
+            metadata_cache=None, row_fields=None, col_fields=None):
+    """
+    Generator that reads a gctx file a block of columns (or rows) at a time, so that
+    files larger than memory can be processed. Metadata is parsed only once, and each
+    block is read with a single hyperslab aligned to the HDF5 chunks of the matrix.
+
+    Input:
+        Mandatory:
+        - gctx_file_path (str): full path to gctx file you want to parse.
+
+        Optional:
+        - block_size (int): number of columns (or rows) per block. Rounded up to a
+            multiple of the matrix chunk shape along dim. Default = one chunk
+            (or default_block_size if the matrix is not chunked).
+        - dim (str): "col" to iterate over blocks of columns, "row" for blocks of rows.
+            Default = "col".
+        - convert_neg_666 (bool): whether to convert -666 values to numpy.nan or not.
+            Default = True.
+        - as_gctoo (bool): whether to yield each block as a GCToo instance (with the
+            full metadata of the other dimension) instead of a data_df. Default = False.
+        - metadata_cache (MetadataCache or str): see parse. Default = None.
+        - row_fields (list of strings): see parse. Default = None.
+        - col_fields (list of strings): see parse. Default = None.
+
+    Output:
+        - generator of (block, meta_block) tuples, where block is the data_df (or GCToo)
+            of the block and meta_block is the column (or row) metadata of the block.
+    """
+    assert dim in ["row", "col"], "dim specified must be either 'row' or 'col'"
+
+    full_path = os.path.expanduser(gctx_file_path)
+    if not os.path.exists(full_path):
+        err_msg = "The given path to the gctx file cannot be found. full_path: {}"
+        logger.error(err_msg.format(full_path))
+        raise Exception(err_msg.format(full_path))
+    logger.info("Iterating over GCTX: {}".format(full_path))
+
+    metadata_cache = gctx_metadata_cache.get_metadata_cache(metadata_cache)
+
+    gctx_file = h5py.File(full_path, "r")
+    try:
+        row_meta = read_metadata(gctx_file, "row", convert_neg_666, metadata_cache, row_fields)
+        col_meta = read_metadata(gctx_file, "col", convert_neg_666, metadata_cache, col_fields)
         my_version = gctx_file.attrs[version_node]
         if type(my_version) == np.ndarray:
             my_version = my_version[0]
 
+        data_dset = gctx_file[data_node]
+
+        # the matrix is stored as cid x rid
+        axis = 0 if dim == "col" else 1
+        block_size = calculate_block_size(data_dset, axis, block_size)
+        logger.debug("block_size:  {}".format(block_size))
+
+        for start in range(0, data_dset.shape[axis], block_size):
+            stop = min(start + block_size, data_dset.shape[axis])
+            data_array = read_data_block(data_dset, axis, start, stop)
+
+            if dim == "col":
+                meta_block = col_meta.iloc[start:stop]
+                data_df = pd.DataFrame(data_array, index=row_meta.index, columns=meta_block.index)
+            else:
+                meta_block = row_meta.iloc[start:stop]
+                data_df = pd.DataFrame(data_array, index=meta_block.index, columns=col_meta.index)
+
+            if as_gctoo:
+                block = GCToo.GCToo(data_df=data_df,
+                                    row_metadata_df=row_meta if dim == "col" else meta_block,
+                                    col_metadata_df=meta_block if dim == "col" else col_meta,
+                                    src=full_path, version=my_version)
+            else:
+                block = data_df
+            yield (block, meta_block)
+    finally:
         gctx_file.close()
 
-        # make GCToo instance
-        my_gctoo = GCToo.GCToo(data_df=data_df, row_metadata_df=row_meta, col_metadata_df=col_meta,
-                               src=full_path, version=my_version, make_multiindex=make_multiindex)
-        return my_gctoo
+
+def calculate_block_size(data_dset, axis, block_size):
+    """
+    Rounds block_size up to a whole number of chunks along axis of data_dset.
+
+    Input:
+        - data_dset (h5py dset): the data matrix
+        - axis (int): axis of data_dset being iterated over
+        - block_size (int or None): requested block size; None means one chunk
+    Output:
+        - block_size (int)
+    """
+    chunk_len = data_dset.chunks[axis] if data_dset.chunks is not None else 1
+    if block_size is None:
+        block_size = chunk_len if data_dset.chunks is not None else default_block_size
+    block_size = max(1, int(block_size))
+    return int(np.ceil(float(block_size) / chunk_len)) * chunk_len
+
+
+def read_data_block(data_dset, axis, start, stop):
+    """
+    Reads the contiguous range [start, stop) along axis of data_dset with a single hyperslab.
+
+    Output:
+        - data_array (numpy array): float32, oriented rid x cid like data_df
+    """
+    if axis == 0:
+        selection = np.s_[start:stop, :]
+        data_array = np.empty((stop - start, data_dset.shape[1]), dtype=np.float32)
+    else:
+        selection = np.s_[:, start:stop]
+        data_array = np.empty((data_dset.shape[0], stop - start), dtype=np.float32)
+    data_dset.read_direct(data_array, source_sel=selection)
+    decode_quantized_array(data_dset, data_array)
+    return data_array.transpose()
+
+
+def apply_metadata_filter(gctx_file, dim, id_list, idx_list, meta_df, meta_filter, convert_neg_666):
+    """
+    Restricts a row or column selection to the entries whose metadata matches meta_filter.
+    Filter fields that were not loaded into meta_df (see row_fields / col_fields) are read
+    on their own; no other metadata is read.
+
+    Input:
+        - gctx_file (h5py File): open gctx file
+        - dim (str): "row" or "col"
+        - id_list (list or None): ids already selected by the caller
+        - idx_list (list or None): indexes already selected by the caller
+        - meta_df (pandas DataFrame): the parsed metadata of dim
+        - meta_filter (dict or None): {field: condition}, see parse
+        - convert_neg_666 (bool): whether "-666" values were converted to np.nan
+    Output:
+        - (id_list, idx_list): inputs unchanged if meta_filter is None, otherwise
+            (None, indexes of the selected entries that pass the filter)
+    """
+    if meta_filter is None:
+        return (id_list, idx_list)
+
+    missing_fields = [f for f in meta_filter.keys() if f not in meta_df.columns]
+    if len(missing_fields) > 0:
+        meta_group = gctx_file[row_meta_group_node if dim == "row" else col_meta_group_node]
+        filter_df = pd.concat([meta_df, parse_metadata_df(dim, meta_group, convert_neg_666, missing_fields)], axis=1)
+    else:
+        filter_df = meta_df
+    mask = evaluate_metadata_filter(filter_df, meta_filter)
+
+    (id_type, id_values) = check_id_idx_exclusivity(id_list, idx_list)
+    if id_type == "id":
+        check_id_validity(convert_ids_to_meta_type(id_values, meta_df), meta_df)
+        positions = meta_df.index.get_indexer([str(i) for i in id_values])
+    elif id_type == "idx":
+        check_idx_validity(id_values, meta_df, True)
+        positions = np.asarray(id_values, dtype=np.int64)
+    else:
+        positions = np.arange(meta_df.shape[0])
+
+    filtered_idx = [int(i) for i in positions[mask[positions]]]
+    logger.info("{} filter kept {} of {} {}s".format(dim, len(filtered_idx), len(positions), dim))
+    return (None, filtered_idx)
+
+
+def evaluate_metadata_filter(meta_df, meta_filter):
+    """
+    Evaluates a {field: condition} filter against metadata.
+
+    Input:
+        - meta_df (pandas DataFrame): metadata containing every field of meta_filter
+        - meta_filter (dict): maps field to a value (equality), a list, tuple, set or
+            array of values (membership) or a function of the field's pandas Series
+            returning a boolean mask
+    Output:
+        - mask (numpy array of bool): whether each entry of meta_df matches all conditions
+    """
+    mask = np.ones(meta_df.shape[0], dtype=bool)
+    for (field, condition) in meta_filter.items():
+        values = meta_df[field]
+        if callable(condition):
+            field_mask = condition(values)
+        elif isinstance(condition, (list, tuple, set, frozenset, np.ndarray, pd.Index, pd.Series)):
+            field_mask = values.isin(list(condition))
+        else:
+            field_mask = values == condition
+        mask &= np.asarray(field_mask, dtype=bool)
+    return mask
 
 
 def check_and_order_id_inputs(rid, ridx, cid, cidx, row_meta_df, col_meta_df, sort_row_meta, sort_col_meta):
@@ -219,9 +584,8 @@ def check_and_convert_ids(id_type, id_list, meta_df, sort_id):
 
 
 def check_id_validity(id_list, meta_df):
-    id_set = set(id_list)
-    meta_set = set(meta_df.index)
-    mismatch_ids = id_set - meta_set
+    id_index = pd.Index(id_list)
+    mismatch_ids = set(id_index[~id_index.isin(meta_df.index)])
     if len(mismatch_ids) > 0:
         msg = "some of the ids being used to subset the data are not present in the metadata for the file being parsed - mismatch_ids:  {}".format(
             mismatch_ids)
@@ -231,13 +595,16 @@ def check_id_validity(id_list, meta_df):
 
 def check_idx_validity(id_list, meta_df, sort_id):
     if sort_id:
-        N = meta_df.shape[0]
-        out_of_range_ids = [my_id for my_id in id_list if my_id < 0 or my_id >= N]
-        if len(out_of_range_ids):
-            msg = "some of indexes being used to subset the data are not valid max N:  {}  out_of_range_ids:  {}".format(N,
-                                                                                                     out_of_range_ids)
-            logger.error(msg)
-            raise Exception("parse_gctx check_idx_validity " + msg)
+        check_idx_range(id_list, meta_df.shape[0])
+
+
+def check_idx_range(id_list, N):
+    out_of_range_ids = [my_id for my_id in id_list if my_id < 0 or my_id >= N]
+    if len(out_of_range_ids):
+        msg = "some of indexes being used to subset the data are not valid max N:  {}  out_of_range_ids:  {}".format(N,
+                                                                                                 out_of_range_ids)
+        logger.error(msg)
+        raise Exception("parse_gctx check_idx_validity " + msg)
 
 
 def convert_ids_to_meta_type(id_list, meta_df):
@@ -266,37 +633,226 @@ def get_ordered_idx(id_type, id_list, meta_df, sort_idx):
         if id_type is None:
             id_list = range(0, len(list(meta_df.index)))
         elif id_type == "id":
-            lookup = {x: i for (i,x) in enumerate(meta_df.index)}
-            id_list = [lookup[str(i)] for i in id_list]
+            id_list = list(meta_df.index.get_indexer([str(i) for i in id_list]))
         if not sort_idx:
-            return [sorted(id_list).index(i) for i in id_list] 
+            return list(np.searchsorted(sorted(id_list), id_list))
         return sorted(id_list)
     else:
         return None
 
 
-def parse_metadata_df(dim, meta_group, convert_neg_666):
+def lookup_ids_with_index(gctx_file, dim, id_list, idx_list):
+    """
+    Converts a list of ids to the equivalent list of indexes using the sorted id index
+    written by write_gctx (under /0/ID_INDEX), without reading any metadata. The index is
+    binary searched on disk (see search_sorted_dset), so only about log(N) chunks of it are
+    read for each id rather than the whole index.
+
+    Input:
+        - gctx_file (h5py File): open gctx file
+        - dim (str): "row" or "col"
+        - id_list (list or None): ids to look up
+        - idx_list (list or None): indexes; if provided, nothing is looked up
+    Output:
+        - (id_list, idx_list): (None, indexes in the order of id_list) if the ids were
+            looked up; otherwise the inputs unchanged (e.g. the file has no id index)
+    """
+    index_group_node = row_id_index_group_node if dim == "row" else col_id_index_group_node
+    if id_list is None or idx_list is not None or index_group_node not in gctx_file:
+        return (id_list, idx_list)
+
+    query_ids = np.array([str(x).encode("utf-8") for x in id_list], dtype=bytes)
+    (positions, found) = search_sorted_dset(gctx_file[index_group_node + "/" + sorted_id_node], query_ids)
+    if not np.all(found):
+        mismatch_ids = set([id_list[i] for i in np.flatnonzero(~found)])
+        msg = "some of the ids being used to subset the data are not present in the metadata for the file being parsed - mismatch_ids:  {}".format(
+            mismatch_ids)
+        logger.error(msg)
+        raise Exception("parse_gctx check_id_validity " + msg)
+
+    # read only the permutation entries of the ids found
+    (unique_positions, inverse) = np.unique(positions, return_inverse=True)
+    sorted_idx = read_dset_points(gctx_file[index_group_node + "/" + sorted_idx_node], unique_positions)
+    return (None, [int(i) for i in sorted_idx[inverse]])
+
+
+def search_sorted_dset(dset, query_values):
+    """
+    Binary searches a sorted 1D dataset on disk for each of query_values. The queries are
+    sorted and split at each probed entry, so queries that fall in the same part of the
+    dataset share probes; a range is read whole once reading it costs no more than probing
+    it once per query that falls in it (about a chunk per query).
+
+    Input:
+        - dset (h5py dset): sorted 1D dataset
+        - query_values (numpy array): values to look for, comparable with dset's values
+    Output:
+        - positions (numpy array of int64): for each query, the position np.searchsorted
+            would return for it on the whole dataset
+        - found (numpy array of bool): whether dset holds each query at that position
+    """
+    num_values = dset.shape[0]
+    block_len = max(2, dset.chunks[0] if dset.chunks is not None else default_index_block_len)
+    order = np.argsort(query_values, kind="mergesort")
+    sorted_queries = query_values[order]
+    positions = np.empty(len(query_values), dtype=np.int64)
+    found = np.zeros(len(query_values), dtype=bool)
+
+    # each entry: the queries sorted_queries[q_start:q_stop] have their position in [start, stop]
+    ranges = [(0, num_values, 0, len(sorted_queries))]
+    while len(ranges) > 0:
+        (start, stop, q_start, q_stop) = ranges.pop()
+        if q_start == q_stop:
+            continue
+        if stop - start <= block_len * (q_stop - q_start):
+            values = dset[start:stop]
+            queries = sorted_queries[q_start:q_stop]
+            block_positions = np.searchsorted(values, queries)
+            in_block = block_positions < len(values)
+            block_found = np.zeros(len(queries), dtype=bool)
+            block_found[in_block] = values[block_positions[in_block]] == queries[in_block]
+            positions[order[q_start:q_stop]] = start + block_positions
+            found[order[q_start:q_stop]] = block_found
+            continue
+        middle = (start + stop) // 2
+        q_split = q_start + np.searchsorted(sorted_queries[q_start:q_stop], dset[middle], side="right")
+        ranges.append((start, middle + 1, q_start, q_split))
+        ranges.append((middle + 1, stop, q_split, q_stop))
+    return (positions, found)
+
+
+def read_dset_points(dset, idx):
+    """
+    Reads the entries of a 1D dataset at the given positions with a single HDF5 point
+    selection (h5py's fancy indexing selects each position as its own hyperslab, which
+    becomes slow for more than a few hundred positions).
+
+    Input:
+        - dset (h5py dset): 1D dataset
+        - idx (numpy array): sorted, unique positions to read
+    Output:
+        - values (numpy array): of dset's dtype; strings are returned as stored (bytes)
+    """
+    values = np.empty(len(idx), dtype=dset.dtype)
+    if len(idx) == 0:
+        return values
+    file_space = dset.id.get_space()
+    file_space.select_elements(np.asarray(idx, dtype=np.uint64).reshape(-1, 1))
+    dset.id.read(h5py.h5s.create_simple((len(idx),)), file_space, values)
+    return values
+
+
+def get_metadata_read_idx(gctx_file, dim, idx_list, meta_filter):
+    """
+    When a dimension is subset by index (given as ridx / cidx, or looked up from rid / cid
+    with lookup_ids_with_index) only the metadata of those entries needs to be read.
+
+    Input:
+        - gctx_file (h5py File): open gctx file
+        - dim (str): "row" or "col"
+        - idx_list (list or None): indexes selected by the caller
+        - meta_filter (dict or None): see parse; evaluating it needs all of the metadata
+    Output:
+        - read_idx (numpy array or None): sorted, unique indexes of the entries to read, or
+            None if all of the metadata must be read
+        - idx_list (list or None): idx_list as positions within the entries read
+    """
+    # the types of fields are inferred from the entries read, so read all of them for an empty selection
+    if idx_list is None or meta_filter is not None or len(idx_list) == 0:
+        return (None, idx_list)
+    check_idx_range(idx_list, gctx_file[rid_node if dim == "row" else cid_node].shape[0])
+    read_idx = np.unique(np.asarray(idx_list, dtype=np.int64))
+    return (read_idx, [int(i) for i in np.searchsorted(read_idx, idx_list)])
+
+
+def read_metadata(gctx_file, dim, convert_neg_666, metadata_cache, fields=None, idx=None):
+    """
+    Reads row or column metadata from an open gctx file, using metadata_cache if provided.
+
+    Input:
+        - gctx_file (h5py File): open gctx file
+        - dim (str): "row" or "col"
+        - convert_neg_666 (bool): whether to convert "-666" values to np.nan or not
+        - metadata_cache (MetadataCache or None)
+        - fields (list or None): metadata fields to read; None means all of them
+        - idx (numpy array or None): sorted, unique indexes of the only entries to read (see
+            get_metadata_read_idx). A cached entry is subset to them; what is read is not
+            cached, as the cache holds whole metadata. Default = None (all entries).
+    Output:
+        - meta_df (pandas DataFrame)
+    """
+    cache_fields = None if fields is None else tuple(fields)
+    if metadata_cache is not None:
+        meta_df = metadata_cache.get(gctx_file.filename, dim, convert_neg_666=convert_neg_666,
+                                     fields=cache_fields)
+        if meta_df is not None:
+            return meta_df if idx is None else meta_df.iloc[idx]
+
+    if idx is not None:
+        meta_group = gctx_file[row_meta_group_node if dim == "row" else col_meta_group_node]
+        return parse_metadata_df(dim, meta_group, convert_neg_666, fields, idx)
+
+    meta_group = gctx_file[row_meta_group_node if dim == "row" else col_meta_group_node]
+    meta_df = parse_metadata_df(dim, meta_group, convert_neg_666, fields)
+
+    if metadata_cache is not None:
+        metadata_cache.put(gctx_file.filename, dim, meta_df, convert_neg_666=convert_neg_666,
+                           fields=cache_fields)
+    return meta_df
+
+
+def parse_metadata_df(dim, meta_group, convert_neg_666, fields=None, idx=None):
     """
     Reads in all metadata from .gctx file to pandas DataFrame
-    with proper GCToo specifications.
+    with proper GCToo specifications. Fields written with their dtype recorded
+    (write_gctx.write(..., typed_metadata=True)) are read as that dtype, or as a pandas
+    Categorical if dictionary-encoded, without type inference; if not convert_neg_666,
+    their missing values are "-666", as in untyped fields (see restore_neg_666).
     Input:
         - dim (str): Dimension of metadata; either "row" or "column"
         - meta_group (HDF5 group): Group from which to read metadata values
         - convert_neg_666 (bool): whether to convert "-666" values to np.nan or not
+        - fields (list or None): metadata fields to read (the ids are always read);
+            datasets of other fields are never touched. Default = None (all fields).
+        - idx (numpy array or None): sorted, unique indexes of the only entries to read. The
+            result is the same as reading all entries and taking these: fields whose type
+            could depend on the entries not read (see get_fields_to_reread) are read in full.
+            Default = None (all entries).
     Output:
         - meta_df (pandas DataFrame): data frame corresponding to metadata fields
             of dimension specified.
     """
+    if fields is None:
+        keys = list(meta_group.keys())
+    else:
+        keys = ["id"] + [f for f in fields if f != "id"]
+        missing_fields = [k for k in keys if k not in meta_group]
+        if len(missing_fields) > 0:
+            msg = "some of the requested {} metadata fields are not present in the file - missing_fields:  {}".format(
+                dim, missing_fields)
+            logger.error(msg)
+            raise Exception("parse_gctx parse_metadata_df " + msg)
+
     # read values from hdf5 & make a DataFrame
     header_values = {}
+    typed_values = {}
     array_index = 0
-    for k in meta_group.keys():
+    for k in keys:
         curr_dset = meta_group[k]
-        temp_array = np.empty(curr_dset.shape, dtype=curr_dset.dtype)
-        curr_dset.read_direct(temp_array)
-        # convert all values to str in temp_array so that
-        # to_numeric works consistently with gct and gct_x parser
-        temp_array = temp_array.astype('str')
+        field_dtype = getattr(curr_dset, "attrs", {}).get(metadata_dtype_attr)
+        if field_dtype is not None:
+            typed_values[str(k)] = read_typed_metadata_field(dim, str(k), curr_dset, field_dtype, idx)
+            continue
+        if is_vlen_string_dset(curr_dset):
+            temp_array = read_string_array(curr_dset, idx)
+        elif idx is not None:
+            temp_array = read_dset_points(curr_dset, idx).astype('str')
+        else:
+            temp_array = np.empty(curr_dset.shape, dtype=curr_dset.dtype)
+            curr_dset.read_direct(temp_array)
+            # convert all values to str in temp_array so that
+            # to_numeric works consistently with gct and gct_x parser
+            temp_array = temp_array.astype('str')
         header_values[str(k)] = temp_array
         array_index = array_index + 1
 
@@ -311,18 +867,143 @@ def parse_metadata_df(dim, meta_group, convert_neg_666):
     # Convert metadata to numeric if possible, after converting everything to string first
     # Note: This conversion first to string is to ensure consistent behavior between
     #    the gctx and gct parser (which by default reads the entire text file into a string)
-    meta_df = meta_df.apply(lambda x: pd.to_numeric(x, errors="ignore"))
+    if meta_df.shape[1] > 0:
+        meta_df = meta_df.apply(lambda x: pd.to_numeric(x, errors="ignore"))
+
+    # typed fields are used as stored
+    if len(typed_values) > 0:
+        for (k, values) in typed_values.items():
+            meta_df[k] = values if convert_neg_666 else restore_neg_666(values)
+        meta_df = meta_df[[str(k) for k in keys if str(k) != "id"]]
 
     meta_df.set_index(pd.Index(ids, dtype=str), inplace=True)
 
     # Replace -666 and -666.0 with NaN; also replace "-666" if convert_neg_666 is True
     meta_df = replace_666(meta_df, convert_neg_666)
 
+    if idx is not None:
+        reread_fields = get_fields_to_reread(meta_group, meta_df)
+        if len(reread_fields) > 0:
+            full_df = parse_metadata_df(dim, meta_group, convert_neg_666, reread_fields)
+            for field in reread_fields:
+                meta_df[field] = full_df[field].values[idx]
+
     # set index and columns appropriately
     set_metadata_index_and_column_names(dim, meta_df)
     return meta_df
 
 
+def get_fields_to_reread(meta_group, meta_df):
+    """
+    Whether a metadata field is converted to numbers, and to which dtype, depends on all of its
+    values: a single non-numeric value keeps it as strings, a single decimal makes it float, and
+    a single -666 (replaced with NaN) makes integers float. Given metadata parsed from only some
+    entries, returns the fields that could have come out differently had all entries been read:
+    integer fields, and untyped fields stored as strings that were converted to float.
+
+    Input:
+        - meta_group (HDF5 group): group meta_df was read from
+        - meta_df (pandas DataFrame): metadata parsed from some of the entries
+    Output:
+        - fields (list of str)
+    """
+    fields = []
+    for field in meta_df.columns:
+        kind = meta_df[field].dtype.kind
+        dset = meta_group[field]
+        stored_as_strings = dset.dtype.kind in ("S", "O", "U") and metadata_dtype_attr not in dset.attrs
+        if kind in ("i", "u") or (kind == "f" and stored_as_strings):
+            fields.append(field)
+    return fields
+
+
+def read_typed_metadata_field(dim, field, dset, field_dtype, idx=None):
+    """
+    Reads a metadata field stored with its dtype recorded (see write_gctx.write_typed_metadata_field).
+
+    Input:
+        - dim (str): "row" or "col"
+        - field (str): name of the field
+        - dset (h5py dset): dataset of the field
+        - field_dtype (str): the dataset's "dtype" attribute
+        - idx (numpy array or None): sorted, unique indexes of the entries to read. Default = None (all).
+    Output:
+        - values (numpy array or pandas Categorical)
+    """
+    if isinstance(field_dtype, bytes):
+        field_dtype = field_dtype.decode("utf-8")
+    if field_dtype == "str":
+        return read_string_array(dset, idx)
+    if idx is not None:
+        values = read_dset_points(dset, idx)
+    else:
+        values = np.empty(dset.shape, dtype=dset.dtype)
+        if values.size > 0:
+            dset.read_direct(values)
+
+    if field_dtype == "category":
+        categories_group_node = row_categories_group_node if dim == "row" else col_categories_group_node
+        categories = read_string_array(dset.file[categories_group_node + "/" + field])
+        return pd.Categorical.from_codes(values, categories=categories)
+    return values.astype(field_dtype, copy=False)
+
+
+def restore_neg_666(values):
+    """
+    Replaces the missing values of a typed metadata field (stored as numpy.nan or as missing
+    category codes, see write_gctx.write_typed_metadata_field) with "-666", which is what
+    untyped fields hold when read with convert_neg_666=False. Float fields with missing
+    values become object arrays, as untyped ones do; "-666" is added to the categories of
+    dictionary-encoded fields.
+
+    Input:
+        - values (numpy array or pandas Categorical): as read by read_typed_metadata_field
+    Output:
+        - values (numpy array or pandas Categorical)
+    """
+    missing = pd.isnull(values)
+    if not missing.any():
+        return values
+    if isinstance(values, pd.Categorical):
+        if "-666" not in values.categories:
+            values = values.add_categories(["-666"])
+        return values.fillna("-666")
+    values = values.astype(object)
+    values[missing] = "-666"
+    return values
+
+
+def is_vlen_string_dset(dset):
+    """Whether dset holds variable-length (UTF-8) strings, see write_gctx.encode_strings."""
+    # h5py.check_dtype rather than check_string_dtype, which needs h5py 2.10+
+    return h5py.check_dtype(vlen=np.dtype(dset.dtype)) in (str, bytes)
+
+
+def is_string_dset(dset):
+    """Whether dset holds fixed-length (ASCII) or variable-length (UTF-8) strings."""
+    return dset.dtype.kind == "S" or is_vlen_string_dset(dset)
+
+
+def read_string_array(dset, idx=None):
+    """
+    Reads a dataset of fixed-length (ASCII) or variable-length (UTF-8) strings, or only
+    the entries at idx (sorted, unique indexes) if given.
+
+    Output:
+        - values (numpy array): str values; of dtype object if variable-length
+    """
+    if idx is not None:
+        values = read_dset_points(dset, idx)
+    elif is_vlen_string_dset(dset) and hasattr(dset, "asstr"):
+        return dset.asstr()[()]
+    else:
+        values = dset[()]
+    if is_vlen_string_dset(dset):
+        # h5py 3 reads variable-length strings as bytes (h5py < 3 as str, and has no asstr)
+        return np.array([v.decode("utf-8") if isinstance(v, bytes) else v for v in values], dtype=object)
+    return values.astype(str)
+
+
 def replace_666(meta_df, convert_neg_666):
     """ Replace -666, -666.0, and optionally "-666".
     Args:
@@ -356,7 +1037,7 @@ def set_metadata_index_and_column_names(dim, meta_df):
         meta_df.columns.name = "chd"
 
 
-def parse_data_df(data_dset, ridx, cidx, row_meta, col_meta):
+def parse_data_df(data_dset, ridx, cidx, row_meta, col_meta, num_threads=1):
     """
     Parses in data_df from hdf5, subsetting if specified.
 
@@ -368,33 +1049,355 @@ def parse_data_df(data_dset, ridx, cidx, row_meta, col_meta):
             (may be all of them if no subsetting)
         -row_meta (pandas DataFrame): the parsed in row metadata
         -col_meta (pandas DataFrame): the parsed in col metadata
+        -num_threads (int): see read_data_array. Default = 1.
     """
-    total_rows = len(row_meta.index)
-    total_cols = len(col_meta.index)
-    if len(ridx) == total_rows and len(cidx) == total_cols:  # no subset
-        data_array = np.empty(data_dset.shape, dtype=np.float32)
-        data_dset.read_direct(data_array)
-        data_array = data_array.transpose()
-    else:
-        # We can only subset on a single dimension at a time with h5py.
-        # For the first dimension to use, pick the one that minimizes
-        # the size of the intermediate array.
-        row_first_count = total_cols * len(ridx)
-        col_first_count = total_rows * len(cidx)
-
-        if row_first_count < col_first_count:
-            first_subset = data_dset[:, ridx].astype(np.float32)
-            data_array = first_subset[cidx, :].transpose()
-        else:
-            first_subset = data_dset[cidx, :].astype(np.float32)
-            data_array = first_subset[:, ridx].transpose()
+    data_array = read_data_array(data_dset, ridx, cidx, num_threads)
 
     # make DataFrame instance
     data_df = pd.DataFrame(data_array, index=row_meta.index[ridx], columns=col_meta.index[cidx])
     return data_df
 
 
-def get_column_metadata(gctx_file_path, convert_neg_666=True):
+def read_data_array(data_dset, ridx, cidx, num_threads=1, out=None):
+    """
+    Reads the requested rows and columns of the data matrix into a float32 array.
+    The values are read straight into a single buffer in on-disk orientation, whose
+    transpose is returned, so no intermediate full-size copy is made.
+
+    Input:
+        -data_dset (h5py dset): HDF5 dataset from which to read (stored as cid x rid)
+        -ridx (list): sorted, unique list of row indexes to read
+        -cidx (list): sorted, unique list of column indexes to read
+        -num_threads (int): number of threads to decompress chunks with (see
+            read_planned_hyperslabs). Default = 1.
+        -out (numpy array): C-contiguous float32 array of shape (len(cidx), len(ridx)) to read
+            into. Default = None (allocate one).
+    Output:
+        - data_array (numpy array): float32 array of shape (len(ridx), len(cidx)),
+            i.e. oriented rid x cid like data_df (the transpose of out)
+    """
+    (total_cols, total_rows) = data_dset.shape
+    if out is None:
+        out = np.empty((len(cidx), len(ridx)), dtype=np.float32)
+    if len(ridx) == 0 or len(cidx) == 0:
+        return out.transpose()
+
+    if len(ridx) == total_rows and len(cidx) == total_cols and num_threads <= 1:  # no subset
+        data_dset.read_direct(out)
+    else:
+        read_planned_hyperslabs(data_dset, np.asarray(cidx, dtype=np.int64), np.asarray(ridx, dtype=np.int64),
+                                num_threads, out)
+    decode_quantized_array(data_dset, out)
+    return out.transpose()
+
+
+def decode_quantized_array(data_dset, data_array):
+    """
+    Converts the int16 codes of a quantized data matrix, already read into the float32
+    data_array, to values in place: code * scale_factor + add_offset, and the missing code
+    to np.nan. Does nothing if data_dset is not quantized.
+    """
+    attrs = data_dset.attrs
+    if scale_factor_attr not in attrs:
+        return data_array
+    missing = data_array == attrs[missing_value_attr]
+    data_array *= np.float32(attrs[scale_factor_attr])
+    data_array += np.float32(attrs[add_offset_attr])
+    data_array[missing] = np.nan
+    return data_array
+
+
+def read_planned_hyperslabs(data_dset, idx0, idx1, num_threads=1, out=None):
+    """
+    Reads a scattered selection of data_dset without h5py point selections: the
+    requested indexes are grouped by HDF5 chunk (or, for contiguous datasets, into runs
+    of consecutive indexes), each group pair is read as one hyperslab -- so every chunk
+    is read at most once -- and the selected values are scattered into a
+    preallocated output array. Hyperslabs covering exactly the requested indexes are read
+    directly into the output; otherwise the temporary buffer is at most one chunk (or
+    max_read_block_bytes for contiguous datasets).
+
+    With num_threads > 1, chunks of a gzip (and/or shuffle) compressed dataset are instead
+    fetched still compressed and decompressed with zlib in a thread pool; zlib releases
+    the GIL, whereas HDF5's own filter pipeline runs under h5py's global lock.
+
+    Input:
+        - data_dset (h5py dset): 2D dataset to read from
+        - idx0 (numpy array of int): sorted, unique indexes along axis 0
+        - idx1 (numpy array of int): sorted, unique indexes along axis 1
+        - num_threads (int): number of decompression threads. Default = 1.
+        - out (numpy array): C-contiguous float32 array of shape (len(idx0), len(idx1)) to
+            read into. Default = None (allocate one).
+    Output:
+        - out (numpy array): float32 array of shape (len(idx0), len(idx1))
+    """
+    if out is None:
+        out = np.empty((len(idx0), len(idx1)), dtype=np.float32)
+
+    if data_dset.chunks is not None:
+        groups0 = plan_axis_reads(idx0, data_dset.chunks[0])
+        groups1 = plan_axis_reads(idx1, data_dset.chunks[1])
+    else:
+        # contiguous datasets are stored row by row; read each run of rows at once
+        row_bytes = data_dset.shape[1] * out.itemsize
+        max_run_len = max(1, min(max_read_block_bytes, out.nbytes // 4) // row_bytes)
+        groups0 = plan_axis_reads(idx0, None, max_run_len)
+        groups1 = plan_axis_reads(idx1, data_dset.shape[1])
+    logger.debug("reading {} x {} hyperslabs".format(len(groups0), len(groups1)))
+    group_pairs = [(group0, group1) for group0 in groups0 for group1 in groups1]
+
+    if num_threads > 1 and can_decompress_chunks(data_dset):
+        chunk_filters = get_chunk_filters(data_dset)
+
+        def read_group_pair(group_pair):
+            ((start0, stop0, out_slice0, local0), (start1, stop1, out_slice1, local1)) = group_pair
+            chunk_offset = (start0 - start0 % data_dset.chunks[0], start1 - start1 % data_dset.chunks[1])
+            chunk = read_decompressed_chunk(data_dset, chunk_offset, chunk_filters)
+            block = chunk[start0 - chunk_offset[0]:stop0 - chunk_offset[0],
+                          start1 - chunk_offset[1]:stop1 - chunk_offset[1]]
+            scatter_block(out, block, out_slice0, local0, out_slice1, local1)
+
+        thread_pool = ThreadPool(num_threads)
+        try:
+            thread_pool.map(read_group_pair, group_pairs)
+        finally:
+            thread_pool.close()
+    else:
+        for ((start0, stop0, out_slice0, local0), (start1, stop1, out_slice1, local1)) in group_pairs:
+            source_sel = np.s_[start0:stop0, start1:stop1]
+            if local0 is None and local1 is None:
+                data_dset.read_direct(out, source_sel=source_sel, dest_sel=np.s_[out_slice0, out_slice1])
+            else:
+                block = np.empty((stop0 - start0, stop1 - start1), dtype=np.float32)
+                data_dset.read_direct(block, source_sel=source_sel)
+                scatter_block(out, block, out_slice0, local0, out_slice1, local1)
+                # free before the next block is allocated
+                del block
+    return out
+
+
+def scatter_block(out, block, out_slice0, local0, out_slice1, local1):
+    if local0 is not None:
+        block = block[local0, :]
+    if local1 is not None:
+        block = block[:, local1]
+    out[out_slice0, out_slice1] = block
+
+
+def can_decompress_chunks(data_dset):
+    """
+    Whether the raw chunks of data_dset can be read and decoded outside of HDF5, i.e.
+    the dataset is chunked and only uses the gzip (deflate) and shuffle filters.
+    """
+    if data_dset.chunks is None or not hasattr(data_dset.id, "read_direct_chunk"):
+        return False
+    return all([f in (h5z.FILTER_DEFLATE, h5z.FILTER_SHUFFLE) for f in get_chunk_filters(data_dset)])
+
+
+def get_chunk_filters(data_dset):
+    """Returns the filter codes of data_dset's filter pipeline, in the order they are applied on write."""
+    dcpl = data_dset.id.get_create_plist()
+    return [dcpl.get_filter(i)[0] for i in range(dcpl.get_nfilters())]
+
+
+def read_decompressed_chunk(data_dset, chunk_offset, chunk_filters):
+    """
+    Reads one raw chunk of data_dset and undoes its filters.
+
+    Input:
+        - data_dset (h5py dset): chunked dataset (see can_decompress_chunks)
+        - chunk_offset (tuple of int): index of the first element of the chunk
+        - chunk_filters (list of int): see get_chunk_filters
+    Output:
+        - chunk (numpy array): full chunk, of shape data_dset.chunks and dtype data_dset.dtype
+    """
+    try:
+        (filter_mask, raw) = data_dset.id.read_direct_chunk(chunk_offset)
+    except RuntimeError:
+        # chunk was never written
+        return np.full(data_dset.chunks, data_dset.fillvalue, dtype=data_dset.dtype)
+
+    # undo filters in reverse order, skipping those that were not applied to this chunk
+    for i in reversed(range(len(chunk_filters))):
+        if filter_mask & (1 << i):
+            continue
+        if chunk_filters[i] == h5z.FILTER_DEFLATE:
+            raw = zlib.decompress(raw)
+        elif chunk_filters[i] == h5z.FILTER_SHUFFLE:
+            raw = unshuffle_bytes(raw, data_dset.dtype)
+    return np.frombuffer(raw, dtype=data_dset.dtype).reshape(data_dset.chunks)
+
+
+def unshuffle_bytes(raw, dtype):
+    """Undoes HDF5's shuffle filter, which stores byte k of every element contiguously."""
+    byte_planes = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    out = np.empty(byte_planes.shape[1], dtype=dtype)
+    out_bytes = out.view(np.uint8).reshape(-1, dtype.itemsize)
+    # copying one byte plane at a time is much faster than a transposed copy
+    for k in range(dtype.itemsize):
+        out_bytes[:, k] = byte_planes[k]
+    return out
+
+
+def plan_axis_reads(indexes, chunk_len, max_run_len=None):
+    """
+    Groups sorted, unique indexes along one axis into hyperslabs to read.
+
+    Input:
+        - indexes (numpy array of int): sorted, unique indexes
+        - chunk_len (int or None): chunk extent along this axis; indexes falling in the
+            same chunk are read together. None groups runs of consecutive indexes instead.
+        - max_run_len (int or None): if given, runs of consecutive indexes are split into
+            pieces of at most this length. Default = None.
+    Output:
+        - groups (list of tuples): (start, stop, out_slice, local) per hyperslab, where
+            [start, stop) is the range to read, out_slice the positions of the group within
+            indexes and local the positions of the group within the range read (None if
+            the whole range is wanted)
+    """
+    if chunk_len is None:
+        breaks = np.flatnonzero(np.diff(indexes) != 1) + 1
+    else:
+        breaks = np.flatnonzero(np.diff(indexes // chunk_len) != 0) + 1
+    bounds = np.concatenate(([0], breaks, [len(indexes)]))
+    if max_run_len is not None:
+        bounds = np.unique(np.concatenate([np.arange(first, last, max_run_len)
+                                           for (first, last) in zip(bounds[:-1], bounds[1:])] + [[len(indexes)]]))
+
+    groups = []
+    for (first, last) in zip(bounds[:-1], bounds[1:]):
+        group = indexes[first:last]
+        start = int(group[0])
+        stop = int(group[-1]) + 1
+        local = None if stop - start == len(group) else group - start
+        groups.append((start, stop, slice(int(first), int(last)), local))
+    return groups
+
+
+def map_data_array(gctx_file_path, data_dset, ridx, cidx):
+    """
+    Memory-maps the data matrix directly from the gctx file with numpy.memmap.
+
+    Input:
+        - gctx_file_path (str): full path to gctx file
+        - data_dset (h5py dset): the data matrix; must be stored contiguous and unfiltered
+        - ridx (list): sorted, unique list of row indexes to keep
+        - cidx (list): sorted, unique list of column indexes to keep
+    Output:
+        - data_array (numpy array): read-only array of shape (len(ridx), len(cidx)); a view of
+            the mapping if every row and column is kept, otherwise a copy of the subset
+    """
+    offset = data_dset.id.get_offset() if data_dset.chunks is None else None
+    if offset is None or data_dset.compression is not None or data_dset.dtype.kind != "f":
+        err_msg = ("the data matrix can only be memory-mapped if it is stored contiguous, uncompressed, "
+                   "allocated and as floats - chunks:  {}  compression:  {}  dtype:  {}").format(
+            data_dset.chunks, data_dset.compression, data_dset.dtype)
+        logger.error(err_msg)
+        raise Exception("parse_gctx.map_data_array " + err_msg)
+
+    mapped = np.memmap(gctx_file_path, dtype=data_dset.dtype, mode="r", offset=offset, shape=data_dset.shape)
+    (total_cols, total_rows) = data_dset.shape
+    if len(ridx) == total_rows and len(cidx) == total_cols:
+        return mapped.transpose()
+    return mapped[np.ix_(cidx, ridx)].transpose()
+
+
+def read_data_array_shared(gctx_file_path, ridx, cidx, workers, num_threads=1):
+    """
+    Reads the requested rows and columns of the data matrix with a pool of worker
+    processes. The columns are partitioned (along chunk boundaries) across the workers;
+    each opens the file itself and writes its columns straight into one shared memory
+    buffer, so neither h5py's global lock nor pickling results back limits the read.
+
+    Input:
+        - gctx_file_path (str): full path to gctx file
+        - ridx (list): sorted, unique list of row indexes to read
+        - cidx (list): sorted, unique list of column indexes to read
+        - workers (int): number of processes
+        - num_threads (int): see read_data_array; used within each worker. Default = 1.
+    Output:
+        - data_array (numpy array): float32 array of shape (len(ridx), len(cidx)) backed by
+            shared memory, which is released once the array is garbage collected
+    """
+    try:
+        # Python 3.8+
+        from multiprocessing import shared_memory
+    except ImportError:
+        msg = "reading with workers > 1 requires Python 3.8 or later (multiprocessing.shared_memory) - workers:  {}".format(
+            workers)
+        logger.error(msg)
+        raise Exception("parse_gctx.read_data_array_shared " + msg)
+
+    ridx = np.asarray(ridx, dtype=np.int64)
+    cidx = np.asarray(cidx, dtype=np.int64)
+    shape = (len(cidx), len(ridx))  # on-disk orientation
+    if len(ridx) == 0 or len(cidx) == 0:
+        return np.empty(shape, dtype=np.float32).transpose()
+
+    with h5py.File(gctx_file_path, "r") as gctx_file:
+        chunks = gctx_file[data_node].chunks
+    partitions = partition_indexes(cidx, workers, chunks[0] if chunks is not None else None)
+    logger.debug("reading data_df with {} worker processes".format(len(partitions)))
+
+    shm = shared_memory.SharedMemory(create=True, size=shape[0] * shape[1] * np.dtype(np.float32).itemsize)
+    try:
+        tasks = [(gctx_file_path, shm.name, shape, ridx, cidx[start:stop], start, num_threads)
+                 for (start, stop) in partitions]
+        pool = multiprocessing.Pool(len(partitions))
+        try:
+            pool.map(read_partition_into_shared_memory, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+    data_array = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    # the mapping outlives the name; release it once nothing references the array
+    shm.unlink()
+    weakref.finalize(data_array, shm.close)
+    return data_array.transpose()
+
+
+def read_partition_into_shared_memory(task):
+    """Worker for read_data_array_shared: reads columns cidx into rows [start, start + len(cidx)) of the buffer."""
+    from multiprocessing import shared_memory
+
+    (gctx_file_path, shm_name, shape, ridx, cidx, start, num_threads) = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        with h5py.File(gctx_file_path, "r") as gctx_file:
+            read_data_array(gctx_file[data_node], ridx, cidx, num_threads, out[start:start + len(cidx), :])
+        del out
+    finally:
+        shm.close()
+
+
+def partition_indexes(indexes, n_parts, chunk_len):
+    """
+    Splits sorted indexes into at most n_parts contiguous (start, stop) position ranges of
+    similar size, moving each split forward to a chunk boundary so that no HDF5 chunk is
+    read by more than one partition.
+
+    Input:
+        - indexes (numpy array of int): sorted, unique indexes
+        - n_parts (int): number of partitions wanted
+        - chunk_len (int or None): chunk length along this axis; None if not chunked
+    Output:
+        - partitions (list of tuples): non-empty (start, stop) ranges of positions in indexes
+    """
+    splits = [int(round(i * len(indexes) / float(n_parts))) for i in range(1, n_parts)]
+    if chunk_len is not None:
+        splits = [int(np.searchsorted(indexes, (indexes[p - 1] // chunk_len + 1) * chunk_len)) if p > 0 else 0
+                  for p in splits]
+    bounds = sorted(set([0] + splits + [len(indexes)]))
+    return [(start, stop) for (start, stop) in zip(bounds[:-1], bounds[1:])]
+
+
+def get_column_metadata(gctx_file_path, convert_neg_666=True, metadata_cache=None, fields=None):
     """
     Opens .gctx file and returns only column metadata
 
@@ -404,6 +1407,8 @@ def get_column_metadata(gctx_file_path, convert_neg_666=True):
 
         Optional:
         - convert_neg_666 (bool): whether to convert -666 values to num
+        - metadata_cache (MetadataCache or str): see parse. Default = None.
+        - fields (list of strings): only read these metadata fields. Default = None (all fields).
 
     Output:
         - col_meta (pandas DataFrame): a DataFrame of all column metadata values.
@@ -411,13 +1416,13 @@ def get_column_metadata(gctx_file_path, convert_neg_666=True):
     full_path = os.path.expanduser(gctx_file_path)
     # open file
     gctx_file = h5py.File(full_path, "r")
-    col_dset = gctx_file[col_meta_group_node]
-    col_meta = parse_metadata_df("col", col_dset, convert_neg_666)
+    col_meta = read_metadata(gctx_file, "col", convert_neg_666,
+                             gctx_metadata_cache.get_metadata_cache(metadata_cache), fields)
     gctx_file.close()
     return col_meta
 
 
-def get_row_metadata(gctx_file_path, convert_neg_666=True):
+def get_row_metadata(gctx_file_path, convert_neg_666=True, metadata_cache=None, fields=None):
     """
     Opens .gctx file and returns only row metadata
 
@@ -427,6 +1432,8 @@ def get_row_metadata(gctx_file_path, convert_neg_666=True):
 
         Optional:
         - convert_neg_666 (bool): whether to convert -666 values to num
+        - metadata_cache (MetadataCache or str): see parse. Default = None.
+        - fields (list of strings): only read these metadata fields. Default = None (all fields).
 
     Output:
         - row_meta (pandas DataFrame): a DataFrame of all row metadata values.
@@ -434,7 +1441,7 @@ def get_row_metadata(gctx_file_path, convert_neg_666=True):
     full_path = os.path.expanduser(gctx_file_path)
     # open file
     gctx_file = h5py.File(full_path, "r")
-    row_dset = gctx_file[row_meta_group_node]
-    row_meta = parse_metadata_df("row", row_dset, convert_neg_666)
+    row_meta = read_metadata(gctx_file, "row", convert_neg_666,
+                             gctx_metadata_cache.get_metadata_cache(metadata_cache), fields)
     gctx_file.close()
     return row_meta
@@ -10,6 +10,7 @@ import logging
 import sys
 import os
 import argparse
+import pandas as pd
 
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
 import cmapPy.pandasGEXpress.parse_gct as parse_gct
@@ -39,6 +40,10 @@ def build_parser():
     parser.add_argument("--cid", nargs="+", help="filepath to grp file or string array for including cols")
     parser.add_argument("--exclude_rid", "-er", nargs="+", help="filepath to grp file or string array for excluding rows")
     parser.add_argument("--exclude_cid", "-ec", nargs="+", help="filepath to grp file or string array for excluding cols")
+    parser.add_argument("--row_filter", "-rf", nargs="+",
+                        help="keep only rows whose metadata matches, given as field=value[,value...] (e.g. pr_is_lm=1)")
+    parser.add_argument("--col_filter", "-cf", nargs="+",
+                        help="keep only cols whose metadata matches, given as field=value[,value...] (e.g. pert_type=trt_cp cell_id=A375,MCF7)")
     parser.add_argument("--out_name", "-o", default="ds_subsetted.gct",
                         help="what to name the output file")
     parser.add_argument("--out_type", default="gct", choices=["gct", "gctx"],
@@ -65,6 +70,8 @@ def subset_main(args):
     cid = _read_arg(args.cid)
     exclude_rid = _read_arg(args.exclude_rid)
     exclude_cid = _read_arg(args.exclude_cid)
+    row_filter = _read_filter_arg(args.row_filter)
+    col_filter = _read_filter_arg(args.col_filter)
 
     # If GCT, use subset_gctoo
     if args.in_path.endswith(".gct"):
@@ -74,6 +81,13 @@ def subset_main(args):
                                  exclude_rid=exclude_rid,
                                  exclude_cid=exclude_cid)
 
+        if (row_filter is not None) or (col_filter is not None):
+            row_bool = (parse_gctx.evaluate_metadata_filter(out_gct.row_metadata_df, row_filter)
+                        if row_filter is not None else None)
+            col_bool = (parse_gctx.evaluate_metadata_filter(out_gct.col_metadata_df, col_filter)
+                        if col_filter is not None else None)
+            out_gct = sg.subset_gctoo(out_gct, row_bool=row_bool, col_bool=col_bool)
+
     # If GCTx, use parse_gctx
     else:
 
@@ -82,7 +96,8 @@ def subset_main(args):
             raise(Exception(msg))
 
         logger.info("Using hyperslab selection functionality of parse_gctx...")
-        out_gct = parse_gctx.parse(args.in_path, rid=rid, cid=cid)
+        out_gct = parse_gctx.parse(args.in_path, rid=rid, cid=cid,
+                                   row_filter=row_filter, col_filter=col_filter)
 
     # Write the output gct
     if args.out_type == "gctx":
@@ -121,5 +136,37 @@ def _read_arg(arg):
     return arg_out
 
 
+def _read_filter_arg(arg):
+    """
+    Converts a list of "field=value[,value...]" strings into a metadata filter
+    (see parse_gctx.parse). Values are compared as strings so that numeric
+    metadata fields can be filtered on as well.
+
+    Args:
+        arg (list or None)
+
+    Returns:
+        meta_filter (dict or None)
+    """
+    if arg is None:
+        return None
+
+    meta_filter = {}
+    for entry in arg:
+        assert "=" in entry, "filters must be given as field=value[,value...] - entry:  {}".format(entry)
+        (field, values) = entry.split("=", 1)
+        meta_filter[field] = _str_isin(values.split(","))
+
+    return meta_filter
+
+
+def _str_isin(values):
+    def isin(field_series):
+        if pd.api.types.is_numeric_dtype(field_series):
+            return field_series.isin(pd.to_numeric(pd.Series(values), errors="coerce").dropna())
+        return field_series.astype(str).isin(values)
+    return isin
+
+
 if __name__ == "__main__":
     main()
@@ -6,6 +6,7 @@ import cmapPy.pandasGEXpress.gct2gctx as gct2gctx
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
 import cmapPy.pandasGEXpress.parse_gct as parse_gct
 import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
 
 logger = logging.getLogger(setup_logger.LOGGER_NAME)
 
@@ -49,6 +50,60 @@ class TestGCT2GCTx(unittest.TestCase):
 		os.remove(out_name)
 		os.remove(added_meta)
 
+	def test_gct2gctx_main_blocks(self):
+
+		in_name = "cmapPy/pandasGEXpress/tests/functional_tests/test_l1000.gct"
+		out_name = "cmapPy/pandasGEXpress/tests/functional_tests/test_gct2gctx_blocks_out.gctx"
+		args_string = "-f {} -o {} -block_size 100".format(in_name, out_name)
+		args = gct2gctx.build_parser().parse_args(args_string.split())
+
+		gct2gctx.gct2gctx_main(args)
+
+		# Converting in blocks of rows gives the same file
+		in_gct = parse_gct.parse(in_name)
+		out_gctx = parse_gctx.parse(out_name)
+
+		pd.testing.assert_frame_equal(in_gct.data_df, out_gctx.data_df)
+		pd.testing.assert_frame_equal(in_gct.col_metadata_df, out_gctx.col_metadata_df, check_like=True)
+		pd.testing.assert_frame_equal(in_gct.row_metadata_df, out_gctx.row_metadata_df, check_like=True)
+
+		os.remove(out_name)
+
+	def test_gct2gctx_main_blocks_mixed_types(self):
+
+		# pr_gene_id is numeric in the first block of 2 rows only, pr_dose in every block
+		in_name = "cmapPy/pandasGEXpress/tests/functional_tests/test_gct2gctx_mixed_types.gct"
+		out_name = "cmapPy/pandasGEXpress/tests/functional_tests/test_gct2gctx_mixed_types_out.gctx"
+		expected_name = "cmapPy/pandasGEXpress/tests/functional_tests/test_gct2gctx_mixed_types_expected.gctx"
+		with open(in_name, "w") as f:
+			f.write("#1.3\n4\t2\t2\t1\n")
+			f.write("id\tpr_gene_id\tpr_dose\tc1\tc2\n")
+			f.write("qc_iqr\t-666\t-666\t1.5\t2.5\n")
+			f.write("r1\t007\t1\t1\t2\n")
+			f.write("r2\t12\t-666\t3\t4\n")
+			f.write("r3\t1.50\t2.5\t5\t6\n")
+			f.write("r4\tabc\t4\t7\t8\n")
+		args = gct2gctx.build_parser().parse_args("-f {} -o {} -block_size 2".format(in_name, out_name).split())
+
+		gct2gctx.gct2gctx_main(args)
+
+		# Same as converting the parsed file at once
+		write_gctx.write(parse_gct.parse(in_name, convert_neg_666=False), expected_name)
+		out_gctx = parse_gctx.parse(out_name)
+		expected_gctx = parse_gctx.parse(expected_name)
+
+		self.assertEqual(["007", "12", "1.50", "abc"], list(out_gctx.row_metadata_df["pr_gene_id"]))
+		pd.testing.assert_frame_equal(expected_gctx.data_df, out_gctx.data_df)
+		pd.testing.assert_frame_equal(expected_gctx.row_metadata_df, out_gctx.row_metadata_df)
+		pd.testing.assert_frame_equal(expected_gctx.col_metadata_df, out_gctx.col_metadata_df)
+
+		for block in parse_gct.iterate(in_name, block_size=2, convert_row_metadata=False):
+			self.assertEqual(object, block.row_metadata_df["pr_dose"].dtype)
+
+		os.remove(in_name)
+		os.remove(out_name)
+		os.remove(expected_name)
+
 	def test_missing_annotations(self):
 		with self.assertRaises(Exception) as context:
 			no_meta = "../functional_tests/mini_gctoo_for_testing_nometa.gct"
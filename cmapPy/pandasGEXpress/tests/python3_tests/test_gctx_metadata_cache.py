@@ -0,0 +1,123 @@
+import logging
+import unittest
+import os
+import shutil
+import tempfile
+import unittest.mock as mock
+import pandas as pd
+
+import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
+import cmapPy.pandasGEXpress.gctx_metadata_cache as gctx_metadata_cache
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+
+FUNCTIONAL_TESTS_PATH = "cmapPy/pandasGEXpress/tests/functional_tests/"
+
+logger = logging.getLogger(setup_logger.LOGGER_NAME)
+
+
+class TestGctxMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.gctx_path = os.path.join(self.cache_dir, "mini.gctx")
+        shutil.copy(FUNCTIONAL_TESTS_PATH + "mini_gctoo_for_testing.gctx", self.gctx_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_put(self):
+        cache = gctx_metadata_cache.MetadataCache(os.path.join(self.cache_dir, "cache"))
+        self.assertIsNone(cache.get(self.gctx_path, "col", convert_neg_666=True, fields=None))
+
+        expected = parse_gctx.parse(self.gctx_path)
+        cached = parse_gctx.parse(self.gctx_path, metadata_cache=cache)
+        pd.testing.assert_frame_equal(expected.col_metadata_df, cached.col_metadata_df)
+        self.assertEqual(2, len(os.listdir(cache.cache_dir)))
+
+        # served from the cache: corrupt the stored entry to prove it is used
+        marker = expected.col_metadata_df.iloc[:, :1]
+        cache.put(self.gctx_path, "col", marker, convert_neg_666=True, fields=None)
+        pd.testing.assert_frame_equal(marker, parse_gctx.get_column_metadata(self.gctx_path, metadata_cache=cache))
+
+        # different parse options are cached separately
+        no_convert = parse_gctx.get_column_metadata(self.gctx_path, convert_neg_666=False, metadata_cache=cache)
+        pd.testing.assert_frame_equal(parse_gctx.get_column_metadata(self.gctx_path, convert_neg_666=False),
+                                      no_convert)
+
+        # modifying the file invalidates its entries, even within a microsecond
+        cache.put(self.gctx_path, "col", marker, convert_neg_666=True, fields=None)
+        stat = os.stat(self.gctx_path)
+        os.utime(self.gctx_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        if os.stat(self.gctx_path).st_mtime_ns == stat.st_mtime_ns + 1:
+            self.assertIsNone(cache.get(self.gctx_path, "col", convert_neg_666=True, fields=None))
+        os.utime(self.gctx_path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(cache.get(self.gctx_path, "col", convert_neg_666=True, fields=None))
+
+    def test_evict(self):
+        cache = gctx_metadata_cache.MetadataCache(os.path.join(self.cache_dir, "cache"))
+        parse_gctx.parse(self.gctx_path, metadata_cache=cache.cache_dir)
+        entries = sorted(os.listdir(cache.cache_dir))
+        self.assertEqual(2, len(entries))
+
+        # make the row entry the least recently used, then shrink the cache to fit one entry
+        row_entry = os.path.join(cache.cache_dir, [e for e in entries if ".row." in e][0])
+        os.utime(row_entry, (0, 0))
+        cache.max_bytes = max([os.path.getsize(os.path.join(cache.cache_dir, e)) for e in entries])
+        cache.evict()
+        self.assertEqual([e for e in entries if ".col." in e], os.listdir(cache.cache_dir))
+
+        cache.clear()
+        self.assertEqual([], os.listdir(cache.cache_dir))
+
+    def test_concurrent_eviction(self):
+        cache = gctx_metadata_cache.MetadataCache(os.path.join(self.cache_dir, "cache"))
+        col_df = parse_gctx.get_column_metadata(self.gctx_path)
+        cache.put(self.gctx_path, "col", col_df)
+        entry_path = cache.entry_path(self.gctx_path, "col", {})
+
+        # another process evicts the entry between reading it and marking it as used: still a hit
+        read_pickle = pd.read_pickle
+
+        def read_then_evict(path):
+            meta_df = read_pickle(path)
+            os.remove(path)
+            return meta_df
+
+        with mock.patch.object(gctx_metadata_cache.pd, "read_pickle", side_effect=read_then_evict):
+            pd.testing.assert_frame_equal(col_df, cache.get(self.gctx_path, "col"))
+
+        # entries removed by another process while evicting are skipped
+        cache.put(self.gctx_path, "col", col_df)
+        cache.max_bytes = 0
+        with mock.patch.object(gctx_metadata_cache.os, "remove", side_effect=remove_already_removed(entry_path)):
+            cache.evict()
+        self.assertEqual([], os.listdir(cache.cache_dir))
+
+        # temp files left by a put that never finished are removed once stale
+        stale_temp = entry_path + ".tmp1"
+        fresh_temp = entry_path + ".tmp2"
+        for temp_path in [stale_temp, fresh_temp]:
+            col_df.to_pickle(temp_path)
+        os.utime(stale_temp, (0, 0))
+        cache.max_bytes = gctx_metadata_cache.default_max_bytes
+        cache.evict()
+        self.assertEqual([os.path.basename(fresh_temp)], os.listdir(cache.cache_dir))
+
+        cache.clear()
+        self.assertEqual([], os.listdir(cache.cache_dir))
+
+
+def remove_already_removed(entry_path):
+    """os.remove replacement under which entry_path has already been removed by someone else."""
+    remove = os.remove
+
+    def concurrent_remove(path):
+        remove(path)
+        if path == entry_path:
+            raise OSError("No such file or directory: {}".format(path))
+    return concurrent_remove
+
+
+if __name__ == "__main__":
+    setup_logger.setup(verbose=True)
+
+    unittest.main()
@@ -0,0 +1,62 @@
+import logging
+import unittest
+import pandas as pd
+
+import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
+import cmapPy.pandasGEXpress.lazy_gctoo as lazy_gctoo
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.subset_gctoo as subset_gctoo
+
+FUNCTIONAL_TESTS_PATH = "cmapPy/pandasGEXpress/tests/functional_tests/"
+
+logger = logging.getLogger(setup_logger.LOGGER_NAME)
+
+
+class TestLazyGCToo(unittest.TestCase):
+    def test_parse(self):
+        in_path = FUNCTIONAL_TESTS_PATH + "mini_gctoo_for_testing.gctx"
+        expected = parse_gctx.parse(in_path)
+
+        with lazy_gctoo.parse(in_path) as lazy_gct:
+            pd.testing.assert_frame_equal(expected.row_metadata_df, lazy_gct.row_metadata_df)
+            pd.testing.assert_frame_equal(expected.col_metadata_df, lazy_gct.col_metadata_df)
+
+            # nothing has been read yet
+            self.assertIsInstance(lazy_gct.data_df, lazy_gctoo.LazyDataFrame)
+            self.assertFalse(lazy_gct.data_df.is_loaded)
+            self.assertEqual(expected.data_df.shape, lazy_gct.data_df.shape)
+
+            # slices are read without loading everything
+            pd.testing.assert_frame_equal(expected.data_df.iloc[[4, 1], 2:5], lazy_gct.data_df.iloc[[4, 1], 2:5])
+            rids = list(expected.data_df.index[[5, 0]])
+            cid = expected.data_df.columns[3]
+            pd.testing.assert_series_equal(expected.data_df.loc[rids, cid], lazy_gct.data_df.loc[rids, cid])
+            self.assertEqual(expected.data_df.iloc[2, 3], lazy_gct.data_df.iloc[2, 3])
+            pd.testing.assert_series_equal(expected.data_df[cid], lazy_gct.data_df[cid])
+            self.assertFalse(lazy_gct.data_df.is_loaded)
+
+            # subset_gctoo only reads what it keeps
+            subsetted = subset_gctoo.subset_gctoo(lazy_gct, cid=[cid])
+            pd.testing.assert_frame_equal(expected.data_df[[cid]], subsetted.data_df)
+            self.assertFalse(lazy_gct.data_df.is_loaded)
+
+            # anything else loads the full matrix
+            self.assertAlmostEqual(expected.data_df.values.sum(), lazy_gct.data_df.values.sum(), places=4)
+            self.assertTrue(lazy_gct.data_df.is_loaded)
+            pd.testing.assert_frame_equal(expected.data_df, lazy_gct.load().data_df)
+
+    def test_parse_subset(self):
+        in_path = FUNCTIONAL_TESTS_PATH + "mini_gctoo_for_testing.gctx"
+        expected = parse_gctx.parse(in_path, ridx=[0, 3, 5], cidx=[1, 2])
+
+        lazy_gct = lazy_gctoo.parse(in_path, ridx=[5, 3, 0], cidx=[1, 2])
+        pd.testing.assert_frame_equal(expected.row_metadata_df, lazy_gct.row_metadata_df)
+        pd.testing.assert_frame_equal(expected.data_df, lazy_gct.data_df.iloc[:, :])
+        pd.testing.assert_frame_equal(expected.data_df, lazy_gct.data_df.load())
+        lazy_gct.close()
+
+
+if __name__ == "__main__":
+    setup_logger.setup(verbose=True)
+
+    unittest.main()
@@ -1,11 +1,14 @@
 import unittest
 import logging
 import os
+import gzip
+import shutil
 import pandas as pd
 import numpy as np
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
 import cmapPy.pandasGEXpress.parse_gct as pg
 import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.subset_gctoo as sg
 
 
 FUNCTIONAL_TESTS_PATH = "cmapPy/pandasGEXpress/tests/functional_tests/"
@@ -111,6 +114,115 @@ class TestParseGct(unittest.TestCase):
                         ("The last data index value should be " + correct_str +
                          " not {}").format(data.index.values[e_dims[0] - 1]))
 
+    def test_read_data_rows(self):
+        gct_filepath = os.path.join(FUNCTIONAL_TESTS_PATH, "test_l1000.gct")
+        (_, n_rows, n_cols, n_rhd, n_chd) = pg.read_version_and_dims(gct_filepath)
+        (row_metadata, _, data) = pg.parse_into_3_df(gct_filepath, n_rows, n_cols, n_rhd, n_chd, ["-666"])
+
+        blocks = list(pg.read_data_rows(gct_filepath, n_chd, n_rhd, n_cols, ["-666"], chunk_rows=300))
+        self.assertEqual([300, 300, 300, 78], [len(data_block) for (_, data_block) in blocks])
+        self.assertEqual(np.float32, blocks[0][1].dtype)
+        self.assertTrue(np.array_equal(data.values, np.concatenate([data_block for (_, data_block) in blocks]),
+                                       equal_nan=True))
+        self.assertEqual(list(row_metadata.index),
+                         [rid for (row_metadata_block, _) in blocks for rid in row_metadata_block.iloc[:, 0]])
+        self.assertEqual(n_rhd + 1, blocks[0][0].shape[1])
+
+    def test_parse_into_3_df_unconvertible_value(self):
+        fname = "testing_unconvertible_value.gct"
+        with open(fname, "w") as f:
+            f.write("#1.3\n2\t2\t1\t1\nid\trhd1\tcid1\tcid2\nchd1\t-666\ta\tb\n" +
+                    "rid1\tx\t0.3\t0.2\nrid2\ty\tnope\t0.9\n")
+        with self.assertRaises(Exception) as context:
+            pg.parse(fname)
+        self.assertIn("data.loc['rid2', 'cid1'] = 'nope'", str(context.exception))
+        os.remove(fname)
+
+    def test_parse_subset(self):
+        # only the requested rows and columns are read, in file order, and each metadata field
+        # has the dtype it has when the whole file is parsed
+        for fname in ["test_l1000.gct", "test_p100.gct", "test_merged_left_right.gct"]:
+            gct_filepath = os.path.join(FUNCTIONAL_TESTS_PATH, fname)
+            full_gct = pg.parse(gct_filepath)
+            rids = list(full_gct.data_df.index)
+            cids = list(full_gct.data_df.columns)
+
+            for subset in [{"rid": [rids[-1], rids[0], "not_a_rid"], "cidx": [1, 0]},
+                           {"ridx": [len(rids) - 1, 0, 0], "cid": cids[:2]},
+                           {"cidx": [len(cids) - 1]},
+                           {"ridx": [-1]}]:
+                subset_gct = pg.parse(gct_filepath, **subset)
+                e_gct = sg.subset_gctoo(full_gct, **subset)
+                pd.testing.assert_frame_equal(e_gct.data_df, subset_gct.data_df)
+                pd.testing.assert_frame_equal(e_gct.row_metadata_df, subset_gct.row_metadata_df)
+                pd.testing.assert_frame_equal(e_gct.col_metadata_df, subset_gct.col_metadata_df)
+
+        gct_filepath = os.path.join(FUNCTIONAL_TESTS_PATH, "test_l1000.gct")
+        with self.assertRaises(AssertionError) as context:
+            pg.parse(gct_filepath, rid=["not_a_rid"])
+        self.assertIn("Subsetting yielded an empty gct", str(context.exception))
+
+        with self.assertRaises(AssertionError) as context:
+            pg.parse(gct_filepath, rid=["200814_at"], ridx=[0])
+        self.assertIn("Only one of rid and ridx can be provided", str(context.exception))
+
+    def test_build_gz_index(self):
+        gct_filepath = os.path.join(FUNCTIONAL_TESTS_PATH, "test_l1000.gct")
+        gz_filepath = "testing_build_gz_index.gct.gz"
+        with open(gct_filepath, "rb") as gct_file, gzip.open(gz_filepath, "wb") as gz_file:
+            shutil.copyfileobj(gct_file, gz_file)
+        full_gct = pg.parse(gct_filepath)
+        rids = list(full_gct.data_df.index)
+
+        index_path = pg.build_gz_index(gz_filepath, spacing=2 ** 16)
+        self.assertEqual(gz_filepath + pg.gz_index_suffix, index_path)
+        gz_index = pg.load_gz_index(gz_filepath, len(rids))
+        self.assertEqual(rids, list(gz_index["row_ids"]))
+        self.assertEqual(pg.indexed_gzip is not None, len(gz_index["checkpoints"]) > 0)
+
+        # the rows are read from their offsets
+        for subset in [{"rid": [rids[900], rids[3], rids[4]], "cidx": [10, 2]}, {"ridx": [977, 0]}]:
+            out_gct = pg.parse(gz_filepath, **subset)
+            e_gct = sg.subset_gctoo(full_gct, **subset)
+            pd.testing.assert_frame_equal(e_gct.data_df, out_gct.data_df)
+            pd.testing.assert_frame_equal(e_gct.row_metadata_df, out_gct.row_metadata_df)
+
+        # an index that no longer matches its file is ignored
+        with gzip.open(gz_filepath, "wb") as gz_file:
+            gz_file.write(b"#1.3\n1\t1\t0\t0\nid\tcid1\nrid1\t0.5\n")
+        self.assertIsNone(pg.load_gz_index(gz_filepath, 1))
+        self.assertEqual(["rid1"], list(pg.parse(gz_filepath, rid=["rid1"]).data_df.index))
+
+        os.remove(gz_filepath)
+        os.remove(index_path)
+
+    def test_iterate(self):
+        gct_filepath = os.path.join(FUNCTIONAL_TESTS_PATH, "test_l1000.gct")
+        full_gct = pg.parse(gct_filepath)
+
+        blocks = list(pg.iterate(gct_filepath, block_size=300))
+        self.assertEqual([300, 300, 300, 78], [block.data_df.shape[0] for block in blocks])
+        self.assertTrue(all(type(block) == GCToo.GCToo for block in blocks))
+        self.assertEqual(full_gct.version, blocks[0].version)
+
+        pd.testing.assert_frame_equal(full_gct.data_df, pd.concat([block.data_df for block in blocks]))
+        pd.testing.assert_frame_equal(full_gct.row_metadata_df,
+                                      pd.concat([block.row_metadata_df for block in blocks]), check_dtype=False)
+        for block in blocks:
+            pd.testing.assert_frame_equal(full_gct.col_metadata_df, block.col_metadata_df)
+
+        # unconvertible value in a later block
+        fname = "testing_iterate_unconvertible_value.gct"
+        with open(fname, "w") as f:
+            f.write("#1.3\n3\t2\t1\t1\nid\trhd1\tcid1\tcid2\nchd1\t-666\ta\tb\n" +
+                    "rid1\tx\t0.3\t0.2\nrid2\ty\t0.1\t0.9\nrid3\tz\t0.5\tnope\n")
+        blocks = pg.iterate(fname, block_size=2)
+        self.assertEqual(["rid1", "rid2"], list(next(blocks).data_df.index))
+        with self.assertRaises(Exception) as context:
+            next(blocks)
+        self.assertIn("data.loc['rid3', 'cid2'] = 'nope'", str(context.exception))
+        os.remove(fname)
+
     def test_assemble_row_metadata(self):
         #simple happy path
         full_df = pd.DataFrame(
@@ -1,6 +1,9 @@
 import logging
 import unittest
 import os
+import sys
+import multiprocessing
+import unittest.mock as mock
 import pandas as pd
 import numpy as np
 import h5py
@@ -204,6 +207,98 @@ class TestParseGctx(unittest.TestCase):
         self.assertEqual((3, 5), g.data_df.shape)
         logger.debug("g.data_df.index:  {}".format(g.data_df.index))
 
+    def test_iterate(self):
+        in_path = "cmapPy/pandasGEXpress/tests/functional_tests/mini_gctoo_for_testing.gctx"
+        mg1 = parse_gctx.parse(in_path)
+
+        # column blocks of an unchunked matrix
+        blocks = list(parse_gctx.iterate(in_path, block_size=4))
+        self.assertEqual([4, 2], [b.shape[1] for (b, _) in blocks])
+        pandas_testing.assert_frame_equal(mg1.data_df, pd.concat([b for (b, _) in blocks], axis=1))
+        pandas_testing.assert_frame_equal(mg1.col_metadata_df, pd.concat([m for (_, m) in blocks]))
+
+        # row blocks as GCToo instances
+        blocks = list(parse_gctx.iterate(in_path, block_size=5, dim="row", as_gctoo=True))
+        self.assertEqual([5, 1], [b.data_df.shape[0] for (b, _) in blocks])
+        pandas_testing.assert_frame_equal(mg1.data_df, pd.concat([b.data_df for (b, _) in blocks]))
+        pandas_testing.assert_frame_equal(mg1.col_metadata_df, blocks[1][0].col_metadata_df)
+        pandas_testing.assert_frame_equal(mg1.row_metadata_df.iloc[5:], blocks[1][1])
+
+        # block size follows the chunk shape of the matrix (2 x 1000)
+        in_path = "cmapPy/pandasGEXpress/tests/functional_tests/tsne_n2x1203.gctx"
+        tsne = parse_gctx.parse(in_path)
+        blocks = list(parse_gctx.iterate(in_path, block_size=10, dim="row"))
+        self.assertEqual([1000, 203], [b.shape[0] for (b, _) in blocks])
+        pandas_testing.assert_frame_equal(tsne.data_df, pd.concat([b for (b, _) in blocks]))
+
+    def test_lookup_ids_with_index(self):
+        mg1 = mini_gctoo_for_testing.make()
+        write_gctx.write(mg1, "mini_gctoo_with_id_index.gctx")
+        gctx_file = h5py.File("mini_gctoo_with_id_index.gctx", "r")
+
+        # ids are converted to indexes in the order given
+        cids = list(mg1.data_df.columns[[4, 0, 2]])
+        self.assertEqual((None, [4, 0, 2]), parse_gctx.lookup_ids_with_index(gctx_file, "col", cids, None))
+        rids = list(mg1.data_df.index[[5]])
+        self.assertEqual((None, [5]), parse_gctx.lookup_ids_with_index(gctx_file, "row", rids, None))
+
+        # nothing to look up
+        self.assertEqual((None, [1]), parse_gctx.lookup_ids_with_index(gctx_file, "row", None, [1]))
+        self.assertEqual((None, None), parse_gctx.lookup_ids_with_index(gctx_file, "row", None, None))
+
+        # unknown ids
+        with self.assertRaises(Exception) as context:
+            parse_gctx.lookup_ids_with_index(gctx_file, "col", cids + ["not_a_cid", "zzz"], None)
+        self.assertIn("not_a_cid", str(context.exception))
+        gctx_file.close()
+
+        # parsing with ids gives the same result with or without the index
+        mg2 = parse_gctx.parse("mini_gctoo_with_id_index.gctx", cid=cids, rid=rids, sort_col_meta=False)
+        os.remove("mini_gctoo_with_id_index.gctx")
+        pandas_testing.assert_frame_equal(mg1.data_df.loc[rids, cids], mg2.data_df)
+        pandas_testing.assert_frame_equal(mg1.col_metadata_df.loc[cids], mg2.col_metadata_df)
+
+        # files without an index are left to the metadata-based lookup
+        gctx_file = h5py.File("cmapPy/pandasGEXpress/tests/functional_tests/mini_gctoo_for_testing.gctx", "r")
+        self.assertEqual((cids, None), parse_gctx.lookup_ids_with_index(gctx_file, "col", cids, None))
+        gctx_file.close()
+
+    def test_search_sorted_dset(self):
+        values = np.array(sorted(["id_{:04d}".format(i).encode() for i in range(0, 2000, 2)]))
+        queries = np.array([b"id_0000", b"id_1998", b"id_0999", b"id_0500", b"zzz", b"a", b"id_0500"])
+        with h5py.File("sorted_dset.h5", "w") as f:
+            f.create_dataset("chunked", data=values, chunks=(16,))
+            f.create_dataset("contiguous", data=values)
+            for name in ["chunked", "contiguous"]:
+                (positions, found) = parse_gctx.search_sorted_dset(f[name], queries)
+                self.assertEqual(list(np.searchsorted(values, queries)), list(positions))
+                self.assertEqual([True, True, False, True, False, False, True], list(found))
+
+            self.assertEqual([b"id_0000", b"id_0998", b"id_1998"],
+                             list(parse_gctx.read_dset_points(f["chunked"], np.array([0, 499, 999]))))
+            self.assertEqual(0, len(parse_gctx.read_dset_points(f["chunked"], np.array([], dtype=int))))
+        os.remove("sorted_dset.h5")
+
+    def test_parse_reads_selected_metadata(self):
+        # whether a field is numeric depends on all of its values, not only the selected ones
+        cids = ["cid_{}".format(i) for i in range(8)]
+        col_meta = pd.DataFrame({"num_then_str": ["1"] * 6 + ["a", "b"],
+                                 "int_then_float": ["1"] * 6 + ["1.5", "2.5"],
+                                 "int_with_666": [1, 2, 3, 4, 5, 6, 7, -666],
+                                 "pert_id": ["BRD-{}".format(i) for i in range(8)]}, index=cids)
+        data_df = pd.DataFrame(np.arange(16, dtype=np.float32).reshape(2, 8), index=["a", "b"], columns=cids)
+        gctoo = GCToo.GCToo(data_df=data_df, col_metadata_df=col_meta)
+        for typed_metadata in [False, True]:
+            write_gctx.write(gctoo, "selected_metadata.gctx", typed_metadata=typed_metadata)
+            full = parse_gctx.parse("selected_metadata.gctx")
+            for subset in [{"cid": ["cid_3", "cid_0"]}, {"cidx": [5, 1]}, {"ridx": [1], "cidx": [7]}]:
+                expected = subset_gctoo.subset_gctoo(full, **subset)
+                parsed = parse_gctx.parse("selected_metadata.gctx", **subset)
+                pandas_testing.assert_frame_equal(expected.data_df, parsed.data_df)
+                pandas_testing.assert_frame_equal(expected.row_metadata_df, parsed.row_metadata_df)
+                pandas_testing.assert_frame_equal(expected.col_metadata_df, parsed.col_metadata_df)
+        os.remove("selected_metadata.gctx")
+
     def test_check_and_order_id_inputs(self):
         ridx = [0, 1]
         cidx = [2, 1]
@@ -278,6 +373,53 @@ class TestParseGctx(unittest.TestCase):
         logger.debug("r.index:  {}".format(r.index))
         self.assertEqual(set(expected_rids), set(r.index))
 
+    def test_parse_metadata_fields(self):
+        in_path = "cmapPy/pandasGEXpress/tests/functional_tests/mini_gctoo_for_testing.gctx"
+        mg1 = mini_gctoo_for_testing.make()
+
+        # only the requested fields are read
+        mg2 = parse_gctx.parse(in_path, col_fields=["zmad_ref", "distil_ss"], row_fields=[])
+        pandas_testing.assert_frame_equal(mg1.data_df, mg2.data_df)
+        pandas_testing.assert_frame_equal(mg1.col_metadata_df[["zmad_ref", "distil_ss"]], mg2.col_metadata_df)
+        self.assertEqual((6, 0), mg2.row_metadata_df.shape)
+        self.assertEqual(list(mg1.row_metadata_df.index), list(mg2.row_metadata_df.index))
+
+        row_meta = parse_gctx.get_row_metadata(in_path, fields=["distil_nsample"])
+        pandas_testing.assert_frame_equal(mg1.row_metadata_df[["distil_nsample"]], row_meta)
+
+        col_meta = parse_gctx.parse(in_path, col_meta_only=True, cidx=[1, 2], col_fields=["mfc_plate_id"])
+        pandas_testing.assert_frame_equal(mg1.col_metadata_df.iloc[[1, 2]][["mfc_plate_id"]], col_meta)
+
+        # unknown fields
+        with self.assertRaises(Exception) as context:
+            parse_gctx.get_column_metadata(in_path, fields=["zmad_ref", "not_a_field"])
+        self.assertIn("not_a_field", str(context.exception))
+
+    def test_parse_metadata_filter(self):
+        in_path = "cmapPy/pandasGEXpress/tests/functional_tests/mini_gctoo_for_testing.gctx"
+        mg1 = mini_gctoo_for_testing.make()
+        col_mask = (mg1.col_metadata_df.distil_nsample > 3).values
+
+        mg2 = parse_gctx.parse(in_path, col_filter={"distil_nsample": lambda x: x > 3},
+                               row_filter={"zmad_ref": "population", "distil_nsample": [3, 66]})
+        pandas_testing.assert_frame_equal(mg1.data_df.loc[mg1.data_df.index[:3], col_mask], mg2.data_df)
+        pandas_testing.assert_frame_equal(mg1.col_metadata_df.loc[col_mask], mg2.col_metadata_df)
+
+        # filter fields do not need to be among the fields that are returned
+        mg3 = parse_gctx.parse(in_path, col_filter={"distil_nsample": lambda x: x > 3}, col_fields=[])
+        self.assertEqual(list(mg1.data_df.columns[col_mask]), list(mg3.data_df.columns))
+        self.assertEqual((int(col_mask.sum()), 0), mg3.col_metadata_df.shape)
+
+        # combined with ids / indexes
+        cids = list(mg1.data_df.columns[[5, 0, 2]])
+        mg4 = parse_gctx.parse(in_path, cid=cids, col_filter={"distil_nsample": lambda x: x > 3},
+                               ridx=[4, 1], row_filter={"count_cv": ["13", "13|14|13"]}, sort_col_meta=False)
+        pandas_testing.assert_frame_equal(mg1.data_df.iloc[[1, 4], [5, 2]], mg4.data_df)
+
+        # metadata only
+        row_meta = parse_gctx.parse(in_path, row_meta_only=True, row_filter={"count_cv": "13"})
+        pandas_testing.assert_frame_equal(mg1.row_metadata_df.iloc[[3, 4]], row_meta)
+
     def test_replace_666(self):
         # convert_neg_666 is True
         row_df = pd.DataFrame([[3, "a"], [-666, "c"], ["-666", -666.0]],
@@ -376,6 +518,178 @@ class TestParseGctx(unittest.TestCase):
 
         mini_gctx.close()
 
+    def test_parse_workers(self):
+        in_path = "cmapPy/pandasGEXpress/tests/functional_tests/mini_gctoo_for_testing.gctx"
+        mg1 = parse_gctx.parse(in_path)
+
+        mg2 = parse_gctx.parse(in_path, workers=3)
+        pandas_testing.assert_frame_equal(mg1.data_df, mg2.data_df)
+        pandas_testing.assert_frame_equal(mg1.col_metadata_df, mg2.col_metadata_df)
+
+        mg3 = parse_gctx.parse(in_path, ridx=[4, 0, 2], cidx=[5, 1], sort_row_meta=False, workers=2)
+        pandas_testing.assert_frame_equal(mg1.data_df.iloc[[4, 0, 2], [1, 5]], mg3.data_df)
+
+        # without multiprocessing.shared_memory (Python < 3.8), only workers > 1 fails
+        saved_shared_memory = multiprocessing.__dict__.pop("shared_memory", None)
+        try:
+            with mock.patch.dict(sys.modules, {"multiprocessing.shared_memory": None}):
+                mg4 = parse_gctx.parse(in_path)
+                pandas_testing.assert_frame_equal(mg1.data_df, mg4.data_df)
+                with self.assertRaises(Exception) as context:
+                    parse_gctx.parse(in_path, workers=2)
+                self.assertIn("requires Python 3.8", str(context.exception))
+        finally:
+            if saved_shared_memory is not None:
+                multiprocessing.shared_memory = saved_shared_memory
+
+    def test_parse_mmap(self):
+        in_path = "cmapPy/pandasGEXpress/tests/functional_tests/mini_gctoo_for_testing.gctx"
+        mg1 = parse_gctx.parse(in_path)
+
+        # full matrix is backed by the mapping, keeping the stored dtype (float64 in this file)
+        mg2 = parse_gctx.parse(in_path, mode="mmap")
+        self.assertEqual(np.float64, mg2.data_df.values.dtype)
+        pandas_testing.assert_frame_equal(mg1.data_df, mg2.data_df, check_dtype=False)
+        self.assertTrue(np.shares_memory(mg2.data_df.values, mg2.data_df.values.base))
+        self.assertFalse(mg2.data_df.values.flags.writeable)
+
+        mg3 = parse_gctx.parse(in_path, ridx=[4, 0, 2], cidx=[5, 1], mode="mmap")
+        pandas_testing.assert_frame_equal(mg1.data_df.iloc[[0, 2, 4], [1, 5]], mg3.data_df, check_dtype=False)
+
+        # compressed matrices cannot be mapped
+        fn = "mmap_compressed_example.gctx"
+        write_gctx.write(mg1, fn)
+        hdf5_file = h5py.File(fn, "a")
+        del hdf5_file[data_node]
+        hdf5_file.create_dataset(data_node, data=mg1.data_df.values.T, compression="gzip")
+        hdf5_file.close()
+        with self.assertRaises(Exception) as context:
+            parse_gctx.parse(fn, mode="mmap")
+        self.assertIn("can only be memory-mapped", str(context.exception))
+        os.remove(fn)
+
+        with self.assertRaises(Exception) as context:
+            parse_gctx.parse(in_path, mode="copy")
+        self.assertIn("mode must be either", str(context.exception))
+
+    def test_gctx_reader(self):
+        in_path = "cmapPy/pandasGEXpress/tests/functional_tests/mini_gctoo_for_testing.gctx"
+        mg1 = parse_gctx.parse(in_path)
+
+        with parse_gctx.GCTXReader(in_path, rdcc_nbytes=1024 * 1024, rdcc_nslots=521) as reader:
+            self.assertEqual(1024 * 1024, reader.gctx_file.id.get_access_plist().get_cache()[2])
+            pandas_testing.assert_frame_equal(mg1.row_metadata_df, reader.row_metadata_df)
+            pandas_testing.assert_frame_equal(mg1.col_metadata_df, reader.col_metadata_df)
+
+            # repeated slices reuse the open file and parsed metadata
+            for (rids, cids) in [(mg1.data_df.index[[4, 1]], mg1.data_df.columns[[0]]),
+                                 (mg1.data_df.index[[0, 2, 3]], mg1.data_df.columns[[5, 2]])]:
+                expected = parse_gctx.parse(in_path, rid=list(rids), cid=list(cids), sort_row_meta=False,
+                                            sort_col_meta=False)
+                sliced = reader.slice(rid=list(rids), cid=list(cids), sort_row_meta=False, sort_col_meta=False)
+                pandas_testing.assert_frame_equal(expected.data_df, sliced.data_df)
+                pandas_testing.assert_frame_equal(expected.row_metadata_df, sliced.row_metadata_df)
+                pandas_testing.assert_frame_equal(expected.col_metadata_df, sliced.col_metadata_df)
+
+            sliced = reader.slice(cidx=[1, 3], row_filter={"zmad_ref": "population"})
+            expected = parse_gctx.parse(in_path, cidx=[1, 3], row_filter={"zmad_ref": "population"})
+            pandas_testing.assert_frame_equal(expected.data_df, sliced.data_df)
+            self.assertEqual(expected.version, sliced.version)
+
+            # full read
+            pandas_testing.assert_frame_equal(mg1.data_df, reader.slice().data_df)
+        self.assertFalse(reader.gctx_file.id.valid)
+
+    def test_partition_indexes(self):
+        indexes = np.array([0, 1, 2, 5, 7, 8, 12])
+        self.assertEqual([(0, 2), (2, 5), (5, 7)], parse_gctx.partition_indexes(indexes, 3, None))
+
+        # splits move forward to chunk boundaries
+        self.assertEqual([(0, 3), (3, 5), (5, 7)], parse_gctx.partition_indexes(indexes, 3, 4))
+        self.assertEqual([(0, 7)], parse_gctx.partition_indexes(indexes, 3, 20))
+        self.assertEqual([(0, 1), (1, 2)], parse_gctx.partition_indexes(np.array([3, 4]), 4, None))
+
+    def test_plan_axis_reads(self):
+        indexes = np.array([0, 1, 2, 5, 7, 8, 12])
+
+        # runs of consecutive indexes
+        groups = parse_gctx.plan_axis_reads(indexes, None)
+        self.assertEqual([(0, 3), (5, 6), (7, 9), (12, 13)], [(g[0], g[1]) for g in groups])
+        self.assertEqual([slice(0, 3), slice(3, 4), slice(4, 6), slice(6, 7)], [g[2] for g in groups])
+        self.assertTrue(all([g[3] is None for g in groups]))
+
+        # one group per chunk
+        groups = parse_gctx.plan_axis_reads(indexes, 4)
+        self.assertEqual([(0, 3), (5, 8), (8, 9), (12, 13)], [(g[0], g[1]) for g in groups])
+        self.assertEqual([slice(0, 3), slice(3, 5), slice(5, 6), slice(6, 7)], [g[2] for g in groups])
+        self.assertIsNone(groups[0][3])
+        self.assertEqual([0, 2], list(groups[1][3]))
+
+        # long runs split into pieces
+        groups = parse_gctx.plan_axis_reads(indexes, None, max_run_len=2)
+        self.assertEqual([(0, 2), (2, 3), (5, 6), (7, 9), (12, 13)], [(g[0], g[1]) for g in groups])
+        self.assertTrue(all([g[3] is None for g in groups]))
+
+    def test_read_planned_hyperslabs(self):
+        data = np.arange(30 * 20, dtype=np.float32).reshape(30, 20)
+        idx0 = np.array([0, 3, 4, 5, 17, 29])
+        idx1 = np.array([1, 2, 9, 10, 19])
+
+        fn = "read_planner_example.gctx"
+        hdf5_file = h5py.File(fn, "w")
+        chunked = hdf5_file.create_dataset("chunked", data=data, chunks=(4, 6))
+        contiguous = hdf5_file.create_dataset("contiguous", data=data)
+        for dset in [chunked, contiguous]:
+            out = parse_gctx.read_planned_hyperslabs(dset, idx0, idx1)
+            self.assertEqual(np.float32, out.dtype)
+            np.testing.assert_array_equal(data[np.ix_(idx0, idx1)], out)
+
+        # reads into a given buffer, in place
+        out = np.zeros((len(idx0), len(idx1)), dtype=np.float32)
+        self.assertIs(out, parse_gctx.read_planned_hyperslabs(contiguous, idx0, idx1, out=out))
+        np.testing.assert_array_equal(data[np.ix_(idx0, idx1)], out)
+
+        # read_data_array returns a transposed view of its buffer rather than a copy
+        out = np.zeros((len(idx0), len(idx1)), dtype=np.float32)
+        data_array = parse_gctx.read_data_array(chunked, idx1, idx0, out=out)
+        self.assertIs(out, data_array.base)
+        np.testing.assert_array_equal(data[np.ix_(idx0, idx1)].T, data_array)
+        hdf5_file.close()
+        os.remove(fn)
+
+    def test_read_planned_hyperslabs_threaded(self):
+        data = np.arange(30 * 20, dtype=np.float32).reshape(30, 20)
+        idx0 = np.array([0, 3, 4, 5, 17, 29])
+        idx1 = np.array([1, 2, 9, 10, 19])
+
+        fn = "read_planner_threaded_example.gctx"
+        hdf5_file = h5py.File(fn, "w")
+        gzip_shuffle = hdf5_file.create_dataset("gzip_shuffle", data=data, chunks=(4, 6),
+                                                compression="gzip", shuffle=True)
+        gzip_only = hdf5_file.create_dataset("gzip_only", data=data, chunks=(4, 6), compression="gzip")
+        lzf = hdf5_file.create_dataset("lzf", data=data, chunks=(4, 6), compression="lzf")
+        self.assertTrue(parse_gctx.can_decompress_chunks(gzip_shuffle))
+        self.assertTrue(parse_gctx.can_decompress_chunks(gzip_only))
+        self.assertFalse(parse_gctx.can_decompress_chunks(lzf))
+
+        for dset in [gzip_shuffle, gzip_only, lzf]:
+            out = parse_gctx.read_planned_hyperslabs(dset, idx0, idx1, num_threads=3)
+            np.testing.assert_array_equal(data[np.ix_(idx0, idx1)], out)
+
+        # full reads also go through the threaded path
+        out = parse_gctx.read_data_array(gzip_shuffle, range(20), range(30), num_threads=2)
+        np.testing.assert_array_equal(data.T, out)
+
+        # chunks that were never written read as the fill value
+        sparse = hdf5_file.create_dataset("sparse", shape=(30, 20), dtype=np.float32, chunks=(4, 6),
+                                          compression="gzip", fillvalue=-666)
+        sparse[0:4, 0:6] = data[0:4, 0:6]
+        out = parse_gctx.read_planned_hyperslabs(sparse, idx0, idx1, num_threads=2)
+        np.testing.assert_array_equal(sparse[:][np.ix_(idx0, idx1)], out)
+        self.assertEqual(-666, out[-1, -1])
+        hdf5_file.close()
+        os.remove(fn)
+
     def test_convert_ids_to_meta_type(self):
         # happy path
         id_list = [0, 1, 2]
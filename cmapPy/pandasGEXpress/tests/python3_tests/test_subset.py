@@ -60,5 +60,31 @@ class TestSubset(unittest.TestCase):
         self.assertIn("exclude_{rid,cid} args not currently supported",
                       str(e.exception))
 
+    def test_read_filter_arg(self):
+        self.assertIsNone(sg._read_filter_arg(None))
+
+        meta_filter = sg._read_filter_arg(["pert_type=trt_cp", "pert_idose=10,3.33"])
+        self.assertEqual(["pert_idose", "pert_type"], sorted(meta_filter.keys()))
+        self.assertEqual([True, False, True],
+                         list(meta_filter["pert_idose"](pd.Series([10, 11, 3.33]))))
+
+        with self.assertRaises(AssertionError) as e:
+            sg._read_filter_arg(["pert_type"])
+        self.assertIn("field=value", str(e.exception))
+
+    def test_subset_main_filter(self):
+        in_gctx_path = os.path.join("cmapPy/pandasGEXpress/tests/functional_tests/", "mini_gctoo_for_testing.gctx")
+        out_name = os.path.join("cmapPy/pandasGEXpress/tests/functional_tests/", "test_subset_filter_out.gct")
+
+        args_string = "-i {} -cf distil_nsample=3,9 -rf count_cv=13 -o {}".format(in_gctx_path, out_name)
+        args = sg.build_parser().parse_args(args_string.split())
+        sg.subset_main(args)
+
+        full_gct = parse.parse(in_gctx_path)
+        out_gct = parse.parse(out_name)
+        os.remove(out_name)
+        self.assertEqual(list(full_gct.data_df.index[[3, 4]]), list(out_gct.data_df.index))
+        self.assertEqual(list(full_gct.data_df.columns[[0, 1, 4]]), list(out_gct.data_df.columns))
+
 if __name__ == '__main__':
     unittest.main()
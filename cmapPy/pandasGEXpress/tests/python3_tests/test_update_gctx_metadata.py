@@ -0,0 +1,56 @@
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+import pandas as pd
+import cmapPy.pandasGEXpress.update_gctx_metadata as update_gctx_metadata
+import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+
+FUNCTIONAL_TESTS_PATH = "cmapPy/pandasGEXpress/tests/functional_tests/"
+
+logger = logging.getLogger(setup_logger.LOGGER_NAME)
+
+
+class TestUpdateGctxMetadata(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.gctx_path = os.path.join(self.temp_dir, "mini_nometa.gctx")
+        shutil.copy(FUNCTIONAL_TESTS_PATH + "mini_gctoo_for_testing_nometa.gctx", self.gctx_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_update_gctx_metadata_main(self):
+        args_string = "-f {} -row_annot_path {} -col_annot_path {}".format(
+            self.gctx_path, FUNCTIONAL_TESTS_PATH + "test_rowmeta_n6.txt", FUNCTIONAL_TESTS_PATH + "test_colmeta_n6.txt")
+        args = update_gctx_metadata.build_parser().parse_args(args_string.split())
+        update_gctx_metadata.update_gctx_metadata_main(args)
+
+        # annotated in place: same as the original file with metadata
+        expected = parse_gctx.parse(FUNCTIONAL_TESTS_PATH + "mini_gctoo_for_testing.gctx")
+        annotated = parse_gctx.parse(self.gctx_path)
+        pd.testing.assert_frame_equal(expected.data_df, annotated.data_df)
+        pd.testing.assert_frame_equal(expected.row_metadata_df, annotated.row_metadata_df.loc[:, expected.row_metadata_df.columns])
+        pd.testing.assert_frame_equal(expected.col_metadata_df, annotated.col_metadata_df.loc[:, expected.col_metadata_df.columns])
+
+        # drop fields
+        drop_field = expected.col_metadata_df.columns[0]
+        args = update_gctx_metadata.build_parser().parse_args(
+            "-f {} -drop_col_fields {}".format(self.gctx_path, drop_field).split())
+        update_gctx_metadata.update_gctx_metadata_main(args)
+        self.assertNotIn(drop_field, parse_gctx.get_column_metadata(self.gctx_path).columns)
+
+    def test_missing_annotations(self):
+        args = update_gctx_metadata.build_parser().parse_args(
+            "-f {} -row_annot_path {}".format(self.gctx_path, FUNCTIONAL_TESTS_PATH + "test_missing_rowmeta.txt").split())
+        with self.assertRaises(Exception) as context:
+            update_gctx_metadata.update_gctx_metadata_main(args)
+        self.assertIn("missing_ids", str(context.exception))
+
+
+if __name__ == "__main__":
+    setup_logger.setup(verbose=True)
+
+    unittest.main()
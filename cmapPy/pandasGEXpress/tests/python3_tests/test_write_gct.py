@@ -2,6 +2,7 @@ import unittest
 import logging
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
 import os
+import gzip
 import numpy as np
 import pandas as pd
 import cmapPy.pandasGEXpress.GCToo as GCToo
@@ -111,6 +112,45 @@ class TestWriteGct(unittest.TestCase):
         pd.testing.assert_frame_equal(bottom_half, e_bottom_half)
         os.remove(fname)
 
+    def test_format_fixed_point_block(self):
+        # ties, values within rounding error of a tie, negative zero, NaN, infinity, large values
+        values = np.array([[0.00005, 0.00015, -0.00005, 2.5, -0.0],
+                           [123456.78905, 9.99995, np.nan, np.inf, 1e20],
+                           [-1.23456, 0.1, 1e-9, -7, 0.99995]])
+        for dtype in [np.float32, np.float64]:
+            for decimals in [0, 1, 4, 6]:
+                data_float_format = "%.{}f".format(decimals)
+                e_lines = ["\t".join("NaN" if np.isnan(value) else data_float_format % value for value in row)
+                           for row in values.astype(dtype)]
+                lines = wg.format_fixed_point_block(values.astype(dtype), decimals, "NaN", data_float_format)
+                self.assertEqual(e_lines, lines)
+
+    def test_write_blocks_workers_gzip(self):
+        in_gct = pg.parse(os.path.join(FUNCTIONAL_TESTS_PATH, "test_l1000.gct"))
+        in_gct.data_df.iloc[::5, ::3] = np.nan
+        out_name = "test_write_blocks.gct"
+        wg.write(in_gct, out_name)
+        with open(out_name) as f:
+            e_text = f.read()
+
+        # blocks formatted in worker processes give the same file
+        wg.write(in_gct, out_name, block_rows=100, workers=2)
+        with open(out_name) as f:
+            self.assertEqual(e_text, f.read())
+
+        # gzipped, with one gzip member per block
+        wg.write(in_gct, "test_write_blocks", gzip_output=True, block_rows=100, workers=2)
+        with gzip.open("test_write_blocks.gct.gz", "rt") as f:
+            self.assertEqual(e_text, f.read())
+        pd.testing.assert_frame_equal(in_gct.data_df, pg.parse("test_write_blocks.gct.gz").data_df)
+
+        # float formats other than "%.<n>f" are written with to_csv
+        wg.write(in_gct, out_name, data_float_format="%.3g", block_rows=100)
+        pd.testing.assert_frame_equal(in_gct.data_df, pg.parse(out_name).data_df, atol=0.06)
+
+        os.remove(out_name)
+        os.remove("test_write_blocks.gct.gz")
+
     def test_append_dims_and_file_extension(self):
         data_df = pd.DataFrame([[1, 2], [3, 4]])
         fname_no_gct = "a/b/file"
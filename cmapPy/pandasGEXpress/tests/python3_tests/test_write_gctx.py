@@ -3,8 +3,10 @@ import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
 import unittest
 import h5py
 import os
+import unittest.mock as mock
 import numpy
 import pandas
+import cmapPy.pandasGEXpress.GCToo as GCToo
 import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
 import cmapPy.pandasGEXpress.write_gctx as write_gctx
 import cmapPy.pandasGEXpress.mini_gctoo_for_testing as mini_gctoo_for_testing
@@ -93,11 +95,14 @@ class TestWriteGctx(unittest.TestCase):
         elem_per_kb2 = write_gctx.calculate_elem_per_kb(max_chunk_kb, dtype2)
         self.assertEqual(elem_per_kb2, correct_elem_per_kb2)
 
+        # dtype is numpy.int16 (quantized matrices)
+        self.assertEqual(512, write_gctx.calculate_elem_per_kb(max_chunk_kb, numpy.int16))
+
         # dtype is somethign else 
-        dtype3 = numpy.int 
+        dtype3 = numpy.str_
         with self.assertRaises(Exception) as context:
             write_gctx.calculate_elem_per_kb(max_chunk_kb, dtype3)
-        self.assertTrue("only numpy.float32 and numpy.float64 are currently supported" in str(context.exception))
+        self.assertTrue("only numeric (float or integer) dtypes are supported" in str(context.exception))
 
 
     def test_set_data_matrix_chunk_size(self):
@@ -108,6 +113,52 @@ class TestWriteGctx(unittest.TestCase):
         calculated_chunk_size = write_gctx.set_data_matrix_chunk_size(sample_data_shape, max_chunk_kb, elem_per_kb)
         self.assertEqual(calculated_chunk_size, expected_chunk_size)
 
+    def test_set_data_matrix_chunk_layout(self):
+        max_chunk_kb = 1024
+        elem_per_kb = 256
+        sample_data_shape = (978, 1000)
+        self.assertEqual((978, 268), write_gctx.set_data_matrix_chunk_layout(
+            sample_data_shape, max_chunk_kb, elem_per_kb, "balanced"))
+        self.assertEqual((978, 268), write_gctx.set_data_matrix_chunk_layout(
+            sample_data_shape, max_chunk_kb, elem_per_kb, "column"))
+        self.assertEqual((262, 1000), write_gctx.set_data_matrix_chunk_layout(
+            sample_data_shape, max_chunk_kb, elem_per_kb, "row"))
+        self.assertEqual((1, 3), write_gctx.set_data_matrix_chunk_layout((12, 3), 1, 4, "row"))
+        self.assertIsNone(write_gctx.set_data_matrix_chunk_layout(sample_data_shape, max_chunk_kb, elem_per_kb,
+                                                                  "contiguous"))
+        self.assertIsNone(write_gctx.set_data_matrix_chunk_layout((0, 5), max_chunk_kb, elem_per_kb, "balanced"))
+
+        with self.assertRaises(Exception) as context:
+            write_gctx.set_data_matrix_chunk_layout(sample_data_shape, max_chunk_kb, elem_per_kb, "diagonal")
+        self.assertIn("Invalid layout", str(context.exception))
+
+    def test_write_chunked(self):
+        mini_gctoo = mini_gctoo_for_testing.make()
+        fn = "chunked_example.gctx"
+        # 8 kb -> chunks of 16 elements; the matrix is stored transposed (cid x rid)
+        for (layout, expected_chunks) in [("balanced", (2, 6)), ("column", (2, 6)), ("row", (6, 2))]:
+            write_gctx.write(mini_gctoo, fn, max_chunk_kb=8, layout=layout, matrix_compression="gzip",
+                             shuffle=True)
+            hdf5_file = h5py.File(fn, "r")
+            data_dset = hdf5_file[write_gctx.data_matrix_node]
+            self.assertEqual(expected_chunks, data_dset.chunks)
+            self.assertEqual("gzip", data_dset.compression)
+            self.assertTrue(data_dset.shuffle)
+            hdf5_file.close()
+            pandas.testing.assert_frame_equal(mini_gctoo.data_df, parse_gctx.parse(fn).data_df, check_dtype=False)
+            os.remove(fn)
+
+        write_gctx.write(mini_gctoo, fn, layout="contiguous")
+        hdf5_file = h5py.File(fn, "r")
+        self.assertIsNone(hdf5_file[write_gctx.data_matrix_node].chunks)
+        hdf5_file.close()
+        os.remove(fn)
+
+        with self.assertRaises(Exception) as context:
+            write_gctx.write(mini_gctoo, fn, mmap_friendly=True, matrix_compression="lzf")
+        self.assertIn("can only be compressed / shuffled if it is chunked", str(context.exception))
+        os.remove(fn)
+
 
     def test_write_metadata(self):
         """
@@ -209,6 +260,359 @@ class TestWriteGctx(unittest.TestCase):
             self.assertTrue(set(mini_gctoo.col_metadata_df[c]) == set(mini_gctoo_col_metadata[c]),
                             "Values in column {} differ between expected metadata and written col metadata!".format(c))
 
+    def test_write_id_index(self):
+        mini_gctoo = mini_gctoo_for_testing.make()
+        fn = "id_index_example.gctx"
+        write_gctx.write(mini_gctoo, fn)
+        hdf5_file = h5py.File(fn, "r")
+        for (node, ids) in [(write_gctx.row_id_index_group_node, mini_gctoo.data_df.index),
+                            (write_gctx.col_id_index_group_node, mini_gctoo.data_df.columns)]:
+            sorted_ids = [x.decode() for x in hdf5_file[node + "/" + write_gctx.sorted_id_node][()]]
+            sorted_idx = hdf5_file[node + "/" + write_gctx.sorted_idx_node][()]
+            self.assertEqual(sorted(ids), sorted_ids)
+            self.assertEqual(sorted_ids, list(ids[sorted_idx]))
+        hdf5_file.close()
+        os.remove(fn)
+
+        # index can be turned off
+        write_gctx.write(mini_gctoo, fn, id_index=False)
+        hdf5_file = h5py.File(fn, "r")
+        self.assertFalse(write_gctx.col_id_index_group_node in hdf5_file)
+        hdf5_file.close()
+        os.remove(fn)
+
+    def test_write_mmap_friendly(self):
+        data_df = pandas.DataFrame(numpy.arange(64 * 40, dtype=numpy.float32).reshape(64, 40),
+                                   index=["r{}".format(i) for i in range(64)],
+                                   columns=["c{}".format(i) for i in range(40)])
+        fn = "mmap_friendly_example.gctx"
+        write_gctx.write(GCToo.GCToo(data_df=data_df), fn, mmap_friendly=True)
+        hdf5_file = h5py.File(fn, "r")
+        data_dset = hdf5_file[write_gctx.data_matrix_node]
+        self.assertIsNone(data_dset.chunks)
+        self.assertIsNone(data_dset.compression)
+        self.assertEqual(0, data_dset.id.get_offset() % write_gctx.mmap_alignment)
+        hdf5_file.close()
+
+        parsed = parse_gctx.parse(fn, mode="mmap")
+        pandas.testing.assert_frame_equal(data_df, parsed.data_df, check_names=False)
+        os.remove(fn)
+
+    def test_write_typed_metadata(self):
+        n = 8
+        col_metadata_df = pandas.DataFrame({
+            "cell_id": ["A375", "MCF7", numpy.nan, "A375", "A375", "MCF7", "PC3", "A375"],
+            "pert_id": ["BRD-{}".format(i) for i in range(n)],
+            "pert_idose": numpy.linspace(0.1, 10, n),
+            "nsample": numpy.arange(n, dtype=numpy.int32),
+            "is_gold": [True, False] * (n // 2),
+            "missing": [numpy.nan] * n},
+            index=pandas.Index(["cid{}".format(i) for i in range(n)], name="cid"))
+        col_metadata_df["missing"] = col_metadata_df["missing"].astype(object)
+        col_metadata_df.columns.name = "chd"
+        data_df = pandas.DataFrame(numpy.ones((3, n), dtype=numpy.float32), columns=col_metadata_df.index,
+                                   index=["rid{}".format(i) for i in range(3)])
+        fn = "typed_metadata_example.gctx"
+        write_gctx.write(GCToo.GCToo(data_df=data_df, col_metadata_df=col_metadata_df), fn, typed_metadata=True)
+
+        hdf5_file = h5py.File(fn, "r")
+        field_dtypes = dict([(k, hdf5_file[write_gctx.col_meta_group_node][k].attrs.get("dtype"))
+                             for k in col_metadata_df.columns])
+        self.assertEqual({"cell_id": "category", "pert_id": "str", "pert_idose": "float64", "nsample": "int32",
+                          "is_gold": "bool", "missing": "category"}, field_dtypes)
+        self.assertEqual(numpy.int8, hdf5_file[write_gctx.col_meta_group_node + "/cell_id"].dtype)
+        categories = hdf5_file[write_gctx.col_categories_group_node + "/cell_id"][()]
+        self.assertEqual([b"A375", b"MCF7", b"PC3"], list(categories))
+        hdf5_file.close()
+
+        # read back as stored, categorical fields as pandas Categorical
+        parsed = parse_gctx.parse(fn, col_meta_only=True)
+        self.assertTrue(pandas.api.types.is_categorical_dtype(parsed["cell_id"]))
+        self.assertEqual(numpy.int32, parsed["nsample"].dtype)
+        self.assertEqual(bool, parsed["is_gold"].dtype)
+        expected = col_metadata_df.copy()
+        expected["cell_id"] = expected["cell_id"].astype("category")
+        expected["missing"] = pandas.Categorical([numpy.nan] * n, categories=pandas.Index([], dtype=object))
+        # fields come back in the order hdf5 lists them (alphabetical)
+        pandas.testing.assert_frame_equal(expected[sorted(expected.columns)], parsed)
+
+        parsed = parse_gctx.parse(fn, col_meta_only=True, col_fields=["pert_idose"])
+        pandas.testing.assert_frame_equal(col_metadata_df[["pert_idose"]], parsed)
+
+        # with convert_neg_666=False, missing values are "-666" whether the metadata is typed or not
+        col_metadata_df.loc["cid2", "pert_idose"] = numpy.nan
+        neg_666_parsed = {}
+        for typed_metadata in [False, True]:
+            write_gctx.write(GCToo.GCToo(data_df=data_df, col_metadata_df=col_metadata_df), fn,
+                             typed_metadata=typed_metadata)
+            neg_666_parsed[typed_metadata] = parse_gctx.parse(fn, col_meta_only=True, convert_neg_666=False)
+        for field in ["cell_id", "pert_idose", "missing"]:
+            self.assertEqual([v == "-666" for v in neg_666_parsed[False][field]],
+                             [v == "-666" for v in neg_666_parsed[True][field]])
+        self.assertEqual(list(neg_666_parsed[False]["cell_id"]), list(neg_666_parsed[True]["cell_id"].astype(object)))
+        self.assertEqual("-666", neg_666_parsed[True]["cell_id"].iloc[2])
+        self.assertEqual("-666", neg_666_parsed[True]["pert_idose"].iloc[2])
+        self.assertTrue(numpy.isnan(parse_gctx.parse(fn, col_meta_only=True)["pert_idose"].iloc[2]))
+        os.remove(fn)
+
+    def test_write_compressed_chunks(self):
+        data_df = pandas.DataFrame(numpy.round(numpy.random.RandomState(0).randn(50, 30), 2),
+                                   index=["r{}".format(i) for i in range(50)],
+                                   columns=["c{}".format(i) for i in range(30)])
+        gctoo = GCToo.GCToo(data_df=data_df)
+
+        # chunks compressed in threads are byte-identical to those HDF5 writes itself
+        raw_chunks = {}
+        for workers in [1, 3]:
+            fn = "compressed_chunks_example_{}.gctx".format(workers)
+            write_gctx.write(gctoo, fn, max_chunk_kb=40, matrix_compression="gzip", matrix_compression_opts=6,
+                             shuffle=True, workers=workers)
+            hdf5_file = h5py.File(fn, "r")
+            data_dset = hdf5_file[write_gctx.data_matrix_node]
+            self.assertEqual((8, 50), data_dset.chunks)
+            raw_chunks[workers] = [data_dset.id.read_direct_chunk((i, 0))[1] for i in range(0, 30, 8)]
+            hdf5_file.close()
+            pandas.testing.assert_frame_equal(data_df.astype(numpy.float32), parse_gctx.parse(fn).data_df,
+                                              check_names=False)
+            os.remove(fn)
+        self.assertEqual(raw_chunks[1], raw_chunks[3])
+
+    def test_write_quantized(self):
+        values = numpy.random.RandomState(0).randn(50, 30) * 3
+        values[3, 4] = numpy.nan
+        data_df = pandas.DataFrame(values, index=["r{}".format(i) for i in range(50)],
+                                   columns=["c{}".format(i) for i in range(30)])
+        fn = "quantized_example.gctx"
+        write_gctx.write(GCToo.GCToo(data_df=data_df), fn, max_chunk_kb=8, quantize=True)
+
+        hdf5_file = h5py.File(fn, "r")
+        data_dset = hdf5_file[write_gctx.data_matrix_node]
+        self.assertEqual(numpy.int16, data_dset.dtype)
+        scale_factor = data_dset.attrs[write_gctx.scale_factor_attr]
+        self.assertAlmostEqual((numpy.nanmax(values) - numpy.nanmin(values)) / 65534, scale_factor)
+        hdf5_file.close()
+
+        # decoded within half a step; missing values survive
+        for parsed_df in [parse_gctx.parse(fn).data_df, parse_gctx.parse(fn, ridx=[1, 3, 40], cidx=[4, 5]).data_df,
+                          pandas.concat([block for (block, _) in parse_gctx.iterate(fn, block_size=8)], axis=1)]:
+            self.assertEqual(numpy.float32, parsed_df.values.dtype)
+            expected = data_df.loc[parsed_df.index, parsed_df.columns].values
+            self.assertTrue(numpy.array_equal(numpy.isnan(expected), numpy.isnan(parsed_df.values)))
+            self.assertLessEqual(numpy.nanmax(numpy.abs(parsed_df.values - expected)), scale_factor / 2 + 1e-6)
+
+        # appended values are encoded with the file's scale; values outside its range are not clipped but fail
+        extra_df = pandas.DataFrame([[0.5], [numpy.nan]] + [[0.0]] * 48, index=data_df.index, columns=["c_new"])
+        write_gctx.append(GCToo.GCToo(data_df=extra_df), fn)
+        parsed_df = parse_gctx.parse(fn, cid=["c_new"]).data_df
+        self.assertAlmostEqual(0.5, parsed_df.iloc[0, 0], delta=scale_factor)
+        self.assertTrue(numpy.isnan(parsed_df.iloc[1, 0]))
+        for (new_value, expected_msg) in [(1000.0, "number of values:  1  their range:  [1000.0, 1000.0]"),
+                                          (numpy.inf, "number of infinite values:  1")]:
+            out_of_range_df = pandas.DataFrame([[new_value]] + [[0.0]] * 49, index=data_df.index, columns=["c_bad"])
+            with self.assertRaises(Exception) as context:
+                write_gctx.append(GCToo.GCToo(data_df=out_of_range_df), fn)
+            self.assertIn(expected_msg, str(context.exception))
+        self.assertEqual((50, 31), parse_gctx.parse(fn).data_df.shape)
+        os.remove(fn)
+
+        # infinite values are not quantized as the largest / smallest value either
+        inf_df = data_df.copy()
+        inf_df.iloc[0, 0] = -numpy.inf
+        with self.assertRaises(Exception) as context:
+            write_gctx.write(GCToo.GCToo(data_df=inf_df), fn, quantize=True)
+        self.assertIn("cannot quantize infinite values", str(context.exception))
+        if os.path.exists(fn):
+            os.remove(fn)
+
+        # all-missing matrices still round-trip
+        (codes, scale_factor, add_offset) = write_gctx.quantize_matrix(numpy.full((2, 2), numpy.nan))
+        self.assertTrue(numpy.all(codes == write_gctx.quantized_missing_code))
+
+    def test_gctx_writer(self):
+        mini_gctoo = mini_gctoo_for_testing.make()
+        fn = "gctx_writer_example.gctx"
+
+        # append columns in blocks, rows given in a different order than the first block
+        with write_gctx.GCTXWriter(fn, row_metadata_df=mini_gctoo.row_metadata_df, max_chunk_kb=8) as writer:
+            for cols in [slice(0, 2), slice(2, 5), slice(5, 6)]:
+                data_block = mini_gctoo.data_df.iloc[::-1, cols]
+                writer.append_columns(data_block, mini_gctoo.col_metadata_df.iloc[cols])
+        hdf5_file = h5py.File(fn, "r")
+        self.assertEqual((None, 6), hdf5_file[write_gctx.data_matrix_node].maxshape)
+        hdf5_file.close()
+        parsed = parse_gctx.parse(fn)
+        pandas.testing.assert_frame_equal(mini_gctoo.data_df, parsed.data_df, check_dtype=False)
+        pandas.testing.assert_frame_equal(mini_gctoo.row_metadata_df, parsed.row_metadata_df)
+        pandas.testing.assert_frame_equal(mini_gctoo.col_metadata_df, parsed.col_metadata_df)
+        os.remove(fn)
+
+        # append rows, compressed, without metadata
+        with write_gctx.GCTXWriter(fn, matrix_compression="gzip", shuffle=True) as writer:
+            writer.append_rows(mini_gctoo.data_df.iloc[:4])
+            writer.append_rows(mini_gctoo.data_df.iloc[4:])
+        parsed = parse_gctx.parse(fn)
+        pandas.testing.assert_frame_equal(mini_gctoo.data_df, parsed.data_df, check_dtype=False)
+        self.assertEqual((6, 0), parsed.row_metadata_df.shape)
+        os.remove(fn)
+
+        # blocks must agree on the fixed dimension, and ids must be unique
+        writer = write_gctx.GCTXWriter(fn)
+        writer.append_columns(mini_gctoo.data_df.iloc[:, :2])
+        with self.assertRaises(Exception) as context:
+            writer.append_columns(mini_gctoo.data_df.iloc[1:, 2:])
+        self.assertIn("do not match", str(context.exception))
+        with self.assertRaises(Exception) as context:
+            writer.append_rows(mini_gctoo.data_df.iloc[:, 2:])
+        self.assertIn("cannot append rows", str(context.exception))
+        writer.append_columns(mini_gctoo.data_df.iloc[:, 1:3])
+        with self.assertRaises(Exception) as context:
+            writer.close()
+        self.assertIn("appended more than once", str(context.exception))
+        os.remove(fn)
+
+    def test_append(self):
+        mini_gctoo = mini_gctoo_for_testing.make()
+        fn = "append_example.gctx"
+
+        for typed_metadata in [False, True]:
+            first = GCToo.GCToo(data_df=mini_gctoo.data_df.iloc[:, :3], row_metadata_df=mini_gctoo.row_metadata_df,
+                                col_metadata_df=mini_gctoo.col_metadata_df.iloc[:3])
+            write_gctx.write(first, fn, typed_metadata=typed_metadata)
+
+            # rows in a different order; one metadata field missing, and a new category value
+            new_col_metadata_df = mini_gctoo.col_metadata_df.iloc[3:].drop(columns=["distil_ss"])
+            new_col_metadata_df["zmad_ref"] = ["population", "plate", "plate"]
+            # numeric row metadata given with another type / repr still matches the file's
+            new_row_metadata_df = mini_gctoo.row_metadata_df.iloc[::-1].assign(
+                distil_nsample=lambda df: df["distil_nsample"].astype(float),
+                distil_ss=lambda df: df["distil_ss"].map(lambda v: "{:.15f}".format(v)))
+            second = GCToo.GCToo(data_df=mini_gctoo.data_df.iloc[::-1, 3:],
+                                 row_metadata_df=new_row_metadata_df,
+                                 col_metadata_df=new_col_metadata_df)
+            write_gctx.append(second, fn)
+
+            parsed = parse_gctx.parse(fn)
+            pandas.testing.assert_frame_equal(mini_gctoo.data_df, parsed.data_df, check_dtype=False)
+            pandas.testing.assert_frame_equal(mini_gctoo.row_metadata_df.astype(str), parsed.row_metadata_df.astype(str))
+            self.assertEqual(["population"] * 4 + ["plate"] * 2, list(parsed.col_metadata_df["zmad_ref"]))
+            self.assertEqual(list(mini_gctoo.col_metadata_df["distil_ss"].iloc[:3]),
+                             list(parsed.col_metadata_df["distil_ss"].iloc[:3]))
+            self.assertTrue(parsed.col_metadata_df["distil_ss"].iloc[3:].isnull().all())
+            pandas.testing.assert_series_equal(mini_gctoo.col_metadata_df["count_cv"],
+                                               parsed.col_metadata_df["count_cv"])
+
+            # the id index covers the appended columns
+            cid = mini_gctoo.data_df.columns[4]
+            pandas.testing.assert_frame_equal(mini_gctoo.data_df[[cid]], parse_gctx.parse(fn, cid=[cid]).data_df,
+                                              check_dtype=False)
+            os.remove(fn)
+
+        # invalid appends
+        first = GCToo.GCToo(data_df=mini_gctoo.data_df.iloc[:, :3], row_metadata_df=mini_gctoo.row_metadata_df,
+                            col_metadata_df=mini_gctoo.col_metadata_df.iloc[:3])
+        write_gctx.write(first, fn)
+        invalid_appends = [
+            (GCToo.GCToo(data_df=mini_gctoo.data_df.iloc[1:, 3:]), "rows of gctoo_object do not match"),
+            (GCToo.GCToo(data_df=mini_gctoo.data_df.iloc[:, 2:]), "already in"),
+            (GCToo.GCToo(data_df=mini_gctoo.data_df.iloc[:, 3:],
+                         row_metadata_df=mini_gctoo.row_metadata_df.assign(zmad_ref="plate")), "['zmad_ref']"),
+            (GCToo.GCToo(data_df=mini_gctoo.data_df.iloc[:, 3:],
+                         col_metadata_df=mini_gctoo.col_metadata_df.iloc[3:].assign(new_field=1)), "new_field")]
+        for (gctoo, expected_msg) in invalid_appends:
+            with self.assertRaises(Exception) as context:
+                write_gctx.append(gctoo, fn)
+            self.assertIn(expected_msg, str(context.exception))
+        self.assertEqual((3, 6), parse_gctx.parse(fn).data_df.shape[::-1])
+        os.remove(fn)
+
+        write_gctx.write(first, fn, layout="contiguous")
+        with self.assertRaises(Exception) as context:
+            write_gctx.append(GCToo.GCToo(data_df=mini_gctoo.data_df.iloc[:, 3:]), fn)
+        self.assertIn("chunked and resizable", str(context.exception))
+        os.remove(fn)
+
+    def test_append_metadata_types(self):
+        fn = "append_types_example.gctx"
+
+        def make_gctoo(cids, **fields):
+            data_df = pandas.DataFrame(numpy.ones((2, len(cids)), dtype=numpy.float32), index=["r1", "r2"],
+                                       columns=cids)
+            return GCToo.GCToo(data_df=data_df, col_metadata_df=pandas.DataFrame(fields, index=cids))
+
+        first = make_gctoo(["c1", "c2"], dose=[1, 2], name=["aa", "bb"])
+        for typed_metadata in [False, True]:
+            # strings longer than the stored width are only written in place if the file has room for them
+            for (min_string_width, expected_width) in [(None, 18), (32, 32)]:
+                write_gctx.write(first, fn, typed_metadata=typed_metadata, min_string_width=min_string_width)
+                write_gctx.append(make_gctoo(["c3_with_longer_cid", "c4"], dose=[3, numpy.nan],
+                                             name=["a_much_longer_name", "x"]), fn)
+                with h5py.File(fn, "r") as hdf5_file:
+                    self.assertEqual(expected_width, hdf5_file[write_gctx.col_meta_group_node + "/name"].dtype.itemsize)
+                    # missing values are stored as -666 rather than making the field float
+                    self.assertEqual(numpy.int64, hdf5_file[write_gctx.col_meta_group_node + "/dose"].dtype)
+
+                    # the new ids are merged into the id index
+                    index_node = write_gctx.col_id_index_group_node
+                    self.assertEqual([b"c1", b"c2", b"c3_with_longer_cid", b"c4"],
+                                     list(hdf5_file[index_node + "/" + write_gctx.sorted_id_node][()]))
+                    self.assertEqual([0, 1, 2, 3], list(hdf5_file[index_node + "/" + write_gctx.sorted_idx_node][()]))
+
+                parsed = parse_gctx.parse(fn)
+                self.assertEqual([1, 2, 3], list(parsed.col_metadata_df["dose"].iloc[:3]))
+                self.assertTrue(numpy.isnan(parsed.col_metadata_df["dose"].iloc[3]))
+                self.assertEqual("a_much_longer_name", parsed.col_metadata_df["name"].iloc[2])
+                self.assertEqual(["c4", "c1"], list(parse_gctx.parse(fn, cid=["c4", "c1"], sort_col_meta=False).data_df.columns))
+
+                # values are not converted to another type to make them fit, and the file is left as it was
+                for (dose, expected_msg) in [(1.5, "without changing its type"), ("abc", "not numbers")]:
+                    with self.assertRaises(Exception) as context:
+                        write_gctx.append(make_gctoo(["c5"], dose=[dose], name=["y"]), fn)
+                    self.assertIn(expected_msg, str(context.exception))
+                self.assertEqual((2, 4), parse_gctx.parse(fn).data_df.shape)
+                os.remove(fn)
+
+    def test_update_metadata(self):
+        mini_gctoo = mini_gctoo_for_testing.make()
+        fn = "update_metadata_example.gctx"
+
+        for typed_metadata in [False, True]:
+            write_gctx.write(mini_gctoo, fn, layout="contiguous", typed_metadata=typed_metadata)
+            hdf5_file = h5py.File(fn, "r")
+            data_offset = hdf5_file[write_gctx.data_matrix_node].id.get_offset()
+            hdf5_file.close()
+
+            # replace one field and add another (ids in a different order), drop a third
+            new_col_metadata_df = pandas.DataFrame({"zmad_ref": ["a", "b", "a", "b", "a", numpy.nan],
+                                                    "new_field": range(6)},
+                                                   index=mini_gctoo.col_metadata_df.index[::-1])
+            write_gctx.update_metadata(fn, "col", new_col_metadata_df, drop_fields=["distil_ss"])
+
+            parsed = parse_gctx.parse(fn)
+            hdf5_file = h5py.File(fn, "r")
+            self.assertEqual(data_offset, hdf5_file[write_gctx.data_matrix_node].id.get_offset())
+            hdf5_file.close()
+            pandas.testing.assert_frame_equal(mini_gctoo.data_df, parsed.data_df, check_dtype=False)
+            expected_col_metadata_df = mini_gctoo.col_metadata_df.drop(columns=["distil_ss"])
+            expected_col_metadata_df["zmad_ref"] = new_col_metadata_df["zmad_ref"]
+            expected_col_metadata_df["new_field"] = new_col_metadata_df["new_field"]
+            self.assertEqual(sorted(expected_col_metadata_df.columns), sorted(parsed.col_metadata_df.columns))
+            for field in expected_col_metadata_df.columns:
+                self.assertEqual(list(expected_col_metadata_df[field].astype(str).replace("nan", "-666")),
+                                 list(parsed.col_metadata_df[field].astype(str).replace("nan", "-666")),
+                                 "{} typed_metadata: {}".format(field, typed_metadata))
+            os.remove(fn)
+
+        # ids must be exactly the file's, and the ids themselves cannot be dropped
+        write_gctx.write(mini_gctoo, fn)
+        with self.assertRaises(Exception) as context:
+            write_gctx.update_metadata(fn, "row", mini_gctoo.row_metadata_df.iloc[1:])
+        self.assertIn("missing_ids", str(context.exception))
+        with self.assertRaises(Exception) as context:
+            write_gctx.update_metadata(fn, "row", drop_fields=["id"])
+        self.assertIn("cannot drop", str(context.exception))
+        pandas.testing.assert_frame_equal(mini_gctoo.row_metadata_df, parse_gctx.parse(fn).row_metadata_df)
+        os.remove(fn)
+
     def test_check_fix_metadata(self):
         metadata_df = pandas.DataFrame({"a/b":range(3), "c":range(3,6)}, index=["e", "g/h", "i"])
         logger.debug("preparation - metadata_df:\n{}".format(metadata_df))
@@ -216,6 +620,51 @@ class TestWriteGctx(unittest.TestCase):
         r = write_gctx.check_fix_metadata(metadata_df)
         logger.debug("r.shape:  {}".format(r.shape))
         logger.debug("r:\n{}".format(r))
+        self.assertEqual(["a|b", "c"], list(r.columns))
+        self.assertEqual(["e", "g|h", "i"], list(r.index))
+        self.assertEqual(["a/b", "c"], list(metadata_df.columns))
+        self.assertTrue((r.values == metadata_df.values).all())
+
+    def test_write_utf8_metadata(self):
+        mini_gctoo = mini_gctoo_for_testing.make()
+        col_metadata_df = mini_gctoo.col_metadata_df.copy()
+        col_metadata_df["desc"] = ["caf\u00e9", "na\u00efve", numpy.nan, "plain", "\u03b2-actin", "plain"]
+        col_metadata_df.index = ["\u00b5" + c for c in col_metadata_df.index]
+        data_df = mini_gctoo.data_df.copy()
+        data_df.columns = col_metadata_df.index
+        gctoo = GCToo.GCToo(data_df=data_df, row_metadata_df=mini_gctoo.row_metadata_df,
+                            col_metadata_df=col_metadata_df)
+        fn = "utf8_metadata_example.gctx"
+
+        # fixed-length ASCII cannot hold these values
+        with self.assertRaises(Exception) as context:
+            write_gctx.write(gctoo, fn)
+        self.assertIn("utf8_metadata=True", str(context.exception))
+
+        for typed_metadata in [False, True]:
+            write_gctx.write(gctoo, fn, utf8_metadata=True, typed_metadata=typed_metadata)
+            parsed = parse_gctx.parse(fn, cid=[col_metadata_df.index[4], col_metadata_df.index[0]])
+            self.assertEqual(list(col_metadata_df.index[[0, 4]]), list(parsed.data_df.columns))
+            self.assertEqual(["caf\u00e9", "\u03b2-actin"], list(parsed.col_metadata_df["desc"]))
+            pandas.testing.assert_frame_equal(mini_gctoo.row_metadata_df, parse_gctx.parse(fn).row_metadata_df,
+                                              check_dtype=not typed_metadata, check_categorical=False)
+
+            # appended columns are encoded the same way
+            extra = GCToo.GCToo(data_df=data_df.iloc[:, :1].rename(columns=lambda c: c + "\u00e9"),
+                                col_metadata_df=col_metadata_df.iloc[:1].rename(index=lambda c: c + "\u00e9"))
+            write_gctx.append(extra, fn)
+            parsed_col_metadata_df = parse_gctx.parse(fn).col_metadata_df
+            self.assertEqual(7, parsed_col_metadata_df.shape[0])
+            self.assertEqual("caf\u00e9", parsed_col_metadata_df["desc"].iloc[-1])
+
+            # h5py < 3 has no Dataset.asstr; the strings are decoded the same way without it
+            with mock.patch.object(h5py.Dataset, "asstr", property(self.raise_attribute_error), create=True):
+                pandas.testing.assert_frame_equal(parsed_col_metadata_df, parse_gctx.parse(fn).col_metadata_df)
+            os.remove(fn)
+
+    @staticmethod
+    def raise_attribute_error(_):
+        raise AttributeError("asstr")
 
 
 if __name__ == "__main__":
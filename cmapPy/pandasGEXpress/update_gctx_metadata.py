@@ -0,0 +1,72 @@
+"""
+update_gctx_metadata.py
+
+Command-line script to add, replace or drop row / column metadata fields of an
+existing .gctx file in place. Annotations are read from tab-separated files whose
+first column holds the ids; they must cover exactly the ids of the .gctx file.
+Only the updated fields are written - the data matrix is not touched - so
+refreshing metadata takes seconds even for very large files. See
+write_gctx.update_metadata for the equivalent method.
+
+ex:
+    update_gctx_metadata -f my_big_file.gctx -col_annot_path new_sig_info.txt -drop_col_fields old_field
+
+"""
+import sys
+import logging
+import argparse
+import pandas as pd
+import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+
+__author__ = "Oana Enache"
+__email__ = "oana@broadinstitute.org"
+
+logger = logging.getLogger(setup_logger.LOGGER_NAME)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    # required
+    parser.add_argument("-filename", "-f", required=True,
+                        help=".gctx file whose metadata you would like to update (modified in place)")
+    # optional
+    parser.add_argument("-row_annot_path", default=None,
+                        help="Path to annotations file for rows; its fields are added or replaced")
+    parser.add_argument("-col_annot_path", default=None,
+                        help="Path to annotations file for columns; its fields are added or replaced")
+    parser.add_argument("-drop_row_fields", nargs="+", default=None,
+                        help="row metadata fields to remove")
+    parser.add_argument("-drop_col_fields", nargs="+", default=None,
+                        help="column metadata fields to remove")
+    parser.add_argument("-no_convert_back_to_neg_666", action="store_true", default=False,
+                        help="do not write missing annotation values as -666")
+    parser.add_argument("-verbose", "-v",
+                        help="Whether to print a bunch of output.", action="store_true", default=False)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args(sys.argv[1:])
+    setup_logger.setup(verbose=args.verbose)
+    update_gctx_metadata_main(args)
+
+
+def update_gctx_metadata_main(args):
+    """ Separate from main() in order to make command-line tool. """
+    annot_paths = {"row": args.row_annot_path, "col": args.col_annot_path}
+    drop_fields = {"row": args.drop_row_fields, "col": args.drop_col_fields}
+
+    for dim in ["row", "col"]:
+        if annot_paths[dim] is None and drop_fields[dim] is None:
+            continue
+        metadata_df = None
+        if annot_paths[dim] is not None:
+            metadata_df = pd.read_csv(annot_paths[dim], sep='\t', index_col=0, header=0, low_memory=False)
+        write_gctx.update_metadata(args.filename, dim, metadata_df=metadata_df, drop_fields=drop_fields[dim],
+                                   convert_back_to_neg_666=not args.no_convert_back_to_neg_666)
+
+
+if __name__ == "__main__":
+    main()
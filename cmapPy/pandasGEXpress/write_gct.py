@@ -2,6 +2,10 @@ import logging
 import pandas as pd
 import numpy as np
 import os
+import io
+import re
+import gzip
+import multiprocessing
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
 
 __author__ = "Lev Litichevskiy"
@@ -12,8 +16,14 @@ logger = logging.getLogger(setup_logger.LOGGER_NAME)
 # Only writes GCT1.3
 VERSION = "1.3"
 
+# number of data values formatted per block of rows of the bottom half
+default_block_values = 2 ** 20
+# data_float_format strings that format_fixed_point_block formats vectorized, e.g. "%.4f"
+fixed_point_format_regex = re.compile(r"^%\.(\d)f$")
 
-def write(gctoo, out_fname, data_null="NaN", metadata_null="-666", filler_null="-666", data_float_format="%.4f"):
+
+def write(gctoo, out_fname, data_null="NaN", metadata_null="-666", filler_null="-666", data_float_format="%.4f",
+          gzip_output=False, gzip_compression_level=6, block_rows=None, workers=1):
     """Write a gctoo object to a gct file.
 
     Args:
@@ -24,28 +34,48 @@ def write(gctoo, out_fname, data_null="NaN", metadata_null="-666", filler_null="
         filler_null (string): what value to fill the top-left filler block with (default = "-666")
         data_float_format (string): how many decimal points to keep in representing data
             (default = 4 digits; None will keep all digits)
+        gzip_output (bool): write a gzipped .gct.gz file (default = False). The header and each
+            block of rows are compressed separately (by the workers, if any) into consecutive
+            gzip members, which gzip readers read as one stream.
+        gzip_compression_level (int): compression level if gzip_output (default = 6)
+        block_rows (int): number of rows of data formatted at a time (default = None, about
+            default_block_values values per block)
+        workers (int): number of processes to format blocks of rows with; the rows are
+            written in order (default = 1)
 
     Returns:
         None
 
     """
-    # Create handle for output file
-    if not out_fname.endswith(".gct"):
-        out_fname += ".gct"
-    f = open(out_fname, "w")
+    # Create handle for output file (for a gzipped file, the header is compressed once complete)
+    if gzip_output:
+        if out_fname.endswith(".gct"):
+            out_fname += ".gz"
+        elif not out_fname.endswith(".gct.gz"):
+            out_fname += ".gct.gz"
+        f = open(out_fname, "wb")
+        header_f = io.StringIO()
+    else:
+        if not out_fname.endswith(".gct"):
+            out_fname += ".gct"
+        f = open(out_fname, "w")
+        header_f = f
 
     # Write first two lines
     dims = [str(gctoo.data_df.shape[0]), str(gctoo.data_df.shape[1]),
             str(gctoo.row_metadata_df.shape[1]), str(gctoo.col_metadata_df.shape[1])]
-    write_version_and_dims(VERSION, dims, f)
+    write_version_and_dims(VERSION, dims, header_f)
 
     # Write top half of the gct
-    write_top_half(f, gctoo.row_metadata_df, gctoo.col_metadata_df,
+    write_top_half(header_f, gctoo.row_metadata_df, gctoo.col_metadata_df,
                    metadata_null, filler_null)
+    if gzip_output:
+        f.write(gzip.compress(header_f.getvalue().encode("utf-8"), compresslevel=gzip_compression_level))
 
     # Write bottom half of the gct
     write_bottom_half(f, gctoo.row_metadata_df, gctoo.data_df,
-                      data_null, data_float_format, metadata_null)
+                      data_null, data_float_format, metadata_null, block_rows=block_rows, workers=workers,
+                      gzip_compression_level=gzip_compression_level if gzip_output else None)
 
     f.close()
     logger.info("GCT has been written to {}".format(out_fname))
@@ -102,9 +132,14 @@ def write_top_half(f, row_metadata_df, col_metadata_df, metadata_null, filler_nu
     top_half_df.to_csv(f, header=False, index=False, sep="\t")
 
 
-def write_bottom_half(f, row_metadata_df, data_df, data_null, data_float_format, metadata_null):
+def write_bottom_half(f, row_metadata_df, data_df, data_null, data_float_format, metadata_null,
+                      block_rows=None, workers=1, gzip_compression_level=None):
     """ Write the bottom half of the gct file: row metadata and data.
 
+    The rows are formatted and written a block at a time. Float data with a fixed-point
+    data_float_format (e.g. "%.4f") is formatted vectorized (see format_fixed_point_block),
+    anything else with pandas' to_csv.
+
     Args:
         f (file handle): handle for output file
         row_metadata_df (pandas df)
@@ -112,31 +147,151 @@ def write_bottom_half(f, row_metadata_df, data_df, data_null, data_float_format,
         data_null (string): how to represent missing values in the data
         metadata_null (string): how to represent missing values in the metadata
         data_float_format (string): how many decimal points to keep in representing data
+        block_rows (int): number of rows formatted at a time (default = None, about
+            default_block_values values per block)
+        workers (int): number of processes to format blocks with (default = 1)
+        gzip_compression_level (int): if not None, each block is written as a gzip member
+            compressed at this level, to a binary file handle (default = None)
 
     Returns:
         None
     """
-    # create the left side of the bottom half of the gct (for the row metadata)
-    size_of_left_bottom_half_df = (row_metadata_df.shape[0],
-                              1 + row_metadata_df.shape[1])
-    left_bottom_half_df = pd.DataFrame(np.full(size_of_left_bottom_half_df, metadata_null, dtype=object))
-
-    #create the full bottom half by combining with the above with the matrix data
-    bottom_half_df = pd.concat([left_bottom_half_df, data_df.reset_index(drop=True)], axis=1)
-    bottom_half_df.columns = range(bottom_half_df.shape[1])
-
-    # Insert the rids
-    bottom_half_df.iloc[:, 0] = row_metadata_df.index.values
-
-    # Insert the row metadata, but first convert to strings and replace NaNs
-    row_metadata_col_indices = range(1, 1 + row_metadata_df.shape[1])
-    bottom_half_df.iloc[:, row_metadata_col_indices] = (
-        row_metadata_df.astype(str).replace("nan", value=metadata_null).values)
-
-    # Write bottom_half_df to file
-    bottom_half_df.to_csv(f, header=False, index=False, sep="\t",
-                          na_rep=data_null,
-                          float_format=data_float_format)
+    if block_rows is None:
+        block_rows = max(1, default_block_values // max(1, data_df.shape[1]))
+
+    # the rid and row metadata of each row, as strings
+    row_metadata_strings = row_metadata_df.astype(str).replace("nan", value=metadata_null)
+    row_fields = [quote_fields(row_metadata_df.index.astype(str))] + [
+        quote_fields(row_metadata_strings[field]) for field in row_metadata_strings.columns]
+
+    # vectorized formatting only reproduces data_float_format for float data
+    decimals = None
+    fixed_point_format = (fixed_point_format_regex.match(data_float_format)
+                          if data_float_format is not None else None)
+    if fixed_point_format is not None and all(dtype.kind == "f" for dtype in data_df.dtypes):
+        decimals = int(fixed_point_format.group(1))
+
+    tasks = ((["\t".join(fields) for fields in zip(*[field[start:start + block_rows] for field in row_fields])],
+              data_df.values[start:start + block_rows] if decimals is not None else data_df.iloc[start:start + block_rows],
+              decimals, data_null, data_float_format, gzip_compression_level)
+             for start in range(0, data_df.shape[0], block_rows))
+
+    if workers > 1:
+        logger.debug("formatting the bottom half with {} worker processes".format(workers))
+        pool = multiprocessing.Pool(workers)
+        try:
+            # imap returns the blocks in order
+            for block in pool.imap(format_rows_block, tasks):
+                f.write(block)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            f.write(format_rows_block(task))
+
+
+def format_rows_block(task):
+    """
+    Formats a block of rows of the bottom half of the gct file (a task of write_bottom_half) into
+    a string, or into a gzip member if a compression level is given.
+    """
+    (row_prefixes, data_block, decimals, data_null, data_float_format, gzip_compression_level) = task
+    if data_block.shape[1] == 0:
+        block = "".join(row_prefix + "\n" for row_prefix in row_prefixes)
+    else:
+        if decimals is not None:
+            data_lines = format_fixed_point_block(data_block, decimals, data_null, data_float_format)
+        else:
+            data_lines = data_block.to_csv(header=False, index=False, sep="\t", na_rep=data_null,
+                                           float_format=data_float_format).splitlines()
+        block = "".join(row_prefix + "\t" + data_line + "\n"
+                        for (row_prefix, data_line) in zip(row_prefixes, data_lines))
+
+    if gzip_compression_level is not None:
+        return gzip.compress(block.encode("utf-8"), compresslevel=gzip_compression_level)
+    return block
+
+
+def format_fixed_point_block(values, decimals, data_null, data_float_format):
+    """ Formats a block of float data as data_float_format ("%.<decimals>f") does, vectorized.
+
+    Each value is rounded to an integer number of 10^-decimals, whose digits are laid out in a
+    byte array with one fixed-width field per value; the unused bytes are then dropped. Values
+    this cannot format exactly (NaN, infinities, values too large for the integers, and values
+    within rounding error of a tie) are formatted one at a time.
+
+    Args:
+        values (2D numpy array): block of data
+        decimals (int): number of digits after the decimal point
+        data_null (string): how to represent missing values
+        data_float_format (string): "%.<decimals>f"
+
+    Returns:
+        data_lines (list of strings): the tab-separated values of each row
+    """
+    (num_rows, num_cols) = values.shape
+    flat_values = values.astype(np.float64).ravel()
+    scale = 10 ** decimals
+
+    # the scaled values are exact integers below 2 ** 50, and rounding them to the nearest one is
+    # only ambiguous when they are within their own rounding error of a tie
+    scaled = np.abs(flat_values) * scale
+    with np.errstate(invalid="ignore"):
+        rounded = np.rint(scaled)
+        exact = (scaled < 2.0 ** 50) & (np.abs(np.abs(scaled - rounded) - 0.5) > scaled * 2.0 ** -51)
+    integers = np.where(exact, rounded, 0).astype(np.int64)
+    integer_parts = integers // scale
+    fraction_parts = integers % scale
+
+    # the other values, one at a time
+    nulls = np.flatnonzero(np.isnan(flat_values))
+    others = np.flatnonzero(~exact & ~np.isnan(flat_values))
+    other_strings = [(data_float_format % flat_values[i]).encode("utf-8") for i in others]
+    null_bytes = np.frombuffer(data_null.encode("utf-8"), dtype=np.uint8)
+
+    # one field per value: sign, integer digits, decimal point, fraction digits, separator
+    num_integer_digits = 1 + np.searchsorted(10 ** np.arange(1, 19, dtype=np.int64), integer_parts, side="right")
+    max_integer_digits = int(num_integer_digits.max()) if len(flat_values) > 0 else 1
+    number_width = 1 + max_integer_digits + (1 + decimals if decimals > 0 else 0)
+    width = max([number_width, len(null_bytes) if len(nulls) > 0 else 0] +
+                [len(other_string) for other_string in other_strings]) + 1
+    # unused bytes stay 0
+    fields = np.zeros((len(flat_values), width), dtype=np.uint8)
+    offset = width - 1 - number_width
+
+    fields[:, offset] = np.where(np.signbit(flat_values), ord("-"), 0)
+    digits = integer_parts.copy()
+    for i in range(max_integer_digits):
+        fields[:, offset + max_integer_digits - i] = np.where(i < num_integer_digits, digits % 10 + ord("0"), 0)
+        digits //= 10
+    if decimals > 0:
+        fields[:, offset + max_integer_digits + 1] = ord(".")
+        digits = fraction_parts.copy()
+        for i in range(decimals):
+            fields[:, width - 2 - i] = digits % 10 + ord("0")
+            digits //= 10
+
+    if len(nulls) > 0:
+        fields[nulls, :] = 0
+        fields[nulls, :len(null_bytes)] = null_bytes
+    for (i, other_string) in zip(others, other_strings):
+        fields[i, :] = 0
+        fields[i, :len(other_string)] = np.frombuffer(other_string, dtype=np.uint8)
+
+    # tabs between the values of a row, line breaks between rows
+    fields[:, width - 1] = ord("\t")
+    fields[num_cols - 1::num_cols, width - 1] = ord("\n")
+    return fields[fields != 0].tobytes().decode("utf-8").split("\n")[:num_rows]
+
+
+def quote_fields(strings):
+    """Quotes the strings that contain tabs, line breaks or quotes, as to_csv does."""
+    strings = pd.Series(np.asarray(strings, dtype=object), dtype=object)
+    needs_quotes = strings.str.contains('[\t\n\r"]', regex=True).fillna(False).values.astype(bool)
+    if needs_quotes.any():
+        strings[needs_quotes] = '"' + strings[needs_quotes].str.replace('"', '""', regex=False) + '"'
+    return list(strings)
 
 
 def append_dims_and_file_extension(fname, data_df):
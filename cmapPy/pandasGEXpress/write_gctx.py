@@ -1,8 +1,11 @@
 import logging
+import zlib
+from multiprocessing.pool import ThreadPool
 import h5py
 import numpy
 import pandas
 import cmapPy.pandasGEXpress.setup_GCToo_logger as setup_logger
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
 
 __author__ = "Oana Enache"
 __email__ = "oana@broadinstitute.org"
@@ -13,12 +16,35 @@ src_attr = "src"
 data_matrix_node = "/0/DATA/0/matrix"
 row_meta_group_node = "/0/META/ROW"
 col_meta_group_node = "/0/META/COL"
+row_id_index_group_node = "/0/ID_INDEX/ROW"
+col_id_index_group_node = "/0/ID_INDEX/COL"
+sorted_id_node = "sorted_id"
+sorted_idx_node = "sorted_idx"
+row_categories_group_node = "/0/META_CATEGORIES/ROW"
+col_categories_group_node = "/0/META_CATEGORIES/COL"
+metadata_dtype_attr = "dtype"
+# variable-length UTF-8 strings (h5py.string_dtype() is the same, but needs h5py 2.10+)
+vlen_string_dtype = h5py.special_dtype(vlen=str)
+# string fields with at most this fraction of distinct values are dictionary-encoded
+max_category_fraction = 0.5
 version_attr = "version"
 version_number = "GCTX1.0"
+# file alignment used for mmap_friendly output (page size)
+mmap_alignment = 4096
+# quantized storage of the data matrix, see quantize_matrix
+quantized_dtype = numpy.int16
+quantized_missing_code = numpy.iinfo(quantized_dtype).min
+scale_factor_attr = "scale_factor"
+add_offset_attr = "add_offset"
+missing_value_attr = "missing_value"
+# chunk layouts of the data matrix, see set_data_matrix_chunk_layout
+matrix_layouts = ("balanced", "column", "row", "contiguous")
 
 
 def write(gctoo_object, out_file_name, convert_back_to_neg_666=True, gzip_compression_level=6,
-    max_chunk_kb=1024, matrix_dtype=numpy.float32):
+    max_chunk_kb=1024, matrix_dtype=numpy.float32, id_index=True, mmap_friendly=False,
+    typed_metadata=False, layout="balanced", matrix_compression=None, matrix_compression_opts=None,
+    shuffle=False, workers=1, quantize=False, utf8_metadata=False, min_string_width=None):
     """
 	Writes a GCToo instance to specified file.
 
@@ -29,12 +55,45 @@ def write(gctoo_object, out_file_name, convert_back_to_neg_666=True, gzip_compre
         - gzip_compression_level (int, default=6): Compression level to use for metadata. 
         - max_chunk_kb (int, default=1024): The maximum number of KB a given chunk will occupy
         - matrix_dtype (numpy dtype, default=numpy.float32): Storage data type for data matrix. 
+        - id_index (bool, default=True): whether to also write a sorted id index for rows and columns
+            (under /0/ID_INDEX), which lets parse_gctx look up rid/cid without scanning the metadata.
+        - mmap_friendly (bool, default=False): store the data matrix uncompressed, contiguous and
+            page-aligned, so that parse_gctx.parse(..., mode="mmap") can map it directly. Implies
+            layout="contiguous".
+        - typed_metadata (bool, default=False): store each metadata field with its dtype recorded
+            (see write_metadata), so that parse_gctx reads it back without type inference.
+        - layout (str, default="balanced"): chunk layout of the data matrix, tuned to how it will be
+            read (see set_data_matrix_chunk_layout): "balanced" (cmapM / cmapR compatible chunks),
+            "column" (reading whole columns), "row" (reading whole rows) or "contiguous" (no chunks).
+        - matrix_compression (str, default=None): filter for the data matrix: "gzip", "lzf" or None.
+        - matrix_compression_opts (int, default=None): compression level for "gzip" (0-9; h5py's
+            default, 4, if None).
+        - shuffle (bool, default=False): apply HDF5's shuffle filter before compressing, which
+            usually improves the compression of float data.
+        - workers (int, default=1): number of threads to gzip-compress the chunks of the data matrix
+            with (see write_compressed_chunks); ignored unless matrix_compression="gzip".
+        - quantize (bool, default=False): store the data matrix lossily as int16 codes with scale
+            and offset attributes instead of matrix_dtype, halving its size (see quantize_matrix).
+            parse_gctx decodes it back to float32; values are off by at most
+            (max - min) / 131068 (plus float32 rounding), e.g. 1.5e-4 for values between -10 and 10.
+            The matrix must not have infinite values, and values appended later (see append) must
+            be within the range of the values written.
+        - utf8_metadata (bool, default=False): store string metadata (and ids) as variable-length
+            UTF-8 instead of fixed-length ASCII, so that non-ASCII values can be written.
+        - min_string_width (int, default=None): store fixed-length (ASCII) string metadata, ids
+            included, at least this many bytes wide. append can only add values longer than a
+            field's width by rewriting the whole field, so files that will be appended to should
+            be written with room to spare (or with utf8_metadata=True, whose strings have no width).
 	"""
     # make sure out file has a .gctx suffix
     gctx_out_name = add_gctx_to_out_name(out_file_name)
 
     # open an hdf5 file to write to
-    hdf5_out = h5py.File(gctx_out_name, "w")
+    if mmap_friendly:
+        hdf5_out = h5py.File(gctx_out_name, "w", alignment_threshold=mmap_alignment,
+                             alignment_interval=mmap_alignment)
+    else:
+        hdf5_out = h5py.File(gctx_out_name, "w")
 
     # write version
     write_version(hdf5_out)
@@ -42,29 +101,722 @@ def write(gctoo_object, out_file_name, convert_back_to_neg_666=True, gzip_compre
     # write src
     write_src(hdf5_out, gctoo_object, gctx_out_name)
 
+    if quantize:
+        matrix_dtype = quantized_dtype
+
     # set chunk size for data matrix
     elem_per_kb = calculate_elem_per_kb(max_chunk_kb, matrix_dtype)
-    chunk_size = set_data_matrix_chunk_size(gctoo_object.data_df.shape, max_chunk_kb, elem_per_kb)
+    chunk_size = set_data_matrix_chunk_layout(gctoo_object.data_df.shape, max_chunk_kb, elem_per_kb,
+        "contiguous" if mmap_friendly else layout)
+    if chunk_size is None and (matrix_compression is not None or shuffle):
+        msg = "the data matrix can only be compressed / shuffled if it is chunked - layout:  {}  mmap_friendly:  {}".format(
+            layout, mmap_friendly)
+        logger.error(msg)
+        raise Exception("write_gctx.write " + msg)
 
-    # write data matrix
+    # write data matrix (stored transposed, so chunks are too)
     data_df = check_fix_metadata(gctoo_object.data_df)
-    hdf5_out.create_dataset(data_matrix_node, data=data_df.transpose().values,
-        dtype=matrix_dtype)
+    matrix = data_df.values.transpose()
+    if quantize:
+        (matrix, scale_factor, add_offset) = quantize_matrix(matrix)
+    # chunked matrices can have columns appended later (see append)
+    if workers > 1 and matrix_compression == "gzip":
+        data_dset = hdf5_out.create_dataset(data_matrix_node, shape=data_df.shape[::-1],
+            dtype=matrix_dtype, chunks=chunk_size[::-1], maxshape=(None, data_df.shape[0]),
+            compression=matrix_compression, compression_opts=matrix_compression_opts, shuffle=shuffle)
+        write_compressed_chunks(data_dset, matrix, workers)
+    else:
+        data_dset = hdf5_out.create_dataset(data_matrix_node, data=matrix,
+            dtype=matrix_dtype, chunks=chunk_size[::-1] if chunk_size is not None else None,
+            maxshape=(None, data_df.shape[0]) if chunk_size is not None else None,
+            compression=matrix_compression, compression_opts=matrix_compression_opts,
+            shuffle=shuffle)
+    if quantize:
+        write_quantization_attrs(data_dset, scale_factor, add_offset)
 
     # write col metadata
     col_metadata_df = check_fix_metadata(gctoo_object.col_metadata_df)
     write_metadata(hdf5_out, "col", col_metadata_df, convert_back_to_neg_666,
-        gzip_compression=gzip_compression_level)
+        gzip_compression=gzip_compression_level, typed=typed_metadata, utf8=utf8_metadata,
+        min_string_width=min_string_width)
 
     # write row metadata
     row_metadata_df = check_fix_metadata(gctoo_object.row_metadata_df)
     write_metadata(hdf5_out, "row", row_metadata_df, convert_back_to_neg_666,
-        gzip_compression=gzip_compression_level)
+        gzip_compression=gzip_compression_level, typed=typed_metadata, utf8=utf8_metadata,
+        min_string_width=min_string_width)
+
+    # write id indexes
+    if id_index:
+        write_id_index(hdf5_out, "row", gzip_compression=gzip_compression_level)
+        write_id_index(hdf5_out, "col", gzip_compression=gzip_compression_level)
 
     # close gctx file
     hdf5_out.close()
 
 
+def write_compressed_chunks(data_dset, matrix, workers):
+    """
+	Fills a gzip (and optionally shuffle) filtered dataset by compressing its chunks with zlib in
+	a thread pool (zlib releases the GIL; HDF5's own filter pipeline does not run in parallel) and
+	writing the compressed bytes with write_direct_chunk. The chunks are exactly what HDF5 itself
+	would have stored, so the file reads normally with any HDF5 reader.
+
+	Input:
+		- data_dset (h5py dset): empty chunked dataset, created with compression="gzip"
+		- matrix (numpy array): values to write, of data_dset's shape (may be non-contiguous)
+		- workers (int): number of compression threads
+	"""
+    chunks = data_dset.chunks
+    compression_level = data_dset.compression_opts if data_dset.compression_opts is not None else 4
+    chunk_offsets = [(i, j) for i in range(0, matrix.shape[0], chunks[0]) for j in range(0, matrix.shape[1], chunks[1])]
+
+    def compress_chunk(chunk_offset):
+        (i, j) = chunk_offset
+        block = matrix[i:i + chunks[0], j:j + chunks[1]]
+        # HDF5 always stores whole chunks; edge chunks are padded
+        chunk = numpy.zeros(chunks, dtype=data_dset.dtype)
+        chunk[:block.shape[0], :block.shape[1]] = block
+        raw = shuffle_bytes(chunk) if data_dset.shuffle else chunk.tobytes()
+        return (chunk_offset, zlib.compress(raw, compression_level))
+
+    thread_pool = ThreadPool(workers)
+    try:
+        for (chunk_offset, compressed) in thread_pool.imap(compress_chunk, chunk_offsets):
+            data_dset.id.write_direct_chunk(chunk_offset, compressed)
+    finally:
+        thread_pool.close()
+    logger.debug("wrote {} compressed chunks with {} threads".format(len(chunk_offsets), workers))
+
+
+def shuffle_bytes(chunk):
+    """Applies HDF5's shuffle filter: byte k of every element is stored contiguously."""
+    element_bytes = chunk.reshape(-1).view(numpy.uint8).reshape(-1, chunk.dtype.itemsize)
+    byte_planes = numpy.empty((chunk.dtype.itemsize, element_bytes.shape[0]), dtype=numpy.uint8)
+    # copying one byte plane at a time is much faster than a transposed copy
+    for k in range(chunk.dtype.itemsize):
+        byte_planes[k] = element_bytes[:, k]
+    return byte_planes.tobytes()
+
+
+class GCTXWriter(object):
+    """
+    Writes a gctx file one block at a time, so that files larger than memory can be built.
+    The data matrix is created resizable and chunked, and each block is written to it as soon
+    as it is appended; metadata blocks are collected and written when the writer is closed.
+
+    Blocks are appended either as columns (append_columns: the rows are fixed by the first
+    block, or by row_metadata_df) or as rows (append_rows), not both.
+
+    ex:
+        with write_gctx.GCTXWriter("my_big_file.gctx", row_metadata_df=gene_info) as writer:
+            for (data_block, col_meta_block) in my_blocks:
+                writer.append_columns(data_block, col_meta_block)
+    """
+    def __init__(self, out_file_name, row_metadata_df=None, col_metadata_df=None, src=None,
+                 convert_back_to_neg_666=True, gzip_compression_level=6, max_chunk_kb=1024,
+                 matrix_dtype=numpy.float32, id_index=True, typed_metadata=False, layout="balanced",
+                 matrix_compression=None, matrix_compression_opts=None, shuffle=False, utf8_metadata=False,
+                 min_string_width=None):
+        """
+        Input:
+            - out_file_name (str): file name to write to (".gctx" is added if missing).
+            - row_metadata_df (pandas DataFrame): metadata of the fixed rows, when appending
+                columns; its index sets the row order. Default = None (ids of the first block).
+            - col_metadata_df (pandas DataFrame): same, for the fixed columns when appending rows.
+            - src (str): src attribute to write. Default = None (the file name).
+            - the remaining arguments are as for write; layout cannot be "contiguous".
+        """
+        self.gctx_out_name = add_gctx_to_out_name(out_file_name)
+        self.fixed_metadata_df = {"row": row_metadata_df, "col": col_metadata_df}
+        self.convert_back_to_neg_666 = convert_back_to_neg_666
+        self.gzip_compression_level = gzip_compression_level
+        self.max_chunk_kb = max_chunk_kb
+        self.matrix_dtype = matrix_dtype
+        self.id_index = id_index
+        self.typed_metadata = typed_metadata
+        self.layout = layout
+        self.matrix_compression = matrix_compression
+        self.matrix_compression_opts = matrix_compression_opts
+        self.shuffle = shuffle
+        self.utf8_metadata = utf8_metadata
+        self.min_string_width = min_string_width
+
+        if layout == "contiguous":
+            msg = "the data matrix of a GCTXWriter must be chunked to be resizable - layout:  {}".format(layout)
+            logger.error(msg)
+            raise Exception("write_gctx.GCTXWriter " + msg)
+
+        # "col" if appending columns, "row" if appending rows; set by the first append
+        self.append_dim = None
+        self.fixed_ids = None
+        self.meta_blocks = []
+        self.data_dset = None
+
+        self.hdf5_out = h5py.File(self.gctx_out_name, "w")
+        write_version(self.hdf5_out)
+        self.hdf5_out.attrs[src_attr] = self.gctx_out_name if src is None else src
+
+    def append_columns(self, data_block, col_meta_block=None):
+        """
+        Appends columns to the data matrix.
+
+        Input:
+            - data_block (pandas DataFrame): rid x cid block of data; its rows must be the
+                writer's rows (in any order)
+            - col_meta_block (pandas DataFrame): metadata of the block's columns.
+                Default = None (ids only).
+        """
+        self.append(data_block, col_meta_block, "col")
+
+    def append_rows(self, data_block, row_meta_block=None):
+        """
+        Appends rows to the data matrix; see append_columns.
+
+        Input:
+            - data_block (pandas DataFrame): rid x cid block of data
+            - row_meta_block (pandas DataFrame): metadata of the block's rows. Default = None.
+        """
+        self.append(data_block, row_meta_block, "row")
+
+    def append(self, data_block, meta_block, dim):
+        if self.append_dim is None:
+            self.start(data_block, dim)
+        elif dim != self.append_dim:
+            msg = "cannot append {}s to a GCTXWriter that {}s were already appended to".format(dim, self.append_dim)
+            logger.error(msg)
+            raise Exception("write_gctx.GCTXWriter.append " + msg)
+
+        # put the fixed dimension in the writer's order
+        block_fixed_ids = data_block.index if dim == "col" else data_block.columns
+        if not block_fixed_ids.equals(self.fixed_ids):
+            if len(block_fixed_ids) != len(self.fixed_ids) or not block_fixed_ids.isin(self.fixed_ids).all():
+                msg = "the {}s of data_block do not match those of the GCTXWriter".format("row" if dim == "col" else "col")
+                logger.error(msg)
+                raise Exception("write_gctx.GCTXWriter.append " + msg)
+            data_block = data_block.loc[self.fixed_ids, :] if dim == "col" else data_block.loc[:, self.fixed_ids]
+
+        block_ids = data_block.columns if dim == "col" else data_block.index
+        if meta_block is None:
+            meta_block = pandas.DataFrame(index=block_ids)
+        elif not meta_block.index.equals(block_ids):
+            meta_block = meta_block.loc[block_ids, :]
+        self.meta_blocks.append(meta_block)
+
+        # the matrix is stored cid x rid: columns are appended along axis 0, rows along axis 1
+        axis = 0 if dim == "col" else 1
+        start = self.data_dset.shape[axis]
+        self.data_dset.resize(start + len(block_ids), axis=axis)
+        if dim == "col":
+            self.data_dset[start:start + len(block_ids), :] = data_block.values.transpose()
+        else:
+            self.data_dset[:, start:start + len(block_ids)] = data_block.values.transpose()
+        logger.debug("appended {} {}s to {}".format(len(block_ids), dim, self.gctx_out_name))
+
+    def start(self, data_block, dim):
+        """Fixes the other dimension and creates the (empty) resizable data matrix."""
+        self.append_dim = dim
+        fixed_dim = "row" if dim == "col" else "col"
+        if self.fixed_metadata_df[fixed_dim] is not None:
+            self.fixed_ids = self.fixed_metadata_df[fixed_dim].index
+        else:
+            self.fixed_ids = data_block.index if dim == "col" else data_block.columns
+
+        # the appended dimension has no known size; chunk it as if it were unbounded
+        elem_per_kb = calculate_elem_per_kb(self.max_chunk_kb, self.matrix_dtype)
+        unbounded = numpy.iinfo(numpy.int32).max
+        df_shape = (len(self.fixed_ids), unbounded) if dim == "col" else (unbounded, len(self.fixed_ids))
+        chunk_size = set_data_matrix_chunk_layout(df_shape, self.max_chunk_kb, elem_per_kb, self.layout)
+        if chunk_size is None:
+            # nothing to chunk along the fixed dimension; any chunk shape will do
+            chunk_size = (1, 1)
+
+        shape = (0, len(self.fixed_ids)) if dim == "col" else (len(self.fixed_ids), 0)
+        maxshape = (None, len(self.fixed_ids)) if dim == "col" else (len(self.fixed_ids), None)
+        self.data_dset = self.hdf5_out.create_dataset(
+            data_matrix_node, shape=shape, maxshape=maxshape, dtype=self.matrix_dtype,
+            chunks=tuple(max(1, int(c)) for c in chunk_size[::-1]), compression=self.matrix_compression,
+            compression_opts=self.matrix_compression_opts, shuffle=self.shuffle)
+
+    def close(self):
+        """Writes the metadata and closes the file."""
+        if self.append_dim is None:
+            msg = "nothing was appended to the GCTXWriter"
+            logger.error(msg)
+            self.hdf5_out.close()
+            raise Exception("write_gctx.GCTXWriter.close " + msg)
+
+        appended_metadata_df = pandas.concat(self.meta_blocks, axis=0, sort=False)
+        if appended_metadata_df.index.has_duplicates:
+            msg = "the same {} id was appended more than once - duplicated ids:  {}".format(
+                self.append_dim, list(appended_metadata_df.index[appended_metadata_df.index.duplicated()][:10]))
+            logger.error(msg)
+            self.hdf5_out.close()
+            raise Exception("write_gctx.GCTXWriter.close " + msg)
+
+        fixed_dim = "row" if self.append_dim == "col" else "col"
+        fixed_metadata_df = self.fixed_metadata_df[fixed_dim]
+        if fixed_metadata_df is None:
+            fixed_metadata_df = pandas.DataFrame(index=self.fixed_ids)
+        metadata_dfs = {self.append_dim: appended_metadata_df, fixed_dim: fixed_metadata_df}
+
+        for dim in ["col", "row"]:
+            write_metadata(self.hdf5_out, dim, check_fix_metadata(metadata_dfs[dim]), self.convert_back_to_neg_666,
+                           gzip_compression=self.gzip_compression_level, typed=self.typed_metadata,
+                           utf8=self.utf8_metadata, min_string_width=self.min_string_width)
+        if self.id_index:
+            write_id_index(self.hdf5_out, "row", gzip_compression=self.gzip_compression_level)
+            write_id_index(self.hdf5_out, "col", gzip_compression=self.gzip_compression_level)
+
+        self.hdf5_out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # leave the incomplete file as it is
+            self.hdf5_out.close()
+
+
+def append(gctoo_object, gctx_file_path, convert_back_to_neg_666=True, gzip_compression_level=6):
+    """
+	Appends the columns (signatures) of a GCToo to an existing gctx file in place: the data
+	matrix and every column metadata dataset are resized and the new entries written after the
+	existing ones, which are not read or rewritten. Besides the new data, an append reads the
+	file's row ids (and row metadata, if gctoo_object has any) to check them, and reads and
+	rewrites the column id index, if the file has one, with the new ids merged in (see
+	merge_id_index): time and I/O proportional to the number of columns, though far less than
+	rewriting the file.
+
+	A fixed-length string field (or the ids) is rewritten in full if a new value is longer than
+	its width; write the file with min_string_width (or utf8_metadata=True) to avoid this.
+	Values are never converted to another type to make them fit: appending e.g. a float or a
+	string that is not a number to an integer field fails, and the field has to be converted
+	with update_metadata first. Missing values ("-666") can be appended to numeric fields, as
+	the number -666.
+	If the file's data matrix is quantized, the new values are encoded with its scale and offset,
+	and values outside its range (or infinite) fail rather than lose precision (see quantize_matrix).
+
+	Input:
+		- gctoo_object (GCToo): columns to append. Its rows must be those of the file (in any
+			order); if it has row metadata, it must match the file's. Its column metadata may
+			only have fields the file already has; missing fields are written as "-666".
+		- gctx_file_path (str): gctx file to append to. Its data matrix must be chunked and
+			resizable, as write (with a chunked layout) and GCTXWriter create it.
+		- convert_back_to_neg_666 (bool): whether to convert numpy.nans back to "-666"
+		- gzip_compression_level (int): compression level for datasets that have to be rewritten
+	"""
+    hdf5_out = h5py.File(gctx_file_path, "r+")
+    try:
+        data_dset = hdf5_out[data_matrix_node]
+        if data_dset.chunks is None or data_dset.maxshape[0] is not None:
+            msg = ("can only append to a gctx whose data matrix is chunked and resizable; rewrite it with "
+                   "write_gctx.write first - chunks:  {}  maxshape:  {}").format(data_dset.chunks, data_dset.maxshape)
+            logger.error(msg)
+            raise Exception("write_gctx.append " + msg)
+
+        # validate rows and put the new data in the file's row order
+        data_df = check_fix_metadata(gctoo_object.data_df)
+        row_ids = pandas.Index(parse_gctx.read_string_array(hdf5_out[row_meta_group_node + "/id"]))
+        if len(data_df.index) != len(row_ids) or not data_df.index.isin(row_ids).all():
+            msg = "the rows of gctoo_object do not match those of {}".format(gctx_file_path)
+            logger.error(msg)
+            raise Exception("write_gctx.append " + msg)
+        data_df = data_df.loc[row_ids, :]
+        check_appended_row_metadata(hdf5_out, row_ids, check_fix_metadata(gctoo_object.row_metadata_df))
+
+        if col_id_index_group_node in hdf5_out:
+            # look the new ids up in the id index rather than reading all of the ids
+            sorted_id_dset = hdf5_out[col_id_index_group_node + "/" + sorted_id_node]
+            query_ids = numpy.array([str(c).encode("utf-8") for c in data_df.columns], dtype=bytes)
+            duplicated_ids = data_df.columns[parse_gctx.search_sorted_dset(sorted_id_dset, query_ids)[1]]
+        else:
+            col_ids = pandas.Index(parse_gctx.read_string_array(hdf5_out[col_meta_group_node + "/id"]))
+            duplicated_ids = data_df.columns[data_df.columns.isin(col_ids)]
+        if len(duplicated_ids) > 0:
+            msg = "some columns of gctoo_object are already in {} - duplicated_ids:  {}".format(
+                gctx_file_path, list(duplicated_ids[:10]))
+            logger.error(msg)
+            raise Exception("write_gctx.append " + msg)
+        col_metadata_df = check_fix_metadata(gctoo_object.col_metadata_df).loc[data_df.columns, :]
+
+        # extend the data matrix, then the column metadata
+        matrix = data_df.values.transpose()
+        if scale_factor_attr in data_dset.attrs:
+            (matrix, _, _) = quantize_matrix(matrix, data_dset.attrs[scale_factor_attr],
+                                             data_dset.attrs[add_offset_attr])
+        # check the metadata can be appended before changing anything
+        encoded = encode_appended_metadata(hdf5_out, "col", col_metadata_df, convert_back_to_neg_666)
+        try:
+            start = data_dset.shape[0]
+            data_dset.resize(start + data_df.shape[1], axis=0)
+            data_dset[start:, :] = matrix
+            append_metadata(hdf5_out, encoded, "col", convert_back_to_neg_666, gzip_compression_level)
+
+            if col_id_index_group_node in hdf5_out:
+                merge_id_index(hdf5_out, "col", encoded[col_meta_group_node + "/id"][()], start,
+                               gzip_compression_level)
+        finally:
+            encoded.close()
+        logger.info("appended {} columns to {}".format(data_df.shape[1], gctx_file_path))
+    finally:
+        hdf5_out.close()
+
+
+def check_appended_row_metadata(hdf5_out, row_ids, row_metadata_df):
+    """
+	Checks that the row metadata of a GCToo being appended (if it has any) matches the file's.
+
+	Input:
+		- hdf5_out (h5py): open hdf5 file being appended to
+		- row_ids (pandas Index): row ids of the file, in file order
+		- row_metadata_df (pandas DataFrame): row metadata of the GCToo being appended
+	"""
+    if row_metadata_df.shape[1] == 0:
+        return
+    file_row_metadata_df = parse_gctx.parse_metadata_df("row", hdf5_out[row_meta_group_node], True)
+    row_metadata_df = row_metadata_df.loc[row_ids, :]
+
+    mismatched_fields = set(row_metadata_df.columns) ^ set(file_row_metadata_df.columns)
+    for field in set(row_metadata_df.columns) & set(file_row_metadata_df.columns):
+        if not metadata_values_match(row_metadata_df[field].values, file_row_metadata_df[field].values).all():
+            mismatched_fields.add(field)
+    if len(mismatched_fields) > 0:
+        msg = "the row metadata of gctoo_object does not match the file's - mismatched_fields:  {}".format(
+            sorted(mismatched_fields))
+        logger.error(msg)
+        raise Exception("write_gctx.append " + msg)
+
+
+def metadata_values_match(values, file_values):
+    """
+	Compares metadata values with the file's, element-wise: as numbers where both are numbers
+	(so 1 matches 1.0 and "1.50"), as strings otherwise. Missing values (NaN, -666 or "-666")
+	match each other.
+
+	Input:
+		- values (numpy array): values given
+		- file_values (numpy array): values parsed from the file, same length
+	Output:
+		- match (numpy array of bool)
+	"""
+    compared = []
+    for v in [values, file_values]:
+        v = pandas.Series(numpy.asarray(v, dtype=object))
+        numbers = pandas.to_numeric(v, errors="coerce")
+        missing = v.isnull() | (numbers == -666)
+        compared.append((v.astype(str).values, numbers.values, missing.values, (numbers.notnull() & ~missing).values))
+    ((strings, numbers, missing, is_number), (file_strings, file_numbers, file_missing, file_is_number)) = compared
+
+    both_numbers = is_number & file_is_number
+    return ((missing & file_missing) | (both_numbers & (numbers == file_numbers)) |
+            (~missing & ~file_missing & ~both_numbers & (strings == file_strings)))
+
+
+def encode_appended_metadata(hdf5_out, dim, metadata_df, convert_back_to_neg_666):
+    """
+	Encodes the metadata of entries to be appended the way write_metadata would for this file
+	(typed and / or UTF-8, if the file's metadata is), and checks that every field of the file
+	can take them without changing its type (see convert_appended_values).
+
+	Input:
+		- hdf5_out (h5py): open hdf5 file that will be appended to
+		- dim (str; must be "row" or "col"): dimension of metadata
+		- metadata_df (pandas DataFrame): metadata of the appended entries
+		- convert_back_to_neg_666 (bool): see write_metadata
+	Output:
+		- encoded (h5py File): in-memory file holding the encoded entries; to be closed by the caller
+	"""
+    meta_group_node = col_meta_group_node if dim == "col" else row_meta_group_node
+    meta_group = hdf5_out[meta_group_node]
+    fields = [k for k in meta_group.keys() if k != "id"]
+    (typed, utf8) = get_metadata_encoding(meta_group)
+
+    new_fields = [c for c in metadata_df.columns if c not in fields and c != "ind"]
+    if len(new_fields) > 0:
+        msg = "cannot append {} metadata fields the file does not have - new_fields:  {}".format(dim, new_fields)
+        logger.error(msg)
+        raise Exception("write_gctx.append_metadata " + msg)
+    metadata_df = metadata_df.reindex(columns=fields)
+
+    # encode the new entries in an in-memory file
+    encoded = h5py.File("append_metadata_{}.gctx".format(id(metadata_df)), "w", driver="core", backing_store=False)
+    try:
+        write_metadata(encoded, dim, metadata_df, convert_back_to_neg_666, gzip_compression=None, typed=typed,
+                       utf8=utf8)
+        for field in fields:
+            dset = meta_group[field]
+            if dset.attrs.get(metadata_dtype_attr) != "category" and not parse_gctx.is_string_dset(dset):
+                new_values = decode_encoded_field(encoded, dim, field, encoded[meta_group_node + "/" + field].attrs.get(
+                    metadata_dtype_attr))
+                convert_appended_values(new_values, dset.dtype, dim, field, convert_back_to_neg_666)
+    except Exception:
+        encoded.close()
+        raise
+    return encoded
+
+
+def append_metadata(hdf5_out, encoded, dim, convert_back_to_neg_666, gzip_compression):
+    """
+	Extends every metadata dataset of dim with the entries encoded by encode_appended_metadata.
+	Each dataset is resized in place, or rewritten if it cannot hold them (see extend_dataset).
+
+	Input:
+		- hdf5_out (h5py): open hdf5 file to write to
+		- encoded (h5py File): output of encode_appended_metadata
+		- dim (str; must be "row" or "col"): dimension of metadata to extend
+		- convert_back_to_neg_666 (bool): see write_metadata
+		- gzip_compression (int): compression level for rewritten datasets
+	"""
+    meta_group = hdf5_out[col_meta_group_node if dim == "col" else row_meta_group_node]
+    for field in ["id"] + [k for k in meta_group.keys() if k != "id"]:
+        extend_metadata_field(hdf5_out, encoded, dim, field, convert_back_to_neg_666, gzip_compression)
+
+
+def extend_metadata_field(hdf5_out, encoded, dim, field, convert_back_to_neg_666, gzip_compression):
+    """
+	Appends the values of one field, as encoded in another (in-memory) file, to hdf5_out.
+	New values are converted to the field's type (see convert_appended_values); dictionary-encoded
+	fields have their category table extended and the new codes remapped.
+	"""
+    meta_group_node = col_meta_group_node if dim == "col" else row_meta_group_node
+    categories_group_node = col_categories_group_node if dim == "col" else row_categories_group_node
+    node = meta_group_node + "/" + field
+    dset = hdf5_out[node]
+    field_dtype = dset.attrs.get(metadata_dtype_attr)
+    new_dtype = encoded[node].attrs.get(metadata_dtype_attr)
+    new_values = decode_encoded_field(encoded, dim, field, new_dtype)
+
+    if field_dtype == "category":
+        categories_dset = hdf5_out[categories_group_node + "/" + field]
+        categories = list(parse_gctx.read_string_array(categories_dset))
+        known = set(categories)
+        for value in pandas.unique(new_values[pandas.notnull(new_values)]):
+            if value not in known:
+                categories.append(value)
+                known.add(value)
+        if len(categories) > categories_dset.shape[0]:
+            extend_dataset(hdf5_out, categories_group_node + "/" + field, numpy.array([], dtype="S1"),
+                           gzip_compression,
+                           replace_values=encode_strings(categories, parse_gctx.is_vlen_string_dset(categories_dset)))
+        new_codes = pandas.Categorical(new_values, categories=categories).codes
+        codes_dtype = numpy.promote_types(dset.dtype, numpy.min_scalar_type(-max(len(categories), 1)))
+        extend_dataset(hdf5_out, node, new_codes.astype(codes_dtype), gzip_compression)
+        return
+
+    if parse_gctx.is_vlen_string_dset(dset):
+        new_values = encode_strings(["-666" if v is None else v for v in new_values], utf8=True)
+    elif dset.dtype.kind == "S":
+        new_values = numpy.array(["-666" if v is None else str(v) for v in new_values], dtype=object).astype("S")
+    else:
+        new_values = convert_appended_values(new_values, dset.dtype, dim, field, convert_back_to_neg_666)
+    extend_dataset(hdf5_out, node, new_values, gzip_compression)
+
+
+def convert_appended_values(values, dtype, dim, field, convert_back_to_neg_666):
+    """
+	Converts values being appended to a numeric (or boolean) metadata field to the field's dtype.
+	Strings are read as numbers, "-666" included, and if convert_back_to_neg_666 missing values
+	of integer fields are stored as -666 (which parse_gctx reads as missing). Values that would
+	change in the conversion (e.g. 1.5 for an integer field, or "abc") raise an Exception rather
+	than have the field converted to a type that can hold them, which would change its existing
+	values.
+
+	Input:
+		- values (numpy array): encoded values to append (see decode_encoded_field)
+		- dtype (numpy dtype): dtype of the field in the file
+		- dim (str): "row" or "col", for error messages
+		- field (str): name of the field, for error messages
+		- convert_back_to_neg_666 (bool): see write_metadata
+	Output:
+		- converted (numpy array): values as dtype
+	"""
+    if values.dtype.kind in ("S", "U", "O"):
+        strings = pandas.Series([v.decode("utf-8") if isinstance(v, bytes) else v for v in values], dtype=object)
+        numbers = pandas.to_numeric(strings, errors="coerce")
+        is_number = numbers.notnull().values | strings.isin(["nan", "NaN"]).values
+        if not is_number.all():
+            msg = ("cannot append values that are not numbers to the numeric {} metadata field {}; convert the "
+                   "field with update_metadata first - dtype:  {}  values:  {}").format(
+                dim, field, dtype, list(strings[~is_number].unique()[:10]))
+            logger.error(msg)
+            raise Exception("write_gctx.append " + msg)
+        values = numbers.values
+    if convert_back_to_neg_666 and dtype.kind in ("i", "u") and values.dtype.kind == "f":
+        values = numpy.where(numpy.isnan(values), -666, values)
+
+    with numpy.errstate(invalid="ignore", over="ignore"):
+        converted = values.astype(dtype)
+    changed = ~((converted == values) | (pandas.isnull(converted) & pandas.isnull(values)))
+    if changed.any():
+        msg = ("cannot append values to the {} metadata field {} without changing its type; convert the field "
+               "with update_metadata first - dtype:  {}  values:  {}").format(
+            dim, field, dtype, list(pandas.unique(values[changed])[:10]))
+        logger.error(msg)
+        raise Exception("write_gctx.append " + msg)
+    return converted
+
+
+def decode_encoded_field(encoded, dim, field, field_dtype):
+    """Reads a field written by write_metadata; dictionary-encoded values are decoded (missing as None)."""
+    meta_group_node = col_meta_group_node if dim == "col" else row_meta_group_node
+    categories_group_node = col_categories_group_node if dim == "col" else row_categories_group_node
+    dset = encoded[meta_group_node + "/" + field]
+    if parse_gctx.is_string_dset(dset):
+        return parse_gctx.read_string_array(dset).astype(object)
+    values = dset[()]
+    if field_dtype == "category":
+        categories = parse_gctx.read_string_array(encoded[categories_group_node + "/" + field]).astype(object)
+        return numpy.array([categories[c] if c >= 0 else None for c in values], dtype=object)
+    return values
+
+
+def extend_dataset(hdf5_out, node, new_values, gzip_compression, replace_values=None):
+    """
+	Appends new_values (of a type the dataset's values can be converted to without change) to a
+	1D dataset, resizing it in place. A dataset that is not resizable, or whose dtype is too
+	narrow for new_values (longer fixed-length strings, wider category codes), is rewritten
+	instead, keeping its attributes; this reads and writes the whole dataset. If replace_values
+	is given, the dataset is rewritten with those values instead.
+	"""
+    dset = hdf5_out[node]
+    if replace_values is None:
+        dtype = numpy.promote_types(dset.dtype, new_values.dtype)
+        if dset.maxshape[0] is None and dtype == dset.dtype:
+            start = dset.shape[0]
+            dset.resize(start + len(new_values), axis=0)
+            if len(new_values) > 0:
+                dset[start:] = new_values
+            return
+        logger.warning("rewriting {} ({} entries) to append to it - dtype:  {}  new dtype:  {}  resizable:  {}".format(
+            node, dset.shape[0], dset.dtype, dtype, dset.maxshape[0] is None))
+        replace_values = numpy.concatenate([dset[()].astype(dtype), new_values.astype(dtype)])
+
+    attrs = dict(dset.attrs)
+    del hdf5_out[node]
+    dset = hdf5_out.create_dataset(node, data=replace_values, compression=gzip_compression, maxshape=(None,),
+                                   dtype=vlen_string_dtype if replace_values.dtype == object else None)
+    for (k, v) in attrs.items():
+        dset.attrs[k] = v
+
+
+def update_metadata(gctx_file_path, dim, metadata_df=None, drop_fields=None, convert_back_to_neg_666=True,
+                    gzip_compression_level=6):
+    """
+	Adds, replaces or drops row or column metadata fields of an existing gctx file in place. Only
+	the datasets of those fields are written; the data matrix, the ids (and their index) and the
+	other fields are left untouched. Fields are encoded the way the file's metadata already is
+	(typed and / or UTF-8, see write).
+
+	Note that HDF5 does not reclaim the space of replaced or dropped datasets; after many updates
+	a file can be shrunk with h5repack.
+
+	Input:
+		- gctx_file_path (str): gctx file to update
+		- dim (str; must be "row" or "col"): dimension of metadata to update
+		- metadata_df (pandas DataFrame): fields to add or replace. Its index must hold exactly the
+			ids of dim in the file, in any order. Default = None (only drop fields).
+		- drop_fields (list of strings): fields to remove. Default = None.
+		- convert_back_to_neg_666 (bool): whether to convert numpy.nans back to "-666"
+		- gzip_compression_level (int): compression level for the written fields
+	"""
+    assert dim in ["row", "col"], "dim specified must be either 'row' or 'col'"
+    meta_group_node = col_meta_group_node if dim == "col" else row_meta_group_node
+    drop_fields = [] if drop_fields is None else list(drop_fields)
+
+    hdf5_out = h5py.File(gctx_file_path, "r+")
+    try:
+        meta_group = hdf5_out[meta_group_node]
+        unknown_fields = [f for f in drop_fields if f == "id" or f not in meta_group]
+        if len(unknown_fields) > 0:
+            msg = "cannot drop {} metadata fields that are the ids or that the file does not have - unknown_fields:  {}".format(
+                dim, unknown_fields)
+            logger.error(msg)
+            raise Exception("write_gctx.update_metadata " + msg)
+
+        if metadata_df is not None:
+            metadata_df = check_metadata_ids(meta_group, dim, check_fix_metadata(metadata_df), gctx_file_path)
+            fields = [c for c in metadata_df.columns if c not in ("id", "ind")]
+            dropped_and_updated = set(fields) & set(drop_fields)
+            if len(dropped_and_updated) > 0:
+                msg = "fields cannot be both dropped and updated - fields:  {}".format(sorted(dropped_and_updated))
+                logger.error(msg)
+                raise Exception("write_gctx.update_metadata " + msg)
+            replace_metadata_fields(hdf5_out, dim, metadata_df[fields], convert_back_to_neg_666,
+                                    gzip_compression_level)
+
+        for field in drop_fields:
+            delete_metadata_field(hdf5_out, dim, field)
+    finally:
+        hdf5_out.close()
+    logger.info("updated {} metadata of {} - fields added / replaced:  {}  dropped:  {}".format(
+        dim, gctx_file_path, [] if metadata_df is None else list(metadata_df.columns), drop_fields))
+
+
+def check_metadata_ids(meta_group, dim, metadata_df, gctx_file_path):
+    """Checks that metadata_df has exactly the ids of the file, and returns it in the file's order."""
+    file_ids = pandas.Index(parse_gctx.read_string_array(meta_group["id"]))
+    ids = metadata_df.index.astype(str)
+    missing_ids = file_ids[~file_ids.isin(ids)]
+    extra_ids = ids[~ids.isin(file_ids)]
+    if ids.has_duplicates or len(missing_ids) > 0 or len(extra_ids) > 0:
+        msg = ("the ids of metadata_df must be exactly the {} ids of {} - duplicated_ids:  {}  "
+               "missing_ids:  {}  extra_ids:  {}").format(dim, gctx_file_path, list(ids[ids.duplicated()][:10]),
+                                                          list(missing_ids[:10]), list(extra_ids[:10]))
+        logger.error(msg)
+        raise Exception("write_gctx.update_metadata " + msg)
+    metadata_df = metadata_df.copy(deep=False)
+    metadata_df.index = ids
+    return metadata_df.loc[file_ids, :]
+
+
+def replace_metadata_fields(hdf5_out, dim, metadata_df, convert_back_to_neg_666, gzip_compression):
+    """
+	Writes each field of metadata_df (already in the file's id order) to hdf5_out, replacing any
+	existing field of the same name. The fields are encoded in an in-memory file first, then copied.
+	"""
+    meta_group_node = col_meta_group_node if dim == "col" else row_meta_group_node
+    categories_group_node = col_categories_group_node if dim == "col" else row_categories_group_node
+    (typed, utf8) = get_metadata_encoding(hdf5_out[meta_group_node])
+
+    encoded = h5py.File("update_metadata_{}.gctx".format(id(metadata_df)), "w", driver="core", backing_store=False)
+    try:
+        write_metadata(encoded, dim, metadata_df, convert_back_to_neg_666, gzip_compression=gzip_compression,
+                       typed=typed, utf8=utf8)
+        for field in metadata_df.columns:
+            if field in hdf5_out[meta_group_node]:
+                delete_metadata_field(hdf5_out, dim, field)
+            hdf5_out.copy(encoded[meta_group_node + "/" + field], hdf5_out[meta_group_node], name=field)
+            if categories_group_node + "/" + field in encoded:
+                hdf5_out.require_group(categories_group_node)
+                hdf5_out.copy(encoded[categories_group_node + "/" + field], hdf5_out[categories_group_node],
+                              name=field)
+    finally:
+        encoded.close()
+
+
+def delete_metadata_field(hdf5_out, dim, field):
+    """Removes a metadata field, and its category table if it is dictionary-encoded."""
+    meta_group_node = col_meta_group_node if dim == "col" else row_meta_group_node
+    categories_group_node = col_categories_group_node if dim == "col" else row_categories_group_node
+    del hdf5_out[meta_group_node + "/" + field]
+    if categories_group_node + "/" + field in hdf5_out:
+        del hdf5_out[categories_group_node + "/" + field]
+
+
+def get_metadata_encoding(meta_group):
+    """
+	Returns (typed, utf8): whether the metadata fields of meta_group were written typed, and
+	whether its strings are variable-length UTF-8 (see write_metadata).
+	"""
+    typed = any([metadata_dtype_attr in meta_group[k].attrs for k in meta_group.keys() if k != "id"])
+    utf8 = parse_gctx.is_vlen_string_dset(meta_group["id"])
+    return (typed, utf8)
+
+
 def add_gctx_to_out_name(out_file_name):
     """
 	If there isn't a '.gctx' suffix to specified out_file_name, it adds one.
@@ -112,19 +864,77 @@ def calculate_elem_per_kb(max_chunk_kb, matrix_dtype):
     Input: 
         - max_chunk_kb (int, default=1024): The maximum number of KB a given chunk will occupy
         - matrix_dtype (numpy dtype, default=numpy.float32): Storage data type for data matrix. 
-            Currently needs to be np.float32 or np.float64 (TODO: figure out a better way to get bits from a numpy dtype).
+            Any numeric (float or integer) dtype, e.g. numpy.int16 for quantized matrices.
 
     Returns: 
         elem_per_kb (int), the number of elements per kb for matrix dtype specified. 
     """
-    if matrix_dtype == numpy.float32:
-        return (max_chunk_kb * 8)/32
-    elif matrix_dtype == numpy.float64:
-        return (max_chunk_kb * 8)/64
-    else:
-        msg = "Invalid matrix_dtype: {}; only numpy.float32 and numpy.float64 are currently supported".format(matrix_dtype)
+    try:
+        dtype = numpy.dtype(matrix_dtype)
+    except TypeError:
+        dtype = None
+    if dtype is None or dtype.kind not in ("f", "i", "u"):
+        msg = "Invalid matrix_dtype: {}; only numeric (float or integer) dtypes are supported".format(matrix_dtype)
         logger.error(msg)
         raise Exception("write_gctx.calculate_elem_per_kb " + msg)
+    return (max_chunk_kb * 8)/(dtype.itemsize * 8)
+
+
+def quantize_matrix(matrix, scale_factor=None, add_offset=None):
+    """
+    Lossily encodes a matrix as int16 codes: value ~= code * scale_factor + add_offset. Missing
+    values are stored as quantized_missing_code. By default the codes span the range of the
+    values, so each value is off by at most scale_factor / 2 = (max - min) / 131068. Infinite
+    values, and values outside the range of a given scale_factor / add_offset (add_offset +/-
+    32767 * scale_factor), cannot be encoded within that bound and raise an Exception.
+
+    Input:
+        - matrix (numpy array): values to encode
+        - scale_factor (float): step between codes. Default = None (from the range of matrix).
+        - add_offset (float): value of code 0. Default = None (middle of the range of matrix).
+    Output:
+        - codes (numpy array): C-contiguous int16 array of matrix's shape
+        - scale_factor (float)
+        - add_offset (float)
+    """
+    max_code = numpy.iinfo(quantized_dtype).max
+    matrix = numpy.asarray(matrix, dtype=numpy.float64)
+    num_infinite = int(numpy.isinf(matrix).sum())
+    if num_infinite > 0:
+        msg = "cannot quantize infinite values; replace them (e.g. with numpy.nan) first - number of infinite values:  {}".format(
+            num_infinite)
+        logger.error(msg)
+        raise Exception("write_gctx.quantize_matrix " + msg)
+
+    if scale_factor is None:
+        finite = matrix[numpy.isfinite(matrix)]
+        (low, high) = (float(finite.min()), float(finite.max())) if finite.size > 0 else (0.0, 0.0)
+        add_offset = (high + low) / 2
+        scale_factor = (high - low) / (2 * max_code) if high > low else 1.0
+
+    scaled = (matrix - add_offset) / scale_factor
+    missing = numpy.isnan(scaled)
+    numpy.rint(scaled, out=scaled)
+    with numpy.errstate(invalid="ignore"):
+        out_of_range = numpy.abs(scaled) > max_code
+    if out_of_range.any():
+        msg = ("cannot quantize values outside the range of the quantized matrix - number of values:  {}  "
+               "their range:  [{}, {}]  quantized range:  [{}, {}]").format(
+            int(out_of_range.sum()), matrix[out_of_range].min(), matrix[out_of_range].max(),
+            add_offset - max_code * scale_factor, add_offset + max_code * scale_factor)
+        logger.error(msg)
+        raise Exception("write_gctx.quantize_matrix " + msg)
+    scaled[missing] = quantized_missing_code
+    codes = numpy.empty(matrix.shape, dtype=quantized_dtype)
+    codes[...] = scaled
+    return (codes, scale_factor, add_offset)
+
+
+def write_quantization_attrs(data_dset, scale_factor, add_offset):
+    """Records how a quantized data matrix is decoded, with the attribute names of the CF conventions."""
+    data_dset.attrs[scale_factor_attr] = numpy.float64(scale_factor)
+    data_dset.attrs[add_offset_attr] = numpy.float64(add_offset)
+    data_dset.attrs[missing_value_attr] = quantized_dtype(quantized_missing_code)
 
 
 def set_data_matrix_chunk_size(df_shape, max_chunk_kb, elem_per_kb):
@@ -144,9 +954,49 @@ def set_data_matrix_chunk_size(df_shape, max_chunk_kb, elem_per_kb):
     col_chunk_size = min(((max_chunk_kb*elem_per_kb)//row_chunk_size), df_shape[1])
     return (row_chunk_size, col_chunk_size)
 
-def write_metadata(hdf5_out, dim, metadata_df, convert_back_to_neg_666, gzip_compression):
+def set_data_matrix_chunk_layout(df_shape, max_chunk_kb, elem_per_kb, layout):
+    """
+    Sets the chunk shape of the data matrix for the expected access pattern. Each chunk
+    holds up to max_chunk_kb of data.
+
+    Input:
+        - df_shape (tuple): shape of input data_df.
+        - max_chunk_kb (int): The maximum number of KB a given chunk will occupy
+        - elem_per_kb (int): Number of elements per kb
+        - layout (str): one of matrix_layouts:
+            - "balanced": set_data_matrix_chunk_size, i.e. the chunks cmapM and cmapR write
+            - "column": chunks span all rows, so reading a set of columns (e.g. signatures)
+                touches as few chunks as possible
+            - "row": chunks span all columns, for reading sets of rows (e.g. genes)
+            - "contiguous": not chunked
+
+    Returns:
+        chunk size (tuple, oriented like data_df) or None if the matrix should not be chunked
+    """
+    if layout not in matrix_layouts:
+        msg = "Invalid layout: {}; must be one of {}".format(layout, matrix_layouts)
+        logger.error(msg)
+        raise Exception("write_gctx.set_data_matrix_chunk_layout " + msg)
+
+    if layout == "contiguous" or df_shape[0] == 0 or df_shape[1] == 0:
+        return None
+
+    max_chunk_elem = max(1, int(max_chunk_kb * elem_per_kb))
+    if layout == "column":
+        row_chunk_size = min(df_shape[0], max_chunk_elem)
+        return (row_chunk_size, max(1, min(max_chunk_elem // row_chunk_size, df_shape[1])))
+    elif layout == "row":
+        col_chunk_size = min(df_shape[1], max_chunk_elem)
+        return (max(1, min(max_chunk_elem // col_chunk_size, df_shape[0])), col_chunk_size)
+    (row_chunk_size, col_chunk_size) = set_data_matrix_chunk_size(df_shape, max_chunk_kb, elem_per_kb)
+    return (int(row_chunk_size), max(1, int(col_chunk_size)))
+
+
+def write_metadata(hdf5_out, dim, metadata_df, convert_back_to_neg_666, gzip_compression, typed=False,
+                   utf8=False, min_string_width=None):
     """
 	Writes either column or row metadata to proper node of gctx out (hdf5) file.
+	Each field is encoded in one vectorized pass (see encode_strings); metadata_df is not modified.
 
 	Input:
 		- hdf5_out (h5py): open hdf5 file to write to
@@ -154,6 +1004,9 @@ def write_metadata(hdf5_out, dim, metadata_df, convert_back_to_neg_666, gzip_com
 		- metadata_df (pandas DataFrame): metadata DataFrame to write to file 
 		- convert_back_to_neg_666 (bool): Whether to convert numpy.nans back to "-666",
 				as per CMap metadata null convention 
+		- typed (bool, default=False): write fields with write_typed_metadata_field instead
+		- utf8 (bool, default=False): write strings as variable-length UTF-8 instead of fixed-length ASCII
+		- min_string_width (int, default=None): minimum width of fixed-length strings (see write)
 	"""
     if dim == "col":
         hdf5_out.create_group(col_meta_group_node)
@@ -163,58 +1016,211 @@ def write_metadata(hdf5_out, dim, metadata_df, convert_back_to_neg_666, gzip_com
         metadata_node_name = row_meta_group_node
     else:
         logger.error("'dim' argument must be either 'row' or 'col'!")
+    string_dtype = vlen_string_dtype if utf8 else None
 
     # write id field to expected node
-    hdf5_out.create_dataset(metadata_node_name + "/id", data=[numpy.string_(str(x)) for x in metadata_df.index],
-        compression=gzip_compression)
+    hdf5_out.create_dataset(metadata_node_name + "/id",
+        data=encode_strings(metadata_df.index, utf8, "id", min_string_width),
+        dtype=string_dtype, compression=gzip_compression, maxshape=(None,))
 
     metadata_fields = list(metadata_df.columns.copy())
 
-    # if specified, convert numpy.nans in metadata back to -666
-    if convert_back_to_neg_666:
-        for c in metadata_fields:
-            metadata_df[[c]] = metadata_df[[c]].replace([numpy.nan], ["-666"])
+    if typed:
+        for field in [entry for entry in metadata_fields if entry != "ind"]:
+            write_typed_metadata_field(hdf5_out, dim, field, metadata_df[field], convert_back_to_neg_666,
+                                       gzip_compression, utf8, min_string_width)
+        return
 
     # write metadata columns to their own arrays
     for field in [entry for entry in metadata_fields if entry != "ind"]:
-        if numpy.array(metadata_df.loc[:, field]).dtype.type in (numpy.str_, numpy.object_):
-            try:
-                array_write = numpy.array(metadata_df.loc[:, field]).astype('S')
-            except UnicodeEncodeError:
-                for i in range(metadata_df.shape[0]):
-                    try:
-                        numpy.array(metadata_df[field].iloc[i]).astype('S')
-                    except UnicodeEncodeError:
-                        with pandas.option_context('display.max_rows', None, 'display.max_columns', None):
-                            msg = """could not convert this metadata entry to string - field:  {}  i:  {}  metadata_df.iloc[i]:  {}""".format(field, i, metadata_df.iloc[i])
-                            logger.exception(msg)
-                            raise Exception(msg)
+        array_write = numpy.asarray(metadata_df[field])
+        # if specified, convert numpy.nans in metadata back to -666
+        if convert_back_to_neg_666:
+            missing = pandas.isnull(array_write)
+            if missing.any():
+                array_write = array_write.astype(object)
+                array_write[missing] = "-666"
 
+        if array_write.dtype.type in (numpy.str_, numpy.object_):
+            array_write = encode_strings(array_write, utf8, field, min_string_width)
+            dtype = string_dtype
         else:
-            array_write = numpy.array(metadata_df.loc[:, field])
+            dtype = None
         hdf5_out.create_dataset(metadata_node_name + "/" + field,
-                                data=array_write,
+                                data=array_write, dtype=dtype,
+                                compression=gzip_compression, maxshape=(None,))
+
+
+def encode_strings(values, utf8=False, field=None, min_width=None):
+    """
+	Converts values to strings for writing, in one vectorized pass.
+
+	Input:
+		- values (array-like): values to convert; non-strings are converted with str
+		- utf8 (bool, default=False): return an object array of str, to be written as
+			variable-length UTF-8 (vlen_string_dtype), instead of fixed-length ASCII bytes
+		- field (str): name of the field, for error messages
+		- min_width (int, default=None): minimum width of the fixed-length strings
+	Output:
+		- encoded (numpy array): of dtype "S<n>", or object if utf8
+	"""
+    values = numpy.asarray(values, dtype=object)
+    if utf8:
+        return values.astype(str).astype(object)
+    try:
+        encoded = values.astype("S")
+        if min_width is not None and encoded.dtype.itemsize < min_width:
+            encoded = encoded.astype("S{}".format(min_width))
+        return encoded
+    except UnicodeEncodeError:
+        strings = pandas.Series(values.astype(str))
+        i = int(numpy.flatnonzero(strings.str.contains("[^\x00-\x7f]").values)[0])
+        msg = "could not convert this metadata entry to an ASCII string (write with utf8_metadata=True to store it) - field:  {}  i:  {}  value:  {}".format(
+            field, i, strings.iloc[i])
+        logger.error(msg)
+        raise Exception("write_gctx.encode_strings " + msg)
+
+
+def write_typed_metadata_field(hdf5_out, dim, field, values, convert_back_to_neg_666, gzip_compression,
+                               utf8=False, min_string_width=None):
+    """
+	Writes one metadata field together with its dtype, recorded in the dataset's "dtype" attribute:
+		- numeric and boolean fields are stored as such ("int64", "float64", ...); missing values
+			stay numpy.nan
+		- string fields with few distinct values (at most max_category_fraction of the entries),
+			and categorical fields, are dictionary-encoded ("category"): the dataset holds integer
+			codes (-1 for missing) and the distinct values are stored under /0/META_CATEGORIES
+		- other string fields are stored as fixed-length byte strings ("str"), with numpy.nan
+			converted to "-666" if convert_back_to_neg_666
+
+	Input:
+		- hdf5_out (h5py): open hdf5 file to write to
+		- dim (str; must be "row" or "col"): dimension of metadata to write to
+		- field (str): name of the field
+		- values (pandas Series): the field's values
+		- convert_back_to_neg_666 (bool): see write_metadata
+		- gzip_compression (int): compression level to use
+		- utf8 (bool, default=False): see write_metadata
+		- min_string_width (int, default=None): see write_metadata
+	"""
+    string_dtype = vlen_string_dtype if utf8 else None
+    if dim == "col":
+        field_node_name = col_meta_group_node + "/" + field
+        categories_node_name = col_categories_group_node + "/" + field
+    else:
+        field_node_name = row_meta_group_node + "/" + field
+        categories_node_name = row_categories_group_node + "/" + field
+
+    is_string = values.dtype == object or pandas.api.types.is_string_dtype(values.dtype)
+    is_categorical = pandas.api.types.is_categorical_dtype(values.dtype)
+    if is_string and not is_categorical:
+        is_categorical = values.nunique() <= max_category_fraction * len(values)
+
+    if is_categorical:
+        categorical = pandas.Categorical(values)
+        categories = encode_strings(categorical.categories, utf8, field)
+        codes = categorical.codes.astype(numpy.min_scalar_type(-max(len(categories), 1)))
+        dset = hdf5_out.create_dataset(field_node_name, data=codes, compression=gzip_compression,
+                                       maxshape=(None,))
+        dset.attrs[metadata_dtype_attr] = "category"
+        hdf5_out.create_dataset(categories_node_name, data=categories, dtype=string_dtype,
                                 compression=gzip_compression)
+    elif is_string:
+        if convert_back_to_neg_666:
+            values = values.fillna("-666")
+        dset = hdf5_out.create_dataset(field_node_name, data=encode_strings(values, utf8, field, min_string_width),
+                                       dtype=string_dtype, compression=gzip_compression, maxshape=(None,))
+        dset.attrs[metadata_dtype_attr] = "str"
+    else:
+        dset = hdf5_out.create_dataset(field_node_name, data=values.values, compression=gzip_compression,
+                                       maxshape=(None,))
+        dset.attrs[metadata_dtype_attr] = values.dtype.name
 
 
-def check_fix_metadata(metadata_df):
-    work_on = [
-        ("column", metadata_df.columns), ("index", metadata_df.index)
-    ]
+def write_id_index(hdf5_out, dim, gzip_compression):
+    """
+	Writes a sorted copy of the (already written) row or column ids together with
+	each id's position, so that ids can be looked up with a binary search.
 
+	Input:
+		- hdf5_out (h5py): open hdf5 file to write to
+		- dim (str; must be "row" or "col"): dimension of ids to index
+		- gzip_compression (int): compression level to use for the index datasets
+	"""
+    if dim == "col":
+        ids = hdf5_out[col_meta_group_node + "/id"][()]
+        index_node_name = col_id_index_group_node
+    elif dim == "row":
+        ids = hdf5_out[row_meta_group_node + "/id"][()]
+        index_node_name = row_id_index_group_node
+    else:
+        logger.error("'dim' argument must be either 'row' or 'col'!")
+
+    if ids.dtype == object:
+        # variable-length ids are indexed by their UTF-8 bytes
+        ids = ids.astype("S")
+    sorted_idx = numpy.argsort(ids, kind="mergesort")
+
+    if index_node_name in hdf5_out:
+        del hdf5_out[index_node_name]
+    hdf5_out.create_group(index_node_name)
+    hdf5_out.create_dataset(index_node_name + "/" + sorted_id_node, data=ids[sorted_idx],
+                            compression=gzip_compression)
+    hdf5_out.create_dataset(index_node_name + "/" + sorted_idx_node, data=sorted_idx.astype(numpy.int64),
+                            compression=gzip_compression)
+
+
+def merge_id_index(hdf5_out, dim, new_ids, start, gzip_compression):
+    """
+	Adds appended ids to the (existing) sorted id index of dim without re-sorting it: the new
+	ids are sorted on their own and inserted at their positions in the sorted ids. The index
+	datasets are still read and rewritten in full, as every entry after an insertion point moves.
+
+	Input:
+		- hdf5_out (h5py): open hdf5 file to write to
+		- dim (str; must be "row" or "col"): dimension of ids
+		- new_ids (numpy array): the appended ids, as stored in the id dataset, in file order
+		- start (int): position of the first appended id in the id dataset
+		- gzip_compression (int): compression level to use for the index datasets
+	"""
+    index_node_name = col_id_index_group_node if dim == "col" else row_id_index_group_node
+    sorted_id_dset = hdf5_out[index_node_name + "/" + sorted_id_node]
+    sorted_idx_dset = hdf5_out[index_node_name + "/" + sorted_idx_node]
+
+    # variable-length ids are indexed by their UTF-8 bytes, see write_id_index
+    new_ids = new_ids.astype("S")
+    new_order = numpy.argsort(new_ids, kind="mergesort")
+    sorted_ids = sorted_id_dset[()]
+    insert_at = numpy.searchsorted(sorted_ids, new_ids[new_order], side="right")
+    dtype = numpy.promote_types(sorted_ids.dtype, new_ids.dtype)
+    merged_ids = numpy.insert(sorted_ids.astype(dtype), insert_at, new_ids[new_order])
+    merged_idx = numpy.insert(sorted_idx_dset[()], insert_at, start + new_order)
+
+    del hdf5_out[index_node_name + "/" + sorted_id_node]
+    del hdf5_out[index_node_name + "/" + sorted_idx_node]
+    hdf5_out.create_dataset(index_node_name + "/" + sorted_id_node, data=merged_ids, compression=gzip_compression)
+    hdf5_out.create_dataset(index_node_name + "/" + sorted_idx_node, data=merged_idx.astype(numpy.int64),
+                            compression=gzip_compression)
+
+
+def check_fix_metadata(metadata_df):
+    """
+	Replaces forward slashes, which are not allowed in hdf5 gctx ids / field names, with "|"
+	in the index and columns of metadata_df. Returns a shallow copy; the values are not copied.
+	"""
     results = []
-    for name, generic_index in work_on:
-        new_list = generic_index.to_list()
-        results.append(new_list)
-
-        for i, gnrc_indx in enumerate(new_list):
-            if "/" in gnrc_indx:
-                new_gnrc_indx = gnrc_indx.replace("/", "|")
-                logger.warning("forward slash / character in {} of metadata_df is not allowed in hdf5 gctx - will be replaced with | - gnrc_indx:  {}  new_gnrc_indx:  {}".format(
-                    name, gnrc_indx, new_gnrc_indx))
-                new_list[i] = new_gnrc_indx
-
-    new_metadata_df = metadata_df.copy()
+    for name, generic_index in [("column", metadata_df.columns), ("index", metadata_df.index)]:
+        has_slash = numpy.zeros(len(generic_index), dtype=bool)
+        if generic_index.dtype == object:
+            has_slash = numpy.asarray(generic_index.str.contains("/", regex=False, na=False), dtype=bool)
+        if has_slash.any():
+            new_index = generic_index.where(~has_slash, generic_index.str.replace("/", "|", regex=False))
+            logger.warning("forward slash / character in {} of metadata_df is not allowed in hdf5 gctx - will be replaced with | - {} entries, e.g. gnrc_indx:  {}  new_gnrc_indx:  {}".format(
+                name, has_slash.sum(), generic_index[has_slash][0], new_index[has_slash][0]))
+            generic_index = new_index
+        results.append(generic_index)
+
+    new_metadata_df = metadata_df.copy(deep=False)
     new_metadata_df.columns = results[0]
     new_metadata_df.index = results[1]
 
@@ -0,0 +1,60 @@
+# Times write_gctx.append of a plate of new columns to a GCTX with many columns, and what it
+# costs besides writing the new data: merging the new cids into the column id index (which is
+# read and rewritten in full) and, when the new cids are longer than the stored ones, rewriting
+# the fixed-length id dataset (avoided by writing the file with min_string_width). Rewriting
+# the whole file (parse, concatenate, write) is timed for comparison.
+# A synthetic 50 x 1000000 GCTX (with two column metadata fields) is written to the working
+# directory with write_gctx for each case and removed afterwards.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+import cmapPy.pandasGEXpress.concat as concat
+
+n_rows = 50
+n_cols = 1000000
+n_new_cols = 384
+
+
+def make_gctoo(cids, seed):
+    np.random.seed(seed)
+    data_df = pd.DataFrame(np.random.randn(n_rows, len(cids)).astype(np.float32),
+                           index=["rid_{}".format(i) for i in range(n_rows)], columns=cids)
+    col_metadata_df = pd.DataFrame({"pert_id": ["BRD-K{:08d}".format(i % 20000) for i in range(len(cids))],
+                                    "pert_idose": np.random.choice(["1 uM", "10 uM"], len(cids))},
+                                   index=cids)
+    return GCToo.GCToo(data_df=data_df, col_metadata_df=col_metadata_df)
+
+
+if __name__ == "__main__":
+    existing = make_gctoo(["cid_{:07d}".format(i) for i in range(n_cols)], 0)
+    plate = make_gctoo(["cid_{:07d}".format(n_cols + i) for i in range(n_new_cols)], 1)
+    long_cid_plate = make_gctoo(["plate_2026_10_17:cid_{:07d}".format(i) for i in range(n_new_cols)], 1)
+    test_file = "append_timing_test_n{}x{}.gctx".format(n_cols, n_rows)
+
+    cases = [("append", plate, {}), ("append_no_id_index", plate, {"id_index": False}),
+             ("append_longer_cids", long_cid_plate, {}),
+             ("append_longer_cids_min_string_width", long_cid_plate, {"min_string_width": 48})]
+    results = {}
+    for (case_name, new_gctoo, write_options) in cases:
+        write_gctx.write(existing, test_file, **write_options)
+        start = time.time()
+        write_gctx.append(new_gctoo, test_file)
+        results[case_name] = {"seconds": time.time() - start}
+        os.remove(test_file)
+
+    write_gctx.write(existing, test_file)
+    start = time.time()
+    combined = concat.hstack([parse_gctx.parse(test_file), plate])
+    write_gctx.write(combined, test_file)
+    results["rewrite_whole_file"] = {"seconds": time.time() - start}
+    os.remove(test_file)
+
+    # write results to file
+    results_df = pd.DataFrame(results).T
+    print(results_df)
+    results_df.to_csv("python_append_timing_results.txt", sep="\t")
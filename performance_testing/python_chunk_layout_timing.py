@@ -0,0 +1,70 @@
+# Compares the write_gctx chunk layout presets (balanced / column / row / contiguous), each
+# uncompressed and with gzip + shuffle: write time, file size, and the time to read random
+# columns (all rows), landmark-like rows (all columns) and the full matrix with
+# parse_gctx.read_data_array. A synthetic 12328 x 4000 matrix is written to the working
+# directory and removed afterwards. Cache was not cleared between operations.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import h5py
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+
+n_rows = 12328
+n_cols = 4000
+n_landmarks = 978
+n_random_cols = 100
+test_file = "chunk_layout_test_n{}x{}.gctx".format(n_cols, n_rows)
+
+np.random.seed(0)
+# limited precision, like real expression values, so that compression has something to do
+data_df = pd.DataFrame(np.round(np.random.randn(n_rows, n_cols), 2).astype(np.float32),
+                       index=["rid_{}".format(i) for i in range(n_rows)],
+                       columns=["cid_{}".format(i) for i in range(n_cols)])
+gctoo = GCToo.GCToo(data_df=data_df)
+
+all_ridx = list(range(n_rows))
+all_cidx = list(range(n_cols))
+landmark_ridx = sorted(np.random.choice(n_rows, n_landmarks, replace=False))
+random_cidx = sorted(np.random.choice(n_cols, n_random_cols, replace=False))
+access_patterns = [
+    ("random_cols", all_ridx, random_cidx),
+    ("landmark_rows", landmark_ridx, all_cidx),
+    ("full", all_ridx, all_cidx)
+]
+compressions = {
+    "none": {},
+    "gzip_shuffle": {"matrix_compression": "gzip", "matrix_compression_opts": 4, "shuffle": True}
+}
+
+results = {}
+for layout in write_gctx.matrix_layouts:
+    for (compression_name, compression_args) in compressions.items():
+        if layout == "contiguous" and len(compression_args) > 0:
+            continue
+        result = {}
+        start = time.time()
+        write_gctx.write(gctoo, test_file, layout=layout, id_index=False, **compression_args)
+        result["write_s"] = time.time() - start
+        result["size_mb"] = os.path.getsize(test_file) / 1e6
+
+        f = h5py.File(test_file, "r")
+        data_dset = f[parse_gctx.data_node]
+        for (name, ridx, cidx) in access_patterns:
+            start = time.time()
+            parse_gctx.read_data_array(data_dset, ridx, cidx)
+            result[name + "_s"] = time.time() - start
+        f.close()
+        os.remove(test_file)
+
+        results[(layout, compression_name)] = result
+
+# write results to file
+results_df = pd.DataFrame(results).T
+results_df.index.names = ["layout", "compression"]
+with pd.option_context("display.width", 200, "display.max_columns", None):
+    print(results_df)
+results_df.to_csv("python_chunk_layout_results.txt", sep="\t")
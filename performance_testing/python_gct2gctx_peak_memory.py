@@ -0,0 +1,69 @@
+# Compares peak memory and time of converting a GCT to GCTX by parsing it in full and writing it
+# with write_gctx.write (the previous gct2gctx) against gct2gctx, which streams blocks of rows
+# from parse_gct.iterate into a GCTXWriter. Each conversion runs in its own process; peak memory
+# is the growth of its maximum resident set size, relative to the size of the data matrix.
+# A synthetic 4000 x 20000 GCT (with row and column metadata) is written to the working directory
+# with write_gct and removed afterwards, along with the converted files.
+
+import os
+import time
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gct as parse_gct
+import cmapPy.pandasGEXpress.write_gct as write_gct
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+import cmapPy.pandasGEXpress.gct2gctx as gct2gctx
+
+n_rows = 4000
+n_cols = 20000
+
+
+def measure(converter_name, test_file, queue):
+    out_name = "{}_{}.gctx".format(os.path.splitext(test_file)[0], converter_name)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if converter_name == "full_parse":
+        write_gctx.write(parse_gct.parse(test_file, convert_neg_666=False), out_name)
+    else:
+        gct2gctx.gct2gctx_main(argparse.Namespace(filename=test_file, output_filepath=out_name, block_size=None,
+                                                  row_annot_path=None, col_annot_path=None))
+    elapsed = time.time() - start
+    peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1e3
+    os.remove(out_name)
+    queue.put({"seconds": elapsed, "peak_mb": peak_mb})
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    data_df = pd.DataFrame(np.random.randn(n_rows, n_cols).astype(np.float32),
+                           index=["rid_{}".format(i) for i in range(n_rows)],
+                           columns=["cid_{}".format(i) for i in range(n_cols)])
+    row_metadata_df = pd.DataFrame({"pr_gene_symbol": ["gene_{}".format(i) for i in range(n_rows)]},
+                                   index=data_df.index)
+    col_metadata_df = pd.DataFrame({"pert_id": ["BRD-K{:08d}".format(i) for i in range(n_cols)],
+                                    "pert_idose": np.random.choice(["1 uM", "10 uM"], n_cols)},
+                                   index=data_df.columns)
+    test_file = "gct2gctx_peak_memory_test_n{}x{}.gct".format(n_cols, n_rows)
+    write_gct.write(GCToo.GCToo(data_df=data_df, row_metadata_df=row_metadata_df,
+                                col_metadata_df=col_metadata_df), test_file)
+    data_df_mb = data_df.values.nbytes / 1e6
+    del data_df
+
+    results = {}
+    for converter_name in ["full_parse", "streaming"]:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure, args=(converter_name, test_file, queue))
+        process.start()
+        results[converter_name] = queue.get()
+        process.join()
+    os.remove(test_file)
+
+    # write results to file
+    results_df = pd.DataFrame(results).T
+    results_df["peak_over_data_df"] = results_df["peak_mb"] / data_df_mb
+    print(results_df)
+    results_df.to_csv("python_gct2gctx_peak_memory_results.txt", sep="\t")
@@ -0,0 +1,65 @@
+# Compares the time of reading a few rows (by rid) of a .gct.gz file without a sidecar index, with
+# an index of the rows only, and with an index that also holds decompressor checkpoints (which
+# requires indexed_gzip), along with the time to build each index and its size.
+# A synthetic 12328 x 2000 GCT is written to the working directory with write_gct, gzipped, and
+# removed afterwards. Each lookup reads 10 random rids; the time is the mean of n_lookups lookups.
+
+import os
+import gzip
+import time
+import shutil
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gct as parse_gct
+import cmapPy.pandasGEXpress.write_gct as write_gct
+
+n_rows = 12328
+n_cols = 2000
+n_rids_per_lookup = 10
+n_lookups = 5
+
+
+def time_lookups(test_file, lookups):
+    start = time.time()
+    for rids in lookups:
+        parse_gct.parse(test_file, rid=rids)
+    return (time.time() - start) / len(lookups)
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    data_df = pd.DataFrame(np.random.randn(n_rows, n_cols).astype(np.float32),
+                           index=["rid_{}".format(i) for i in range(n_rows)],
+                           columns=["cid_{}".format(i) for i in range(n_cols)])
+    row_metadata_df = pd.DataFrame({"pr_gene_symbol": ["gene_{}".format(i) for i in range(n_rows)]},
+                                   index=data_df.index)
+    gct_file = "gct_gz_index_timing_test_n{}x{}.gct".format(n_cols, n_rows)
+    test_file = gct_file + ".gz"
+    write_gct.write(GCToo.GCToo(data_df=data_df, row_metadata_df=row_metadata_df), gct_file)
+    with open(gct_file, "rb") as f_in, gzip.open(test_file, "wb", compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(gct_file)
+
+    lookups = [list(np.random.choice(data_df.index, n_rids_per_lookup, replace=False)) for _ in range(n_lookups)]
+    del data_df
+
+    results = {"no_index": {"lookup_seconds": time_lookups(test_file, lookups)}}
+
+    indexed_gzip = parse_gct.indexed_gzip
+    index_types = [("row_index", None)] + ([("row_and_checkpoint_index", indexed_gzip)] if indexed_gzip else [])
+    for (index_type, module) in index_types:
+        parse_gct.indexed_gzip = module
+        start = time.time()
+        index_path = parse_gct.build_gz_index(test_file)
+        build_seconds = time.time() - start
+        results[index_type] = {"lookup_seconds": time_lookups(test_file, lookups), "build_seconds": build_seconds,
+                               "index_mb": os.path.getsize(index_path) / 1e6}
+        os.remove(index_path)
+    parse_gct.indexed_gzip = indexed_gzip
+    os.remove(test_file)
+
+    # write results to file
+    results_df = pd.DataFrame(results).T
+    print(results_df)
+    results_df.to_csv("python_gct_gz_index_timing_results.txt", sep="\t")
@@ -0,0 +1,76 @@
+# Compares peak memory and time of parsing a GCT with the previous parse_into_3_df (whole file
+# read with dtype=str, then converted to float32) against the two-region parser, which streams
+# the data rows into a preallocated float32 array. Each parse runs in its own process; peak
+# memory is the growth of its maximum resident set size (which, unlike tracemalloc, includes
+# the C parser's buffers), relative to the size of data_df.
+# Synthetic 1000 x 20000 and 4000 x 20000 GCTs (with row and column metadata) are written to the
+# working directory with write_gct and removed afterwards; the previous parser is only run on the
+# smaller one, as it needs more memory than the test machine has for the larger one.
+
+import os
+import time
+import resource
+import multiprocessing
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gct as parse_gct
+import cmapPy.pandasGEXpress.write_gct as write_gct
+
+n_cols = 20000
+n_rows_list = [1000, 4000]
+
+
+def previous_parse_into_3_df(file_path, num_data_rows, num_data_cols, num_row_metadata, num_col_metadata,
+                             nan_values):
+    full_df = pd.read_csv(file_path, sep="\t", header=None, skiprows=2,
+                          dtype=str, na_values=nan_values, keep_default_na=False)
+    row_metadata = parse_gct.assemble_row_metadata(full_df, num_col_metadata, num_data_rows, num_row_metadata)
+    col_metadata = parse_gct.assemble_col_metadata(full_df, num_col_metadata, num_row_metadata, num_data_cols)
+    data = parse_gct.assemble_data(full_df, num_col_metadata, num_data_rows, num_row_metadata, num_data_cols)
+    return row_metadata, col_metadata, data
+
+
+def measure(parser_name, test_file, queue):
+    (_, num_data_rows, num_data_cols, num_row_metadata, num_col_metadata) = parse_gct.read_version_and_dims(test_file)
+    parser = previous_parse_into_3_df if parser_name == "previous" else parse_gct.parse_into_3_df
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    (_, _, data) = parser(test_file, num_data_rows, num_data_cols, num_row_metadata, num_col_metadata, ["-666"])
+    elapsed = time.time() - start
+    peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1e3
+    queue.put({"seconds": elapsed, "peak_mb": peak_mb, "data_df_mb": data.values.nbytes / 1e6})
+
+
+if __name__ == "__main__":
+    results = {}
+    for n_rows in n_rows_list:
+        np.random.seed(0)
+        data_df = pd.DataFrame(np.random.randn(n_rows, n_cols).astype(np.float32),
+                               index=["rid_{}".format(i) for i in range(n_rows)],
+                               columns=["cid_{}".format(i) for i in range(n_cols)])
+        row_metadata_df = pd.DataFrame({"pr_gene_symbol": ["gene_{}".format(i) for i in range(n_rows)]},
+                                       index=data_df.index)
+        col_metadata_df = pd.DataFrame({"pert_id": ["BRD-K{:08d}".format(i) for i in range(n_cols)],
+                                        "pert_idose": np.random.choice(["1 uM", "10 uM"], n_cols)},
+                                       index=data_df.columns)
+        test_file = "gct_parse_peak_memory_test_n{}x{}.gct".format(n_cols, n_rows)
+        write_gct.write(GCToo.GCToo(data_df=data_df, row_metadata_df=row_metadata_df,
+                                    col_metadata_df=col_metadata_df), test_file)
+        del data_df
+
+        for parser_name in ["previous", "two_region"]:
+            if parser_name == "previous" and n_rows != n_rows_list[0]:
+                continue
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=measure, args=(parser_name, test_file, queue))
+            process.start()
+            results[(parser_name, "{}x{}".format(n_rows, n_cols))] = queue.get()
+            process.join()
+        os.remove(test_file)
+
+    # write results to file
+    results_df = pd.DataFrame(results).T
+    results_df["peak_over_data_df"] = results_df["peak_mb"] / results_df["data_df_mb"]
+    print(results_df)
+    results_df.to_csv("python_gct_parse_peak_memory_results.txt", sep="\t")
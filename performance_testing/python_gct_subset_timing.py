@@ -0,0 +1,63 @@
+# Compares the time of reading a subset of a GCT by parsing all of it and then calling subset_gctoo
+# (the previous parse_gct.parse) against parse_gct.parse, which only reads the requested rows and
+# columns. A synthetic 12328 x 2000 GCT (with row and column metadata) is written to the working
+# directory with write_gct and removed afterwards. The subsets are 978 rows picked by rid
+# ("landmarks"), the same rows and 100 columns, and 100 columns picked by cidx.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gct as parse_gct
+import cmapPy.pandasGEXpress.subset_gctoo as sg
+import cmapPy.pandasGEXpress.write_gct as write_gct
+
+n_rows = 12328
+n_cols = 2000
+n_landmarks = 978
+n_subset_cols = 100
+n_repeats = 3
+
+
+def previous_parse(file_path, **subset):
+    return sg.subset_gctoo(parse_gct.parse(file_path), **subset)
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    data_df = pd.DataFrame(np.random.randn(n_rows, n_cols).astype(np.float32),
+                           index=["rid_{}".format(i) for i in range(n_rows)],
+                           columns=["cid_{}".format(i) for i in range(n_cols)])
+    row_metadata_df = pd.DataFrame({"pr_gene_symbol": ["gene_{}".format(i) for i in range(n_rows)],
+                                    "pr_is_lm": np.arange(n_rows) < n_landmarks},
+                                   index=data_df.index)
+    col_metadata_df = pd.DataFrame({"pert_id": ["BRD-K{:08d}".format(i) for i in range(n_cols)],
+                                    "pert_idose": np.random.choice(["1 uM", "10 uM"], n_cols)},
+                                   index=data_df.columns)
+    test_file = "gct_subset_timing_test_n{}x{}.gct".format(n_cols, n_rows)
+    write_gct.write(GCToo.GCToo(data_df=data_df, row_metadata_df=row_metadata_df,
+                                col_metadata_df=col_metadata_df), test_file)
+
+    landmarks = list(np.random.choice(data_df.index, n_landmarks, replace=False))
+    cidx = sorted(np.random.choice(n_cols, n_subset_cols, replace=False).tolist())
+    subsets = {"rid_landmarks": {"rid": landmarks},
+               "rid_landmarks_cidx": {"rid": landmarks, "cidx": cidx},
+               "cidx": {"cidx": cidx}}
+    del data_df
+
+    results = {}
+    for (subset_name, subset) in subsets.items():
+        for (parser_name, parser) in [("full_parse_then_subset", previous_parse), ("pushdown", parse_gct.parse)]:
+            times = []
+            for _ in range(n_repeats):
+                start = time.time()
+                parser(test_file, **subset)
+                times.append(time.time() - start)
+            results[(subset_name, parser_name)] = {"seconds": min(times)}
+    os.remove(test_file)
+
+    # write results to file
+    results_df = pd.DataFrame(results).T
+    print(results_df)
+    results_df.to_csv("python_gct_subset_timing_results.txt", sep="\t")
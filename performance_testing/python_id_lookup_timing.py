@@ -0,0 +1,49 @@
+# Times parse_gctx.parse of a few columns, picked by cid, of a file with many columns: the time
+# to resolve the cids with the file's sorted id index and read only their metadata (and data)
+# should grow with the number of cids requested, not with the number of columns in the file.
+# A synthetic 10 x 1000000 GCTX (with three column metadata fields) is written to the working
+# directory with write_gctx and removed afterwards. Times are the best of n_repeats parses.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+
+n_rows = 10
+n_cols = 1000000
+n_cids_list = [1, 10, 1000, 10000]
+n_repeats = 3
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    cids = np.array(["cid_{}".format(i) for i in np.random.permutation(n_cols)], dtype=object)
+    data_df = pd.DataFrame(np.random.randn(n_rows, n_cols).astype(np.float32),
+                           index=["rid_{}".format(i) for i in range(n_rows)], columns=cids)
+    col_metadata_df = pd.DataFrame({"pert_id": ["BRD-K{:08d}".format(i % 20000) for i in range(n_cols)],
+                                    "pert_idose": np.random.choice(["1 uM", "10 uM"], n_cols),
+                                    "cell_id": np.random.choice(["A375", "MCF7", "PC3"], n_cols)},
+                                   index=cids)
+    test_file = "id_lookup_timing_test_n{}x{}.gctx".format(n_cols, n_rows)
+    write_gctx.write(GCToo.GCToo(data_df=data_df, col_metadata_df=col_metadata_df), test_file)
+    del data_df, col_metadata_df
+
+    results = {}
+    for n_cids in n_cids_list:
+        cid = list(np.random.choice(cids, n_cids, replace=False))
+        times = []
+        for _ in range(n_repeats):
+            start = time.time()
+            parse_gctx.parse(test_file, cid=cid)
+            times.append(time.time() - start)
+        results[n_cids] = {"seconds": min(times)}
+    os.remove(test_file)
+
+    # write results to file
+    results_df = pd.DataFrame(results).T
+    results_df.index.name = "n_cids"
+    print(results_df)
+    results_df.to_csv("python_id_lookup_timing_results.txt", sep="\t")
@@ -0,0 +1,78 @@
+# Compares writing GCTX column metadata with the previous per-element encoding (a list
+# comprehension of numpy.string_ for the ids, a DataFrame replace per field for nulls and a
+# Python walk over the index in check_fix_metadata) against write_gctx's vectorized encoding,
+# with fixed-length ASCII and with variable-length UTF-8 strings.
+# Synthetic metadata of 500000 columns x 24 fields (string fields with nulls, and numeric
+# fields) is written to files in the working directory, which are removed afterwards.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import h5py
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+
+n_cols = 500000
+n_string_fields = 16
+n_numeric_fields = 8
+gzip_compression = 6
+test_file = "metadata_encoding_test_n{}.gctx".format(n_cols)
+
+
+def previous_check_fix_metadata(metadata_df):
+    results = []
+    for generic_index in [metadata_df.columns, metadata_df.index]:
+        new_list = generic_index.to_list()
+        results.append(new_list)
+        for i, gnrc_indx in enumerate(new_list):
+            if "/" in gnrc_indx:
+                new_list[i] = gnrc_indx.replace("/", "|")
+    new_metadata_df = metadata_df.copy()
+    new_metadata_df.columns = results[0]
+    new_metadata_df.index = results[1]
+    return new_metadata_df
+
+
+def previous_write_metadata(hdf5_out, metadata_df):
+    hdf5_out.create_group(write_gctx.col_meta_group_node)
+    hdf5_out.create_dataset(write_gctx.col_meta_group_node + "/id",
+                            data=[np.string_(str(x)) for x in metadata_df.index],
+                            compression=gzip_compression, maxshape=(None,))
+    for c in list(metadata_df.columns):
+        metadata_df[[c]] = metadata_df[[c]].replace([np.nan], ["-666"])
+    for field in metadata_df.columns:
+        array_write = np.array(metadata_df.loc[:, field])
+        if array_write.dtype.type in (np.str_, np.object_):
+            array_write = array_write.astype("S")
+        hdf5_out.create_dataset(write_gctx.col_meta_group_node + "/" + field, data=array_write,
+                                compression=gzip_compression, maxshape=(None,))
+
+
+np.random.seed(0)
+col_meta = {}
+for i in range(n_string_fields):
+    values = np.array(["value_{}_{}".format(i, j) for j in np.random.randint(0, 5000, n_cols)], dtype=object)
+    values[np.random.rand(n_cols) < 0.05] = np.nan
+    col_meta["string_field_{}".format(i)] = values
+for i in range(n_numeric_fields):
+    col_meta["numeric_field_{}".format(i)] = np.random.randn(n_cols)
+col_metadata_df = pd.DataFrame(col_meta, index=["CPC{:06d}_A375_6H:BRD-K{:08d}:10".format(j, j) for j in range(n_cols)])
+
+timings = {}
+for name in ["previous", "vectorized_ascii", "vectorized_utf8"]:
+    hdf5_out = h5py.File(test_file, "w")
+    start = time.time()
+    if name == "previous":
+        previous_write_metadata(hdf5_out, previous_check_fix_metadata(col_metadata_df))
+    else:
+        write_gctx.write_metadata(hdf5_out, "col", write_gctx.check_fix_metadata(col_metadata_df), True,
+                                  gzip_compression, utf8=(name == "vectorized_utf8"))
+    timings[name] = time.time() - start
+    hdf5_out.close()
+    os.remove(test_file)
+
+# write results to file
+timings_df = pd.DataFrame({"seconds": pd.Series(timings)})
+timings_df["speedup"] = timings_df.loc["previous", "seconds"] / timings_df["seconds"]
+print(timings_df)
+timings_df.to_csv("python_metadata_encoding_results.txt", sep="\t")
@@ -0,0 +1,39 @@
+# Times full-file parse_gctx.parse of a synthetic 12328 x 10000 GCTX with 1 (in process) up to
+# 8 worker processes reading into shared memory. The file is written with write_gctx to the
+# working directory and removed afterwards. Cache was not cleared between operations.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+
+n_rows = 12328
+n_cols = 10000
+worker_counts = [1, 2, 4, 8]
+test_file = "parallel_parse_test_n{}x{}.gctx".format(n_cols, n_rows)
+
+np.random.seed(0)
+data_df = pd.DataFrame(np.random.randn(n_rows, n_cols).astype(np.float32),
+                       index=["rid_{}".format(i) for i in range(n_rows)],
+                       columns=["cid_{}".format(i) for i in range(n_cols)])
+write_gctx.write(GCToo.GCToo(data_df=data_df), test_file)
+
+parse_times = {}
+for workers in worker_counts:
+    start = time.time()
+    parsed = parse_gctx.parse(test_file, workers=workers)
+    parse_times[workers] = time.time() - start
+
+    assert np.array_equal(data_df.values, parsed.data_df.values)
+    del parsed
+os.remove(test_file)
+
+# write results to file
+parse_times_df = pd.DataFrame({"parse_time": pd.Series(parse_times)})
+parse_times_df["speedup"] = parse_times_df.loc[1, "parse_time"] / parse_times_df["parse_time"]
+parse_times_df.index.name = "workers"
+print(parse_times_df)
+parse_times_df.to_csv("python_parallel_parse_results.txt", sep="\t")
@@ -0,0 +1,36 @@
+# Times write_gctx.write of a synthetic 12328 x 4000 matrix with gzip + shuffle compression,
+# compressing chunks with HDF5's filter pipeline (workers=1) or in 2 to 8 threads. The file is
+# written to the working directory and removed after each write.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+
+n_rows = 12328
+n_cols = 4000
+worker_counts = [1, 2, 4, 8]
+test_file = "parallel_write_test_n{}x{}.gctx".format(n_cols, n_rows)
+
+np.random.seed(0)
+# limited precision, like real expression values, so that compression has something to do
+data_df = pd.DataFrame(np.round(np.random.randn(n_rows, n_cols), 2).astype(np.float32),
+                       index=["rid_{}".format(i) for i in range(n_rows)],
+                       columns=["cid_{}".format(i) for i in range(n_cols)])
+gctoo = GCToo.GCToo(data_df=data_df)
+
+write_times = {}
+for workers in worker_counts:
+    start = time.time()
+    write_gctx.write(gctoo, test_file, matrix_compression="gzip", shuffle=True, workers=workers)
+    write_times[workers] = time.time() - start
+    os.remove(test_file)
+
+# write results to file
+write_times_df = pd.DataFrame({"write_time": pd.Series(write_times)})
+write_times_df["speedup"] = write_times_df.loc[1, "write_time"] / write_times_df["write_time"]
+write_times_df.index.name = "workers"
+print(write_times_df)
+write_times_df.to_csv("python_parallel_write_results.txt", sep="\t")
@@ -0,0 +1,40 @@
+# Compares file size, parse time and round-trip error of a GCTX written as float32 against
+# one written with write_gctx.write(..., quantize=True) (int16 codes + scale / offset).
+# A synthetic 978 x 20000 z-score-like matrix (rounded to 4 decimals, as robust_zscore does)
+# is written to the working directory, both uncompressed and gzip-compressed, and removed afterwards.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+
+n_rows = 978
+n_cols = 20000
+
+np.random.seed(0)
+data_df = pd.DataFrame(np.round(np.clip(np.random.randn(n_rows, n_cols) * 2, -10, 10), 4).astype(np.float32),
+                       index=["r{}".format(i) for i in range(n_rows)],
+                       columns=["c{}".format(i) for i in range(n_cols)])
+gctoo = GCToo.GCToo(data_df=data_df)
+
+results = {}
+for compression in [None, "gzip"]:
+    for quantize in [False, True]:
+        name = "{}_{}".format("int16" if quantize else "float32", compression or "uncompressed")
+        test_file = "quantized_storage_test_{}.gctx".format(name)
+        write_gctx.write(gctoo, test_file, quantize=quantize, matrix_compression=compression)
+
+        start = time.time()
+        parsed_df = parse_gctx.parse(test_file).data_df
+        results[name] = {"size_mb": os.path.getsize(test_file) / 1e6,
+                         "parse_seconds": time.time() - start,
+                         "max_abs_error": float(np.abs(parsed_df.values - data_df.values).max())}
+        os.remove(test_file)
+
+# write results to file
+results_df = pd.DataFrame(results).transpose()
+print(results_df)
+results_df.to_csv("python_quantized_storage_results.txt", sep="\t")
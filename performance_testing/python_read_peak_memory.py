@@ -0,0 +1,54 @@
+# Measures the peak memory (tracemalloc, which tracks numpy allocations) of parse_gctx.parse
+# relative to the size of the data_df it returns, for a full read and for scattered row /
+# column subsets. A synthetic 12328 x 4000 GCTX is written with write_gctx to the working
+# directory and removed afterwards. A ratio of ~1 means no full-size intermediate copies.
+
+import os
+import tracemalloc
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+import cmapPy.pandasGEXpress.write_gctx as write_gctx
+
+n_rows = 12328
+n_cols = 4000
+n_landmarks = 978
+n_random_cols = 1000
+test_file = "peak_memory_test_n{}x{}.gctx".format(n_cols, n_rows)
+
+np.random.seed(0)
+data_df = pd.DataFrame(np.random.randn(n_rows, n_cols).astype(np.float32),
+                       index=["rid_{}".format(i) for i in range(n_rows)],
+                       columns=["cid_{}".format(i) for i in range(n_cols)])
+write_gctx.write(GCToo.GCToo(data_df=data_df), test_file)
+
+landmark_ridx = sorted(np.random.choice(n_rows, n_landmarks, replace=False))
+random_cidx = sorted(np.random.choice(n_cols, n_random_cols, replace=False))
+access_patterns = {
+    "full": {},
+    "random_cols": {"cidx": random_cidx},
+    "landmark_rows": {"ridx": landmark_ridx},
+    "landmark_rows_random_cols": {"ridx": landmark_ridx, "cidx": random_cidx}
+}
+
+# metadata is parsed (and memory measured) the same way for every pattern; parse it once
+# first so that one-off allocations such as imports are not counted
+parse_gctx.parse(test_file, ridx=[0], cidx=[0])
+
+peak_memory = {}
+for (name, subset_args) in access_patterns.items():
+    tracemalloc.start()
+    parsed = parse_gctx.parse(test_file, **subset_args)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    peak_memory[name] = {"data_df_mb": parsed.data_df.values.nbytes / 1e6, "peak_mb": peak / 1e6}
+    del parsed
+os.remove(test_file)
+
+# write results to file
+peak_memory_df = pd.DataFrame(peak_memory).T
+peak_memory_df["peak_over_data_df"] = peak_memory_df["peak_mb"] / peak_memory_df["data_df_mb"]
+print(peak_memory_df)
+peak_memory_df.to_csv("python_read_peak_memory_results.txt", sep="\t")
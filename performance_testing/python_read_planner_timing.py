@@ -0,0 +1,66 @@
+# Compares reading scattered row/column subsets of a GCTX with h5py point selections (the
+# approach parse_gctx used to take) against parse_gctx's chunk-aware read planner.
+# A synthetic 12328 x 20000 matrix is written to the working directory, chunked the way
+# cmapM / cmapR chunk their output, and removed afterwards.
+# Access patterns: random columns (all rows), landmark-like scattered rows (all columns),
+# and random columns restricted to those rows. Cache was not cleared between operations.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import h5py
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+
+n_rows = 12328
+n_cols = 20000
+n_landmarks = 978
+n_random_cols = 1000
+chunk_shape = (268, 978)  # (cids, rids) as stored on disk
+test_file = "read_planner_test_n{}x{}.gctx".format(n_cols, n_rows)
+
+
+def point_selection_read(data_dset, ridx, cidx):
+    # pre-planner parse_gctx.parse_data_df: fancy-index one axis, slice the other in memory
+    if len(cidx) * n_rows > len(ridx) * n_cols:
+        return data_dset[:, ridx].astype(np.float32)[cidx, :].transpose()
+    return data_dset[cidx, :].astype(np.float32)[:, ridx].transpose()
+
+
+np.random.seed(0)
+f = h5py.File(test_file, "w")
+f.create_dataset(parse_gctx.data_node, data=np.random.randn(n_cols, n_rows).astype(np.float32),
+                 chunks=chunk_shape)
+f.close()
+
+all_ridx = list(range(n_rows))
+all_cidx = list(range(n_cols))
+landmark_ridx = sorted(np.random.choice(n_rows, n_landmarks, replace=False))
+random_cidx = sorted(np.random.choice(n_cols, n_random_cols, replace=False))
+access_patterns = {
+    "random_cols": (all_ridx, random_cidx),
+    "landmark_rows": (landmark_ridx, all_cidx),
+    "landmark_rows_random_cols": (landmark_ridx, random_cidx)
+}
+
+read_times = {}
+f = h5py.File(test_file, "r")
+data_dset = f[parse_gctx.data_node]
+for (name, (ridx, cidx)) in access_patterns.items():
+    start = time.time()
+    expected = point_selection_read(data_dset, ridx, cidx)
+    read_times[(name, "point_selection")] = time.time() - start
+
+    start = time.time()
+    planned = parse_gctx.read_data_array(data_dset, ridx, cidx)
+    read_times[(name, "read_planner")] = time.time() - start
+
+    assert np.array_equal(expected, planned)
+f.close()
+os.remove(test_file)
+
+# write results to file
+read_times_df = pd.Series(read_times).unstack()
+read_times_df["speedup"] = read_times_df["point_selection"] / read_times_df["read_planner"]
+print(read_times_df)
+read_times_df.to_csv("python_read_planner_results.txt", sep="\t")
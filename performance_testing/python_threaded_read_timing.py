@@ -0,0 +1,48 @@
+# Times full reads of a gzip + shuffle compressed GCTX matrix with parse_gctx.read_data_array,
+# decompressing chunks in 1 (HDF5's own filter pipeline) up to 8 threads.
+# A synthetic 12328 x 20000 matrix is written to the working directory, chunked the way
+# cmapM / cmapR chunk their output, and removed afterwards.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import h5py
+import cmapPy.pandasGEXpress.parse_gctx as parse_gctx
+
+n_rows = 12328
+n_cols = 20000
+chunk_shape = (268, 978)  # (cids, rids) as stored on disk
+thread_counts = [1, 2, 4, 8]
+test_file = "threaded_read_test_n{}x{}.gctx".format(n_cols, n_rows)
+
+np.random.seed(0)
+f = h5py.File(test_file, "w")
+f.create_dataset(parse_gctx.data_node, data=np.random.randn(n_cols, n_rows).astype(np.float32),
+                 chunks=chunk_shape, compression="gzip", compression_opts=6, shuffle=True)
+f.close()
+
+all_ridx = list(range(n_rows))
+all_cidx = list(range(n_cols))
+
+read_times = {}
+f = h5py.File(test_file, "r")
+data_dset = f[parse_gctx.data_node]
+expected = None
+for num_threads in thread_counts:
+    start = time.time()
+    data_array = parse_gctx.read_data_array(data_dset, all_ridx, all_cidx, num_threads=num_threads)
+    read_times[num_threads] = time.time() - start
+
+    if expected is None:
+        expected = data_array
+    assert np.array_equal(expected, data_array)
+f.close()
+os.remove(test_file)
+
+# write results to file
+read_times_df = pd.DataFrame({"read_time": pd.Series(read_times)})
+read_times_df["speedup"] = read_times_df.loc[1, "read_time"] / read_times_df["read_time"]
+read_times_df.index.name = "num_threads"
+print(read_times_df)
+read_times_df.to_csv("python_threaded_read_results.txt", sep="\t")
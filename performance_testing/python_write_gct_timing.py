@@ -0,0 +1,66 @@
+# Compares the time of writing a GCT with the previous write_bottom_half (the whole bottom half as an
+# object DataFrame written with to_csv(float_format="%.4f"), which formats the floats one at a time)
+# against write_gct.write, which formats blocks of rows vectorized; also with gzip output and with
+# 2 worker processes. A synthetic 2000 x 20000 GCT (with row and column metadata) is written to
+# the working directory and removed afterwards.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import cmapPy.pandasGEXpress.GCToo as GCToo
+import cmapPy.pandasGEXpress.write_gct as write_gct
+
+n_rows = 2000
+n_cols = 20000
+
+
+def previous_write(gctoo, out_fname, data_null="NaN", metadata_null="-666", filler_null="-666",
+                   data_float_format="%.4f"):
+    f = open(out_fname, "w")
+    dims = [str(gctoo.data_df.shape[0]), str(gctoo.data_df.shape[1]),
+            str(gctoo.row_metadata_df.shape[1]), str(gctoo.col_metadata_df.shape[1])]
+    write_gct.write_version_and_dims(write_gct.VERSION, dims, f)
+    write_gct.write_top_half(f, gctoo.row_metadata_df, gctoo.col_metadata_df, metadata_null, filler_null)
+
+    row_metadata_df = gctoo.row_metadata_df
+    left_bottom_half_df = pd.DataFrame(np.full((row_metadata_df.shape[0], 1 + row_metadata_df.shape[1]),
+                                               metadata_null, dtype=object))
+    bottom_half_df = pd.concat([left_bottom_half_df, gctoo.data_df.reset_index(drop=True)], axis=1)
+    bottom_half_df.columns = range(bottom_half_df.shape[1])
+    bottom_half_df.iloc[:, 0] = row_metadata_df.index.values
+    bottom_half_df.iloc[:, range(1, 1 + row_metadata_df.shape[1])] = (
+        row_metadata_df.astype(str).replace("nan", value=metadata_null).values)
+    bottom_half_df.to_csv(f, header=False, index=False, sep="\t", na_rep=data_null, float_format=data_float_format)
+    f.close()
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    data_df = pd.DataFrame(np.random.randn(n_rows, n_cols).astype(np.float32),
+                           index=["rid_{}".format(i) for i in range(n_rows)],
+                           columns=["cid_{}".format(i) for i in range(n_cols)])
+    data_df.iloc[::7, ::11] = np.nan
+    row_metadata_df = pd.DataFrame({"pr_gene_symbol": ["gene_{}".format(i) for i in range(n_rows)]},
+                                   index=data_df.index)
+    col_metadata_df = pd.DataFrame({"pert_id": ["BRD-K{:08d}".format(i) for i in range(n_cols)],
+                                    "pert_idose": np.random.choice(["1 uM", "10 uM"], n_cols)},
+                                   index=data_df.columns)
+    gctoo = GCToo.GCToo(data_df=data_df, row_metadata_df=row_metadata_df, col_metadata_df=col_metadata_df)
+    out_fname = "write_gct_timing_test_n{}x{}.gct".format(n_cols, n_rows)
+
+    writers = [("previous", lambda: previous_write(gctoo, out_fname), out_fname),
+               ("vectorized", lambda: write_gct.write(gctoo, out_fname), out_fname),
+               ("vectorized_2_workers", lambda: write_gct.write(gctoo, out_fname, workers=2), out_fname),
+               ("vectorized_gzip", lambda: write_gct.write(gctoo, out_fname, gzip_output=True), out_fname + ".gz")]
+    results = {}
+    for (writer_name, writer, written_fname) in writers:
+        start = time.time()
+        writer()
+        results[writer_name] = {"seconds": time.time() - start, "file_mb": os.path.getsize(written_fname) / 1e6}
+        os.remove(written_fname)
+
+    # write results to file
+    results_df = pd.DataFrame(results).T
+    print(results_df)
+    results_df.to_csv("python_write_gct_timing_results.txt", sep="\t")